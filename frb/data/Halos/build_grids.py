@@ -1,4 +1,4 @@
-from frb.halos import build_grid
+from frb.halos.hmf import build_grid
 
 # Command line execution
 if __name__ == '__main__':
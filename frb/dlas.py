@@ -12,7 +12,7 @@ from scipy.interpolate import interp1d
 from astropy import units as u
 
 from frb.io import load_dla_fits
-from frb.turb_scattering import Turbulence
+from frb.turb_scattering import Turbulence, _angular_diameter_distances
 from frb import defs
 
 
@@ -85,7 +85,7 @@ def approx_avgDM(zeval, dla_model='atan', verbose=False):
     return (DM_values / u.cm**2).to('pc/cm**3')
 
 
-def monte_DM(zeval, model='atan', nrand=100, verbose=False):
+def monte_DM(zeval, model='atan', nrand=100, verbose=False, seed=None):
     """
     Parameters
     ----------
@@ -95,6 +95,7 @@ def monte_DM(zeval, model='atan', nrand=100, verbose=False):
     nrand : int, optional
       Number of samples on NHI
     verbose : bool, optional
+    seed : int or np.random.Generator, optional
 
     Returns
     -------
@@ -104,59 +105,21 @@ def monte_DM(zeval, model='atan', nrand=100, verbose=False):
 
     """
     # Convert to array
-    if isinstance(zeval, float):
-        zeval = np.array([zeval])
+    zeval = np.atleast_1d(np.asarray(zeval, dtype=float))
     # Init
     dla_fits = load_dla_fits()
     nenH_param = dla_fits['nenH']['loglog']
-    mlz = _model_lz(model)
-    lgNmax = np.linspace(20.3, 22., 10000)
-    intfN = _int_dbl_pow(dla_fits['fN']['dpow'], lgNmax=lgNmax)
-
-    # Interpolate (cubic is *very* slow)
-    interp_fN = interp1d(intfN/intfN[-1], lgNmax)
 
-    # l(z) model
-    # Evaluate l(z) in small z intervals
-    zmax = np.max(zeval)
-    z = np.linspace(0., zmax, 50000)
-    dz = np.median(z-np.roll(z,1))
-    lz = mlz['eval'](z, param=mlz['param'])
-    # Setup for n(z) and drawing zdla
-    nzc = np.cumsum(lz*dz)  # Note nzc[0] is not 0
-    avgz = np.cumsum(z*lz*dz) / nzc
-    interp_avgz = interp1d(z, avgz)
-    nzc[0] = 0.
-    interp_nz = interp1d(z, nzc)
-    interp_revnz = interp1d((nzc-nzc[0])/nzc[-1], z)  # Accurate to ~1%
-    #
+    # Draw all of the DLAs at once
     rand_DM = np.zeros((nrand, zeval.size))
-    nz = interp_nz(zeval)
-    for kk,inz in enumerate(nz):
-        # Random number of DLAs
-        rn = np.random.poisson(inz, size=nrand)
-        ndla = np.sum(rn)
-        if ndla == 0:
-            continue
-        # Draw NHI
-        rval = np.random.uniform(size=ndla)
-        rNHI = interp_fN(rval)
+    for rows, cell, rNHI, zdla in _draw_dlas(zeval, nrand, model=model, seed=seed):
         # nenH
         nenH = nenH_param['bp'] + nenH_param['m'] * (rNHI-20.3)
-        # Draw zdla
-        rval2 = np.random.uniform(size=ndla)
-        zdla = interp_revnz(rval2*inz/nzc[-1])
         # DM values
         DMi = 10.**(rNHI + nenH) / (1+zdla)
-        # Generate a dummy array
-        DMarr = np.zeros((nrand, max(rn)))
-        cnt = 0
-        for jj in range(nrand): # Fill
-            if rn[jj] > 0:
-                DMarr[jj,:rn[jj]] = DMi[cnt:cnt+rn[jj]]
-                cnt += rn[jj]
-        # Fill em up
-        rand_DM[:,kk] = np.sum(DMarr,axis=1)
+        # Sum the DLAs of each trial and redshift
+        rand_DM[rows] = np.bincount(cell, weights=DMi,
+                                    minlength=(rows.stop-rows.start)*zeval.size).reshape(-1, zeval.size)
 
     # Return
     unit_conv = (1/u.cm**2).to('pc/cm**3').value
@@ -164,7 +127,7 @@ def monte_DM(zeval, model='atan', nrand=100, verbose=False):
 
 
 def monte_tau(zeval, nrand=100, nHI=0.1, avg_ne=-2.6,
-              sigma_ne=0.5, cosmo=None, lobs=50*u.cm, turb=None):
+              sigma_ne=0.5, cosmo=None, lobs=50*u.cm, turb=None, model='atan', seed=None):
     """ Generate random draws of tau at a series of redshifts
 
     Parameters
@@ -185,6 +148,9 @@ def monte_tau(zeval, nrand=100, nHI=0.1, avg_ne=-2.6,
       Usually defined internally and that is the highly recommended approach
     cosmo : astropy.cosmology, optional
       Defaults to defs.frb_cosmo
+    model : str, optional
+      l(z) model
+    seed : int or np.random.Generator, optional
 
     Returns
     -------
@@ -192,20 +158,10 @@ def monte_tau(zeval, nrand=100, nHI=0.1, avg_ne=-2.6,
       Random tau values reported in ms (but without explicit astropy Units)
     """
     # Init
+    zeval = np.atleast_1d(np.asarray(zeval, dtype=float))
     ne_param = dict(value=avg_ne, sigma=sigma_ne)  # Neeleman+15
-    dla_fits = load_dla_fits()
     if cosmo is None:
         cosmo = defs.frb_cosmo
-    # Setup NHI
-    lgNmax = np.linspace(20.3, 22., 10000)
-    intfN = _int_dbl_pow(dla_fits['fN']['dpow'], lgNmax=lgNmax)
-    # Spline
-    interp_fN = interp1d(intfN/intfN[-1], lgNmax)#, kind='cubic')
-
-    # Setup z
-    zvals = np.linspace(0., 7., 10000)
-    nz_s = _dla_nz(zvals)
-    nz_s[0] = 0.
 
     # Turbulence
     if turb is None:
@@ -213,55 +169,109 @@ def monte_tau(zeval, nrand=100, nHI=0.1, avg_ne=-2.6,
     f_ne=turb.ne
     zsource = 2.
     turb.set_rdiff(lobs)
-    fiducial_tau = turb.temporal_smearing(lobs, zsource)
+    fiducial_tau = turb.temporal_smearing(lobs, zsource, cosmo=cosmo)
     # Take out the cosmology
     f_D_S = cosmo.angular_diameter_distance(zsource)
     f_D_L = cosmo.angular_diameter_distance(turb.zL)
     f_D_LS = cosmo.angular_diameter_distance_z1z2(turb.zL, zsource)
-    fiducial_tau = fiducial_tau / f_D_LS / f_D_L * f_D_S * (1+turb.zL)**3  # ms/Mpc
-    kpc_cm = (1*u.kpc).to('cm').value
+    fiducial_tau = (fiducial_tau / f_D_LS / f_D_L * f_D_S * (1+turb.zL)**3).to('ms/Mpc').value
+    f_ne = f_ne.to('cm**-3').value
 
+    rng = np.random.default_rng(seed)
     rand_tau = np.zeros((nrand, zeval.size))
-    # Loop on zeval
-    for ss,izeval in enumerate(zeval):
-        avg_nz = _dla_nz(izeval)
-        rn = np.random.poisson(avg_nz, size=nrand)
-        ndla = np.sum(rn)
-        if ndla == 0:
-            continue
-        # Get random NHI
-        rval = np.random.uniform(size=ndla)
-        rNHI = interp_fN(rval)
-        DL = 10.**rNHI / nHI / kpc_cm
-        # Get random z
-        imin = np.argmin(np.abs(zvals-izeval))
-        interp_z = interp1d(nz_s[0:imin]/nz_s[imin-1], zvals[0:imin])#, kind='cubic')
-        rval = np.random.uniform(size=ndla)
-        rz = interp_z(rval)
+    for rows, cell, rNHI, rz in _draw_dlas(zeval, nrand, model=model, seed=rng):
         # Cosmology
-        D_S = cosmo.angular_diameter_distance(izeval)
-        D_L = cosmo.angular_diameter_distance(rz)
-        D_LS = cosmo.angular_diameter_distance_z1z2(rz, izeval)
+        D_L, D_S, D_LS = _angular_diameter_distances(rz, zeval[cell % zeval.size], cosmo=cosmo)
+        D_term = (D_LS * D_L / D_S).to('Mpc').value
         # Get random n_e
-        rne = 10.**(ne_param['value'] + ne_param['sigma']*np.random.normal(size=ndla))
+        rne = 10.**(ne_param['value'] + ne_param['sigma']*rng.normal(size=rz.size))
         # Calculate (scale)
-        rtau = fiducial_tau * (D_LS * D_L / D_S) * (rne/f_ne.to('cm**-3').value)**2 / (1+rz)**3
-        # Generate, fill
-        taus = np.zeros((nrand, np.max(rn)))
-        kk = 0
-        for jj,irn in enumerate(rn):
-            if irn > 0:
-                taus[jj,0:irn] = rtau[kk:kk+irn]
-                kk += irn
+        rtau = fiducial_tau * D_term * (rne/f_ne)**2 / (1+rz)**3
         # Finish -- add in quadrature
-        final_tau = np.sqrt(np.sum(taus**2, axis=1))
-        # Save
-        rand_tau[:,ss] = final_tau
+        rand_tau[rows] = np.sqrt(np.bincount(cell, weights=rtau**2,
+                                             minlength=(rows.stop-rows.start)*zeval.size)).reshape(-1, zeval.size)
 
     # Return
     return rand_tau
 
 
+# Inverse CDFs of f(N) and n(z), by (model, zmax)
+_dla_samplers = {}
+
+
+def _dla_sampler(model='atan', zmax=5.):
+    """ Tabulated inverse CDFs for drawing DLAs
+
+    Cached for each (model, zmax)
+
+    Parameters
+    ----------
+    model : str, optional
+      l(z) model
+    zmax : float, optional
+      Maximum redshift of the n(z) table
+
+    Returns
+    -------
+    sampler : dict
+      CDF_N, lgN : Cumulative f(N) and log10 NHI
+      nz, z : Cumulative number of DLAs n(<z) and z
+    """
+    key = (model, float(zmax))
+    if key not in _dla_samplers:
+        dla_fits = load_dla_fits()
+        lgNmax = np.linspace(20.3, 22., 10000)
+        intfN = _int_dbl_pow(dla_fits['fN']['dpow'], lgNmax=lgNmax)
+        # l(z) in small z intervals
+        mlz = _model_lz(model)
+        z = np.linspace(0., zmax, 50000)
+        dz = np.median(z-np.roll(z,1))
+        lz = mlz['eval'](z, param=mlz['param'])
+        nzc = np.cumsum(lz*dz)
+        nzc[0] = 0.
+        _dla_samplers[key] = dict(CDF_N=intfN/intfN[-1], lgN=lgNmax, nz=nzc, z=z)
+    return _dla_samplers[key]
+
+
+def _draw_dlas(zeval, nrand, model='atan', seed=None, chunk_size=2**20):
+    """ Draw the DLAs intersected by nrand sightlines to each redshift
+
+    Parameters
+    ----------
+    zeval : ndarray
+      Redshifts of the sources
+    nrand : int
+      Number of trials
+    model : str, optional
+      l(z) model
+    seed : int or np.random.Generator, optional
+    chunk_size : int, optional
+      Maximum number of (trial, redshift) cells per chunk
+
+    Returns
+    -------
+    generator of (rows, cell, rNHI, zdla) : slice, ndarray, ndarray, ndarray
+      For each chunk of trials, the flattened (trial, redshift) cell
+      of each DLA, relative to the chunk, and its log10 NHI and redshift
+    """
+    rng = np.random.default_rng(seed)
+    # Tables are shared by redshifts up to the next 0.1
+    sampler = _dla_sampler(model, zmax=max(np.ceil(np.max(zeval)*10)/10, 0.1))
+    # Average number of DLAs to each redshift
+    nz = np.interp(zeval, sampler['z'], sampler['nz'])
+    ntrial = max(1, chunk_size // zeval.size)
+    for start in range(0, nrand, ntrial):
+        rows = slice(start, min(start+ntrial, nrand))
+        # Random number of DLAs
+        rn = rng.poisson(nz, size=(rows.stop-rows.start, zeval.size)).ravel()
+        cell = np.repeat(np.arange(rn.size), rn)
+        # Draw NHI
+        rNHI = np.interp(rng.uniform(size=cell.size), sampler['CDF_N'], sampler['lgN'])
+        # Draw zdla, uniformly in n(z) up to the source
+        zdla = np.interp(rng.uniform(size=cell.size)*nz[cell % zeval.size], sampler['nz'], sampler['z'])
+        yield rows, cell, rNHI, zdla
+
+
 def _avgN_dbl_pow(lgNmin=20.3, dla_fits=None):
     """  Calculate <NHI> for the double power-law
 
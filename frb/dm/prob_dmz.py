@@ -1,6 +1,7 @@
 """ Code for calculations of P(DM|z) and P(z|DM)"""
 import numpy as np
 import os
+import multiprocessing
 
 
 from importlib.resources import files
@@ -11,6 +12,7 @@ from scipy.interpolate import interp1d, interp2d
 from frb.dm import igm
 from frb.dm import cosmic
 from frb import defs
+from frb import io as frb_io
 
 from IPython import embed
 
@@ -28,6 +30,10 @@ telescope_dict = {
     'perfect': 'PDM_z.npz'
 }
 
+# Version of the P(DM_cosmic|z) grid generation.  Bump this when the
+#  algorithm changes so that cached grids are regenerated
+PDMZ_GRID_VERSION = 1
+
 class P_DM_z(object):
     pass
 
@@ -90,15 +96,64 @@ def prob_DMcosmic_FRB(frb, DM_min=0., DM_max=5000., step=1.,
     return DMcosmics, P_DM_cosmic
 
 
+def _PDF_columns(zvals, DM_cosmics, avgDMs, F, beta=3.):
+    """
+    Evaluate normalized P(DM_cosmic|z) for a set of redshifts in one pass
+
+    Args:
+        zvals (np.ndarray): Redshifts
+        DM_cosmics (np.ndarray): DMs for the grid
+        avgDMs (np.ndarray): Average DM_cosmic at zvals
+        F (float): Feedback parameter
+        beta (float, optional): sigma_DM_cosmic parameter
+
+    Returns:
+        np.ndarray: P(DM_cosmic|z) with shape (zvals.size, DM_cosmics.size)
+    """
+    f_C0 = cosmic.grab_C0_spline(beta=beta)
+
+    PDF = np.zeros((zvals.size, DM_cosmics.size))
+    # z=0
+    zero = zvals == 0.
+    PDF[zero, 0] = 1.
+    gdz = ~zero
+    if not np.any(gdz):
+        return PDF
+
+    # Params
+    sigma = F / np.sqrt(zvals[gdz])
+    C0 = f_C0(sigma)
+    #  Delta
+    Delta = DM_cosmics[None,:] / avgDMs[gdz][:,None]
+    # PDF time
+    sub_PDF = cosmic.DMcosmic_PDF(Delta, C0[:,None], sigma[:,None], beta=beta)
+    # Normalize
+    PDF[gdz] = sub_PDF / np.sum(sub_PDF, axis=1)[:,None]
+    return PDF
+
+
+def _PDF_columns_star(args):
+    """ Unpack the arguments of _PDF_columns for Pool.map """
+    return _PDF_columns(*args)
+
+
 def grid_P_DMcosmic_z(beta=3., F=0.31, zvals=None, 
                       DM_cosmics=None,
-                      cosmo=defs.frb_cosmo):
+                      cosmo=defs.frb_cosmo,
+                      chunk_size:int=None, n_cores:int=1,
+                      max_bytes:int=2**28):
     """
     Generate a grid of P(DM_cosmic|z)
 
+    The PDF is evaluated for many redshifts at once with
+    NumPy broadcasting.  The redshifts are split into chunks
+    so that the working arrays do not exceed max_bytes, and the
+    chunks may be distributed over a pool of processes.
+
     Args:
         beta (float, optional):
-            sigma_DM_cosmic parameter
+            sigma_DM_cosmic parameter.  Values other than 3 are
+            taken from the C0 table;  see cosmic.grab_C0_spline()
         F (float, optional):
             Feedback parameter (higher F means weaker feedback)
         zvals (np.ndarray, optional):
@@ -107,59 +162,142 @@ def grid_P_DMcosmic_z(beta=3., F=0.31, zvals=None,
             DMs for the grid
         cosmo (optional):
             Cosmology
+        chunk_size (int, optional):
+            Number of redshifts evaluated per chunk.
+            Default is set by max_bytes
+        n_cores (int, optional):
+            Number of processes to evaluate the chunks with
+        max_bytes (int, optional):
+            Approximate memory budget for the working arrays of one chunk
 
     Returns:
         tuple: z, DM_cosmic, P(DM_cosmic|z)
     """
-    # Check
-    if not np.isclose(beta, 3.):
-        raise IOError("Not prepared for this beta value (yet)")
-    # Load
-    # sigma_DM
-    f_C0_3 = cosmic.grab_C0_spline()
-
     # Grid
     if zvals is None:
         zvals = np.linspace(0., 2., 200)
     if DM_cosmics is None:
         DM_cosmics = np.linspace(1., 5000., 1000)
+    zvals = np.atleast_1d(zvals)
+
+    # Macquart relation (integrated once)
+    mrel = igm.MacquartRelation(cosmo=cosmo, zmax=max(5., np.max(zvals)))
+    avgDMs = mrel(zvals).value
+
+    # Chunks -- allow for ~4 temporary arrays per evaluation
+    if chunk_size is None:
+        chunk_size = max(1, int(max_bytes // (4 * 8 * DM_cosmics.size)))
+    chunks = [(zvals[i0:i0+chunk_size], DM_cosmics, avgDMs[i0:i0+chunk_size], F, beta)
+              for i0 in range(0, zvals.size, chunk_size)]
+
+    # Evaluate
+    if n_cores > 1 and len(chunks) > 1:
+        # spawn avoids forking a process with live numba threads
+        with multiprocessing.get_context('spawn').Pool(min(n_cores, len(chunks))) as p:
+            PDFs = p.map(_PDF_columns_star, chunks)
+    else:
+        PDFs = [_PDF_columns(*chunk) for chunk in chunks]
 
-    PDF_grid = np.zeros((DM_cosmics.size, zvals.size))
-
-    # Loop
-    for kk, zval in enumerate(zvals):
-        # z=0
-        if zval == 0:
-            PDF_grid[0,0] = 1.
-            continue
-        avgDM = igm.average_DM(zval, cosmo=cosmo).value
-        # Params
-        sigma = F / np.sqrt(zval)
-        C0 = f_C0_3(sigma)
-        #  Delta
-        Delta = DM_cosmics / avgDM
-        # PDF time
-        PDF = cosmic.DMcosmic_PDF(Delta, C0, sigma)
-        # Normalize
-        PDF_grid[:,kk] = PDF / np.sum(PDF)
+    # Fill the (DM, z) grid
+    PDF_grid = np.concatenate(PDFs, axis=0).T.copy()
 
     # Return
     return zvals, DM_cosmics, PDF_grid
 
 
-def build_grid_for_repo(outfile:str):
+def grid_cache_path(beta=3., F=0.31, zvals=None, DM_cosmics=None,
+                    cosmo=defs.frb_cosmo, cache_dir=None):
+    """
+    Path in the user cache for a P(DM_cosmic|z) grid
+
+    The directory name is a hash of all of the parameters
+    that generate the grid (and PDMZ_GRID_VERSION).
+
+    Args:
+        beta (float, optional):
+            sigma_DM_cosmic parameter
+        F (float, optional):
+            Feedback parameter
+        zvals (np.ndarray, optional):
+            Redshifts for the grid
+        DM_cosmics (np.ndarray, optional):
+            DMs for the grid
+        cosmo (optional):
+            Cosmology
+        cache_dir (str, optional):
+            Cache directory.  Default is frb.io.user_cache_dir('PDM_z')
+
+    Returns:
+        str: Path of the cached grid (may not exist yet)
+    """
+    if zvals is None:
+        zvals = np.linspace(0., 2., 200)
+    if DM_cosmics is None:
+        DM_cosmics = np.linspace(1., 5000., 1000)
+    if cache_dir is None:
+        cache_dir = frb_io.user_cache_dir('PDM_z')
+    # Cosmology objects are not hashable;  their repr holds all parameters
+    key = frb_io.hash_params(dict(beta=float(beta), F=float(F),
+                                  zvals=np.asarray(zvals), DM_cosmics=np.asarray(DM_cosmics),
+                                  cosmo=repr(cosmo), version=PDMZ_GRID_VERSION))
+    return os.path.join(cache_dir, key)
+
+
+def cached_grid_P_DMcosmic_z(beta=3., F=0.31, zvals=None, DM_cosmics=None,
+                             cosmo=defs.frb_cosmo, cache_dir=None,
+                             n_cores:int=1):
+    """
+    Grab a P(DM_cosmic|z) grid from the user cache, generating it
+    with grid_P_DMcosmic_z() on a miss
+
+    The arrays are written atomically so that concurrent
+    processes may share the cache, and are read back memory-mapped.
+
+    Args:
+        beta (float, optional):
+            sigma_DM_cosmic parameter
+        F (float, optional):
+            Feedback parameter
+        zvals (np.ndarray, optional):
+            Redshifts for the grid
+        DM_cosmics (np.ndarray, optional):
+            DMs for the grid
+        cosmo (optional):
+            Cosmology
+        cache_dir (str, optional):
+            Cache directory.  Default is frb.io.user_cache_dir('PDM_z')
+        n_cores (int, optional):
+            Number of processes used if the grid is generated
+
+    Returns:
+        dict: z, DM, PDM_z arrays (read-only, memory-mapped)
+    """
+    grid_path = grid_cache_path(beta=beta, F=F, zvals=zvals, DM_cosmics=DM_cosmics,
+                                cosmo=cosmo, cache_dir=cache_dir)
+    if not os.path.isdir(grid_path):
+        z, DM, PDM_z = grid_P_DMcosmic_z(beta=beta, F=F, zvals=zvals,
+                                         DM_cosmics=DM_cosmics, cosmo=cosmo,
+                                         n_cores=n_cores)
+        meta = dict(beta=float(beta), F=float(F), cosmo=repr(cosmo),
+                    version=PDMZ_GRID_VERSION)
+        frb_io.save_npy_dir(grid_path, dict(z=z, DM=DM, PDM_z=PDM_z), meta=meta)
+    # Load
+    return frb_io.load_npy_dir(grid_path, mmap_mode='r')
+
+
+def build_grid_for_repo(outfile:str, n_cores:int=1):
     """
     Build a P(DM,z) grid for the Repository
 
     Args:
         outfile (str): Path+filename for output file
+        n_cores (int, optional): Number of processes for the grid evaluation
     """
 
     print("Generating a new PDM_z grid for the Repo")
-    print("Please be patient (will take a few minutes)....")
     #
     zvals = np.linspace(0., 4., 200)
-    z, DM, P_DM_z = grid_P_DMcosmic_z(zvals=zvals)
+    z, DM, P_DM_z = grid_P_DMcosmic_z(zvals=zvals, n_cores=n_cores)
     # Write
     np.savez(outfile, z=z, DM=DM, PDM_z=P_DM_z)
     print(f"File written: {outfile}")
@@ -171,6 +309,9 @@ def grab_repo_grid(grid_name):
     """
     Grab the grid from the Repository based on the given grid name
 
+    If the 'perfect' grid (PDM_z.npz) is not in the Repository,
+    it is taken from (or generated into) the user cache instead.
+
     Args:
         grid_name (str): Name of the grid to grab
 
@@ -181,10 +322,11 @@ def grab_repo_grid(grid_name):
     # File
     grid_file = files('frb.data.DM').joinpath( grid_name)
     
-    # Build?
+    # Use the cache?
     if grid_name == 'PDM_z.npz':
         if not os.path.isfile(grid_file):
-            build_grid_for_repo(grid_file)
+            print("Grabbing the PDM_z grid from the user cache")
+            return cached_grid_P_DMcosmic_z(zvals=np.linspace(0., 4., 200))
 
     # Load
     print(f"Loading P(DM,z) grid from {grid_file}")
@@ -195,6 +337,150 @@ def grab_repo_grid(grid_name):
 
 
 
+class PzDMGrid(object):
+    """
+    Lazily loaded, memory-mapped access to a telescope p(z|DM) grid
+
+    On first use the npz grid is converted into uncompressed .npy files
+    in the user cache with one contiguous row of p(z) per DM, i.e.
+    column-major in the (z, DM) layout of the telescope grids.
+    Later accesses memory-map the cached copy and only touch the
+    rows that are requested.
+
+    Args:
+        telescope (str, optional): Key in telescope_dict
+        cache_dir (str, optional): Cache directory.
+            Default is frb.io.user_cache_dir('PzDM')
+
+    Attributes:
+        z (np.ndarray): Redshifts of the grid
+        DM (np.ndarray): DMs of the grid.  These are DM_cosmic for
+            the perfect telescope and DM_extragalactic otherwise
+    """
+    def __init__(self, telescope='perfect', cache_dir=None):
+        if telescope not in telescope_dict:
+            raise IOError(f"Not ready for telescope={telescope}")
+        self.telescope = telescope
+        self.grid_name = telescope_dict[telescope]
+        self.cache_dir = cache_dir
+        self._grid = None
+
+    @property
+    def grid(self):
+        """ dict of memory-mapped arrays;  loaded on first access """
+        if self._grid is None:
+            self._grid = self._load()
+        return self._grid
+
+    @property
+    def z(self):
+        return self.grid['z']
+
+    @property
+    def DM(self):
+        return self.grid['DM']
+
+    def _load(self):
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            cache_dir = frb_io.user_cache_dir('PzDM')
+        grid_file = str(files('frb.data.DM').joinpath(self.grid_name))
+        if os.path.isfile(grid_file):
+            stat = os.stat(grid_file)
+            key = frb_io.hash_params(dict(grid_file=grid_file, size=stat.st_size,
+                                          mtime=stat.st_mtime))
+        else:
+            # The perfect grid may only exist in the user cache
+            key = frb_io.hash_params(dict(grid_file=grid_file))
+        grid_path = os.path.join(cache_dir, f'{self.telescope}_{key}')
+        if not os.path.isdir(grid_path):
+            sdict = grab_repo_grid(self.grid_name)
+            if self.telescope == 'perfect':
+                # (DM, z) already
+                pzdm = np.ascontiguousarray(sdict['PDM_z'])
+            else:
+                # (z, DM) -> (DM, z)
+                pzdm = np.ascontiguousarray(np.asarray(sdict['pzdm']).T)
+            frb_io.save_npy_dir(grid_path, dict(z=sdict['z'], DM=sdict['DM'],
+                                                pzdm=pzdm),
+                                meta=dict(telescope=self.telescope))
+        return frb_io.load_npy_dir(grid_path, mmap_mode='r')
+
+    def iDM(self, dm):
+        """
+        Index of the grid DM nearest to the input value(s)
+
+        Args:
+            dm (float or np.ndarray): DM(s) in pc/cm**3
+
+        Returns:
+            int or np.ndarray:
+        """
+        DM = np.asarray(self.DM)
+        dm = np.asarray(dm, dtype=float)
+        # DM is sorted;  compare the neighbors
+        idx = np.clip(np.searchsorted(DM, dm), 1, DM.size-1)
+        idx = idx - ((dm - DM[idx-1]) <= (DM[idx] - dm))
+        return idx
+
+    def pz_given_dm(self, dm):
+        """
+        p(z|DM) at the grid DM nearest to the input value(s)
+
+        Args:
+            dm (float or np.ndarray): DM(s) in pc/cm**3
+
+        Returns:
+            np.ndarray: p(z), normalized to unit sum.
+                Shape is (z.size,) or (dm.size, z.size)
+        """
+        idx = self.iDM(dm)
+        PzDM = np.array(self.grid['pzdm'][idx], dtype=float)
+        PzDM /= np.sum(PzDM, axis=-1, keepdims=True)
+        return PzDM
+
+    def z_stats(self, dm, cl=(2.5, 97.5)):
+        """
+        Summary statistics of p(z|DM) for one or more DMs
+
+        The cumulative distribution is computed once per
+        grid DM, however many input DMs map onto it.
+
+        Args:
+            dm (float or np.ndarray): DM(s) in pc/cm**3
+            cl (tuple, optional): Lower and upper confidence limits in percent
+
+        Returns:
+            dict: z_min, z_max, z_50, z_mode (float or np.ndarray)
+        """
+        idx = self.iDM(dm)
+        uidx, inv = np.unique(np.atleast_1d(idx), return_inverse=True)
+        PzDM = self.pz_given_dm(self.DM[uidx])
+        cum_sum = np.cumsum(PzDM, axis=-1)
+        z = np.asarray(self.z)
+        stats = {}
+        for key, lim in zip(['z_min', 'z_max', 'z_50'], [cl[0], cl[1], 50.]):
+            stats[key] = z[np.argmin(np.abs(cum_sum-lim/100.), axis=-1)][inv]
+        stats['z_mode'] = z[np.argmax(PzDM, axis=-1)][inv]
+        if np.ndim(idx) == 0:
+            stats = {key: item[0] for key, item in stats.items()}
+        return stats
+
+    def credible_interval(self, dm, cl=(2.5, 97.5)):
+        """
+        Redshift interval containing the input confidence limits
+
+        Args:
+            dm (float or np.ndarray): DM(s) in pc/cm**3
+            cl (tuple, optional): Lower and upper limits in percent
+
+        Returns:
+            tuple: z_min, z_max (float or np.ndarray)
+        """
+        stats = self.z_stats(dm, cl=cl)
+        return stats['z_min'], stats['z_max']
+
+
 def get_DMcosmic_from_z(zarray, perc=0.5, redo_pdmz_grid=False, DMevals=np.linspace(1.,2000.,1000), beta=3., F=0.31, cosmo=defs.frb_cosmo):
     """
     Gives DMcosmic values of zarray, considering the percentile.
@@ -244,18 +530,18 @@ def get_DMcosmic_from_z(zarray, perc=0.5, redo_pdmz_grid=False, DMevals=np.linsp
         z_new = np.array(zarray)
    
     # Get the DMcosmic-z grid (will read a default one if redo=False)
-    filename = resource_filename('frb', os.path.join('data','DM', 'pdmz_default_grid.npz'))  
+    filename = str(files('frb.data.DM').joinpath('pdmz_default_grid.npz'))
     if redo_pdmz_grid:
-        # This is time consuming, could be done more efficiently
-        print("Calculating the DMcosmic-z grid, this may take a while... [you can turn off this by setting `redo_pdmz_grid=False`]")
-        zeval , DM_cosmics, PDF_grid = grid_P_DMcosmic_z(zvals=z_new, beta=beta, F=F, cosmo=cosmo, DM_cosmics=DMevals)
-        grid = PDF_grid
+        # Generated once and then re-used from the user cache
+        print("Grabbing the DMcosmic-z grid from the user cache [generated on the first call]")
+        sdict = cached_grid_P_DMcosmic_z(zvals=z_new, beta=beta, F=F, cosmo=cosmo, DM_cosmics=DMevals)
+        DM_cosmics = sdict['DM']
+        grid = sdict['PDM_z']
     else:
         if not os.path.isfile(filename):
             # here we hardcode the default values for the grid to be those of grid_P_DMcosmic_z() defaults
-            print("No {} found in the repo. Calculating it. This may take a while, but should only happen 1 time.")
-            zeval , DM_cosmics, PDF_grid = grid_P_DMcosmic_z()
-            np.savez_compressed(filename, zeval=zeval, DM_cosmics=DM_cosmics, PDF_grid=PDF_grid)
+            sdict = cached_grid_P_DMcosmic_z()
+            zeval, DM_cosmics, PDF_grid = sdict['z'], sdict['DM'], sdict['PDM_z']
         else:
             data = np.load(filename)
             zeval = data['zeval']
@@ -2,6 +2,7 @@
 
 from ne2001 import ne_io, density #ne2001 ism model
 import pygedm #ymw ism model
+from frb import mw
 import numpy as np
 import pandas as pd
 from astropy import units as u
@@ -9,9 +10,8 @@ from astropy.coordinates import SkyCoord, Galactic
 import logging
 
 logging.basicConfig(format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S', level=logging.INFO)
-ne = density.ElectronDensity()
 
-def find_delta_dm(transient_type,transient_data,ism_model,b_val,mc_deg=5,save_df=True):
+def find_delta_dm(transient_type,transient_data,ism_model,b_val,mc_deg=5,save_df=True,use_map=False):
     """
     Find pulsar/FRB DMs corrected for by the MW ISM DM and remove observations in complex DM regions.
     Returns array of DMs
@@ -32,6 +32,9 @@ def find_delta_dm(transient_type,transient_data,ism_model,b_val,mc_deg=5,save_df
             Number of degrees from Magellanic clouds within which transients are removed.
         save_df (str, optional):
             Save transient DMs and coords to csv.
+        use_map (bool, optional):
+            For ne2001, interpolate the cached DM_ISM map of frb.mw.ism_map()
+            instead of integrating every sightline.
     
     Outputs:
     """
@@ -75,15 +78,12 @@ def find_delta_dm(transient_type,transient_data,ism_model,b_val,mc_deg=5,save_df
 
     # ISM model
     logging.info('Correcting transient DMs for ISM...')
-    trans_ism = []
     if ism_model=='ymw16':
-        for i in range(len(transcat_df['dm'])):
-            trans_ism_ = pygedm.dist_to_dm(transcat_df['l'].iloc[i], transcat_df['b'].iloc[i], 100000)[0].value
-            trans_ism = np.append(trans_ism,trans_ism_)
+        trans_ism = np.array([pygedm.dist_to_dm(l, b, 100000)[0].value
+                              for l, b in zip(transcat_df['l'], transcat_df['b'])])
     elif ism_model=='ne2001':
-        for i in range(len(transcat_df['dm'])):
-            trans_ism_ = ne.DM(transcat_df['l'].iloc[i], transcat_df['b'].iloc[i], 100.).value
-            trans_ism = np.append(trans_ism,trans_ism_)
+        trans_coords = SkyCoord(l=transcat_df['l'].values, b=transcat_df['b'].values, unit=(u.degree), frame=Galactic)
+        trans_ism = mw.ismDM(trans_coords, use_map=use_map).value
 
     transcat_df['trans_ism'] = pd.DataFrame(trans_ism)
     transcat_df['deltaDM'] = pd.DataFrame(transcat_df['dm']-transcat_df['trans_ism'])
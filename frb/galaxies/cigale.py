@@ -2,13 +2,16 @@
 A module to automate CIGALE. Currently works for a single galaxy.
 It generates a configuration file and runs the standard pcigale
 script. Requires pcigale already installed on the system. 
+
+run_batch() shards a large table over a pool of such runs.
 """
 
 import numpy as np
 import sys, os, glob, multiprocessing, warnings
+import hashlib, json, shutil, time, traceback
 from collections import OrderedDict
 
-from astropy.table import Table
+from astropy.table import Table, vstack
 
 try:
     from pcigale.session.configuration import Configuration
@@ -19,6 +22,7 @@ else:
     from pcigale.data import SimpleDatabase as Database
 
 from frb.surveys.catalog_utils import _detect_mag_cols, convert_mags_to_flux
+from frb.io import loadjson
 
 
 from IPython import embed
@@ -454,3 +458,208 @@ def host_run(host, cut_photom=None, cigale_file=None):
         sfh_file = cigale_file.replace('CIGALE', 'CIGALE_SFH')
         os.system('mv {:s}/{:s}_SFH.fits {:s}'.format(host.name, host.name, sfh_file))
     return
+
+
+def _table_hash(tbl):
+    """ SHA1 of the column names and values of a Table """
+    sha = hashlib.sha1()
+    for key in tbl.colnames:
+        sha.update(key.encode())
+        values = np.asarray(tbl[key])
+        if values.dtype.kind == 'O':
+            sha.update(repr(values.tolist()).encode())
+        else:
+            sha.update(np.ascontiguousarray(values).tobytes())
+    return sha.hexdigest()
+
+
+def shard_table(photometry_table, n_shards=None, shard_size=100):
+    """
+    Split a table into contiguous shards for run_batch.
+    Groups of a grouped table are never split.
+
+    Args:
+        photometry_table (astropy Table):
+        n_shards (int, optional):
+            Number of shards. Overrides shard_size
+        shard_size (int, optional):
+            Rows (or groups) per shard
+
+    Returns:
+        list: (start, stop) row ranges, one per non-empty shard
+    """
+    # Group boundaries;  one row per group if the table is not grouped
+    if photometry_table.groups.keys is not None:
+        bounds = np.asarray(photometry_table.groups.indices)
+    else:
+        bounds = np.arange(len(photometry_table)+1)
+    ngroup = bounds.size-1
+    if n_shards is None:
+        n_shards = int(np.ceil(ngroup/shard_size))
+    n_shards = max(1, min(n_shards, ngroup))
+    edges = np.linspace(0, ngroup, n_shards+1).round().astype(int)
+    return [(int(bounds[edges[ii]]), int(bounds[edges[ii+1]])) for ii in range(n_shards)]
+
+
+def _run_shard(shard_file, zcol, shard_dir, run_kwargs):
+    """
+    Run CIGALE on one shard inside its own folder, so that
+    concurrent runs do not share pcigale's working files.
+
+    Args:
+        shard_file (str): Photometry of the shard (FITS)
+        zcol (str): Name of the redshift column
+        shard_dir (str): Folder for this shard
+        run_kwargs (dict): Passed to run()
+
+    Returns:
+        tuple: (shard_dir, error message or None, run time in s)
+    """
+    tstart = time.time()
+    cwd = os.getcwd()
+    try:
+        work_dir = os.path.join(shard_dir, 'work')
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir)
+        os.makedirs(work_dir)
+        os.chdir(work_dir)
+        run(Table.read(shard_file), zcol, outdir='out', **run_kwargs)
+        shutil.copy(os.path.join(work_dir, 'out', 'results.fits'),
+                    os.path.join(shard_dir, 'results.fits'))
+    except Exception:
+        return shard_dir, traceback.format_exc(), time.time()-tstart
+    finally:
+        os.chdir(cwd)
+    return shard_dir, None, time.time()-tstart
+
+
+def _run_shard_star(args):
+    """ Unpack the arguments of _run_shard for Pool.imap_unordered """
+    return _run_shard(*args)
+
+
+def _write_manifest(manifest, manifest_file):
+    """ Atomically write the batch manifest """
+    tmp_file = manifest_file+'.tmp'
+    with open(tmp_file, 'wt') as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(tmp_file, manifest_file)
+
+
+def run_batch(photometry_table, zcol, outdir='cigale_batch', n_shards=None, shard_size=100,
+              n_procs=1, cores=1, merge=True, **kwargs):
+    """
+    Run CIGALE on a large table in shards, with a pool of processes.
+
+    Each shard runs in outdir/shard_NNNN/ and its results.fits is recorded
+    in outdir/manifest.json once it completes.  Calling this again with
+    the same table and sharding only runs the shards that are missing
+    or failed, so a crash or a bad shard does not lose the rest.
+
+    Args:
+        photometry_table (astropy Table):
+            Input of run().  Groups of a grouped table stay in one shard.
+        zcol (str):
+            Name of the column with redshift estimates.
+        outdir (str, optional):
+            Folder for the shards, manifest and merged results
+        n_shards (int, optional):
+            Number of shards. Overrides shard_size
+        shard_size (int, optional):
+            Rows (or groups) per shard
+        n_procs (int, optional):
+            Number of shards run at once
+        cores (int, optional):
+            CPU cores given to each CIGALE run
+        merge (bool, optional):
+            Return (and write to outdir/results.fits) the merged results
+        kwargs: Passed to run(), e.g. variables, save_sed.
+            Plotting is turned off.
+
+    Returns:
+        astropy Table or None: Merged results if merge is True
+    """
+    if zcol not in photometry_table.colnames:
+        raise IOError("{} not found in the table. Please check".format(zcol))
+    os.makedirs(outdir, exist_ok=True)
+    outdir = os.path.abspath(outdir)
+    manifest_file = os.path.join(outdir, 'manifest.json')
+    shards = shard_table(photometry_table, n_shards=n_shards, shard_size=shard_size)
+    table_hash = _table_hash(photometry_table)
+
+    # Resume from the manifest of a previous run
+    if os.path.isfile(manifest_file):
+        manifest = loadjson(manifest_file)
+        if manifest['table_hash'] != table_hash or manifest['shards'] != [list(shard) for shard in shards]:
+            raise IOError("{} holds a batch for a different table or sharding. "
+                          "Use a new outdir".format(outdir))
+    else:
+        manifest = {'table_hash': table_hash, 'zcol': zcol,
+                    'shards': [list(shard) for shard in shards], 'status': {}}
+        _write_manifest(manifest, manifest_file)
+
+    # Write the input of each remaining shard
+    run_kwargs = dict(kwargs)
+    run_kwargs.update({'plot': False, 'cores': cores})
+    todo = []
+    for ii, (start, stop) in enumerate(shards):
+        shard_name = 'shard_{:04d}'.format(ii)
+        if manifest['status'].get(shard_name, {}).get('done', False):
+            continue
+        shard_dir = os.path.join(outdir, shard_name)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_file = os.path.join(shard_dir, 'photometry.fits')
+        photometry_table[start:stop].write(shard_file, overwrite=True)
+        todo.append((shard_file, zcol, shard_dir, run_kwargs))
+    if len(todo) > 0:
+        print("Running CIGALE on {} of {} shards".format(len(todo), len(shards)))
+
+    # Run them;  the manifest is only written here, in the parent
+    def record(result):
+        shard_dir, error, run_time = result
+        shard_name = os.path.basename(shard_dir)
+        manifest['status'][shard_name] = {'done': error is None, 'time': run_time, 'error': error}
+        _write_manifest(manifest, manifest_file)
+        if error is not None:
+            print("Shard {} failed;  see {}".format(shard_name, manifest_file))
+    n_procs = max(1, min(n_procs, len(todo)))
+    if n_procs > 1:
+        with multiprocessing.get_context('spawn').Pool(n_procs) as p:
+            for result in p.imap_unordered(_run_shard_star, todo):
+                record(result)
+    else:
+        for args in todo:
+            record(_run_shard(*args))
+
+    if merge:
+        return merge_batch(outdir)
+    return None
+
+
+def merge_batch(outdir, results_file='results.fits'):
+    """
+    Merge the shard results of a run_batch() folder,
+    in the order of the input table.
+
+    Args:
+        outdir (str): Folder of the batch
+        results_file (str, optional): Name of the merged table
+            written to outdir;  None to skip writing
+
+    Returns:
+        astropy Table: Merged results
+
+    Raises:
+        IOError: If any shard has not completed
+    """
+    manifest = loadjson(os.path.join(outdir, 'manifest.json'))
+    shard_names = ['shard_{:04d}'.format(ii) for ii in range(len(manifest['shards']))]
+    missing = [name for name in shard_names
+               if not manifest['status'].get(name, {}).get('done', False)]
+    if len(missing) > 0:
+        raise IOError("Shards {} of {} have not completed. Re-run run_batch()".format(
+            ', '.join(missing), outdir))
+    merged = vstack([Table.read(os.path.join(outdir, name, 'results.fits')) for name in shard_names])
+    if results_file is not None:
+        merged.write(os.path.join(outdir, results_file), overwrite=True)
+    return merged
@@ -553,13 +553,14 @@ def getEazyPz(idx, MAIN_OUTPUT_FILE='photz', OUTPUT_DIRECTORY='./OUTPUT', CACHE_
 
     Get Eazy p(z) for object #idx.
 
-    To avoid re-reading the binary files, supply binaries = (tempfilt, pz)
+    To avoid re-reading the binary files, supply binaries = (tempfilt, pz);
+    otherwise they are memory-mapped once per directory (see EazyOutput).
+    For many objects use EazyOutput.pz()
 
     """
     if binaries is None:
-        tempfilt, coeffs, temp_seds, pz = readEazyBinary(MAIN_OUTPUT_FILE=MAIN_OUTPUT_FILE, \
-                                                         OUTPUT_DIRECTORY=OUTPUT_DIRECTORY, \
-                                                         CACHE_FILE=CACHE_FILE)
+        tempfilt, pz = EazyOutput.open(OUTPUT_DIRECTORY=OUTPUT_DIRECTORY, MAIN_OUTPUT_FILE=MAIN_OUTPUT_FILE,
+                                       CACHE_FILE=CACHE_FILE).binaries
     else:
         tempfilt, pz = binaries
 
@@ -591,4 +592,226 @@ def getEazyPz(idx, MAIN_OUTPUT_FILE='photz', OUTPUT_DIRECTORY='./OUTPUT', CACHE_
     if get_prior:
         return tempfilt['zgrid'], pzi, prior
     else:
-        return tempfilt['zgrid'], pzi
\ No newline at end of file
+        return tempfilt['zgrid'], pzi
+
+# Memory-mapped EAZY outputs, one per output root
+_eazy_outputs = {}
+
+
+class EazyOutput(object):
+    """
+    Memory-mapped access to the EAZY BINARY_OUTPUTS files
+    (.tempfilt, .coeff, .temp_sed and .pz) of one run.
+
+    Nothing is read into memory until it is indexed, so p(z)
+    for a subset of a large catalog only touches those rows.
+    Use EazyOutput.open() to share one instance per output directory.
+
+    Args:
+        OUTPUT_DIRECTORY (str, optional): Folder with the EAZY output
+        MAIN_OUTPUT_FILE (str, optional): Root name of the output files
+        CACHE_FILE (str, optional): Template cache file;
+            'Same' means MAIN_OUTPUT_FILE+'.tempfilt'
+
+    Attributes:
+        tempfilt (dict): As in readEazyBinary, arrays memory-mapped
+        coeffs (dict): As in readEazyBinary, arrays memory-mapped
+        temp_sed (dict): As in readEazyBinary, arrays memory-mapped
+        zgrid (np.ndarray): Redshift grid
+        NOBJ (int): Number of objects
+    """
+    def __init__(self, OUTPUT_DIRECTORY='./OUTPUT', MAIN_OUTPUT_FILE='photz', CACHE_FILE='Same'):
+        self.root = os.path.join(OUTPUT_DIRECTORY, MAIN_OUTPUT_FILE)
+        if CACHE_FILE == 'Same':
+            CACHE_FILE = self.root + '.tempfilt'
+        if not os.path.isfile(CACHE_FILE):
+            raise IOError("File, {:s}, not found.".format(CACHE_FILE))
+        self.cache_file = CACHE_FILE
+
+        # .tempfilt
+        NFILT, NTEMP, NZ, NOBJ = np.fromfile(CACHE_FILE, dtype=np.int32, count=4)
+        arrays = self._memmap(CACHE_FILE, 16, [('tempfilt', np.double, (NZ, NTEMP, NFILT)),
+                                               ('lc', np.double, (NFILT,)),
+                                               ('zgrid', np.double, (NZ,)),
+                                               ('fnu', np.double, (NOBJ, NFILT)),
+                                               ('efnu', np.double, (NOBJ, NFILT))])
+        self.tempfilt = {'NFILT': NFILT, 'NTEMP': NTEMP, 'NZ': NZ, 'NOBJ': NOBJ,
+                         'tempfilt': arrays['tempfilt'].T, 'lc': arrays['lc'],
+                         'zgrid': arrays['zgrid'], 'fnu': arrays['fnu'].T, 'efnu': arrays['efnu'].T}
+        self.zgrid = np.array(arrays['zgrid'])
+        self.NOBJ = NOBJ
+
+        # .coeff
+        self.coeffs = None
+        if os.path.isfile(self.root + '.coeff'):
+            NFILT, NTEMP, NZ, NOBJ = np.fromfile(self.root + '.coeff', dtype=np.int32, count=4)
+            arrays = self._memmap(self.root + '.coeff', 16, [('coeffs', np.double, (NOBJ, NTEMP)),
+                                                             ('izbest', np.int32, (NOBJ,)),
+                                                             ('tnorm', np.double, (NTEMP,))])
+            self.coeffs = {'NFILT': NFILT, 'NTEMP': NTEMP, 'NZ': NZ, 'NOBJ': NOBJ,
+                           'coeffs': arrays['coeffs'].T, 'izbest': arrays['izbest'],
+                           'tnorm': arrays['tnorm']}
+
+        # .temp_sed
+        self.temp_sed = None
+        if os.path.isfile(self.root + '.temp_sed'):
+            NTEMP, NTEMPL, NZ = np.fromfile(self.root + '.temp_sed', dtype=np.int32, count=3)
+            arrays = self._memmap(self.root + '.temp_sed', 12, [('templam', np.double, (NTEMPL,)),
+                                                                ('temp_seds', np.double, (NTEMP, NTEMPL)),
+                                                                ('da', np.double, (NZ,)),
+                                                                ('db', np.double, (NZ,))])
+            self.temp_sed = {'NTEMP': NTEMP, 'NTEMPL': NTEMPL, 'NZ': NZ,
+                             'templam': arrays['templam'], 'temp_seds': arrays['temp_seds'].T,
+                             'da': arrays['da'], 'db': arrays['db']}
+
+        # .pz
+        self._pz = None
+        if os.path.isfile(self.root + '.pz'):
+            pz_file = self.root + '.pz'
+            NZ, NOBJ = np.fromfile(pz_file, dtype=np.int32, count=2)
+            offset = 8 + 8*NZ*NOBJ
+            self._pz = {'NZ': NZ, 'NOBJ': NOBJ, 'NK': 0,
+                       'chi2fit': np.memmap(pz_file, dtype=np.double, mode='r', offset=8, shape=(NOBJ, NZ))}
+            # The prior is only written with APPLY_PRIOR
+            if os.path.getsize(pz_file) > offset:
+                NK = int(np.fromfile(pz_file, dtype=np.int32, count=1, offset=offset)[0])
+                arrays = self._memmap(pz_file, offset+4, [('kbins', np.double, (NK,)),
+                                                          ('priorzk', np.double, (NK, NZ)),
+                                                          ('kidx', np.int32, (NOBJ,))])
+                self._pz.update({'NK': NK, 'kbins': arrays['kbins'], 'priorzk': arrays['priorzk'],
+                                'kidx': arrays['kidx']})
+
+    @staticmethod
+    def _memmap(filename, offset, layout):
+        """ Memory-map consecutive arrays of a binary file
+
+        Args:
+            filename (str):
+            offset (int): Bytes before the first array
+            layout (list): (name, dtype, shape) of each array in file order
+
+        Returns:
+            dict: Read-only memmap for each name
+        """
+        arrays = {}
+        for name, dtype, shape in layout:
+            shape = tuple(int(ii) for ii in shape)
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+            offset += np.dtype(dtype).itemsize * int(np.prod(shape))
+        return arrays
+
+    @classmethod
+    def open(cls, OUTPUT_DIRECTORY='./OUTPUT', MAIN_OUTPUT_FILE='photz', CACHE_FILE='Same'):
+        """ Shared instance for an output directory
+
+        The instance is rebuilt if the .tempfilt or .pz files have changed on disk.
+
+        Args:
+            OUTPUT_DIRECTORY (str, optional):
+            MAIN_OUTPUT_FILE (str, optional):
+            CACHE_FILE (str, optional):
+
+        Returns:
+            EazyOutput:
+        """
+        root = os.path.abspath(os.path.join(OUTPUT_DIRECTORY, MAIN_OUTPUT_FILE))
+        stamp = tuple(os.stat(ifile).st_mtime_ns if os.path.isfile(ifile) else None
+                      for ifile in [root+'.tempfilt' if CACHE_FILE == 'Same' else CACHE_FILE,
+                                    root+'.pz'])
+        key = (root, CACHE_FILE)
+        if key not in _eazy_outputs or _eazy_outputs[key][0] != stamp:
+            _eazy_outputs[key] = (stamp, cls(OUTPUT_DIRECTORY=OUTPUT_DIRECTORY,
+                                             MAIN_OUTPUT_FILE=MAIN_OUTPUT_FILE,
+                                             CACHE_FILE=CACHE_FILE))
+        return _eazy_outputs[key][1]
+
+    @property
+    def binaries(self):
+        """ (tempfilt, pz) in the layout of readEazyBinary, for getEazyPz """
+        if self._pz is None:
+            return self.tempfilt, None
+        pz = dict(self._pz)
+        pz['chi2fit'] = self._pz['chi2fit'].T
+        if pz['NK'] == 0:
+            return self.tempfilt, None
+        pz['priorzk'] = self._pz['priorzk'].T
+        return self.tempfilt, pz
+
+    def pz_chi2(self, idx):
+        """ chi^2(z) and the prior for a set of objects
+
+        Args:
+            idx (int or np.ndarray): Object indices (row in the EAZY catalog)
+
+        Returns:
+            tuple: chi2 (n, NZ), prior (n, NZ)
+        """
+        if self._pz is None:
+            raise IOError("No .pz file for {:s}".format(self.root))
+        idx = np.atleast_1d(idx)
+        chi2 = np.asarray(self._pz['chi2fit'][idx])
+        prior = np.ones_like(chi2)
+        if self._pz['NK'] > 0:
+            kidx = np.asarray(self._pz['kidx'][idx])
+            has_prior = (kidx > 0) & (kidx < self._pz['NK'])
+            prior[has_prior] = self._pz['priorzk'][kidx[has_prior]]
+        return chi2, prior
+
+    def pz(self, idx, chunk_size=2**22):
+        """ p(z) for a set of objects, as in getEazyPz
+
+        Args:
+            idx (int or np.ndarray): Object indices (row in the EAZY catalog)
+            chunk_size (int, optional): Maximum number of chi^2 values in memory at once
+
+        Returns:
+            np.ndarray: p(z) on self.zgrid, shape (n, NZ);  normalized to unit integral
+                unless it vanishes everywhere
+        """
+        idx = np.atleast_1d(idx)
+        pzi = np.zeros((idx.size, self.zgrid.size))
+        nrow = max(1, chunk_size // self.zgrid.size)
+        for ss in range(0, idx.size, nrow):
+            chi2, prior = self.pz_chi2(idx[ss:ss+nrow])
+            ipz = np.exp(-0.5 * (chi2 - np.min(chi2, axis=1, keepdims=True))) * prior
+            norm = np.trapz(ipz, self.zgrid, axis=1)
+            good = np.sum(ipz, axis=1) > 0
+            ipz[good] /= norm[good, None]
+            pzi[ss:ss+nrow] = ipz
+        return pzi
+
+    def sample_z(self, idx, ndraws=1000, rng=None, chunk_size=2**22):
+        """ Draw redshifts from p(z) for a set of objects
+
+        p(z) is forced to 0 at z=0 and sampled by inverting its cumulative sum.
+
+        Args:
+            idx (int or np.ndarray): Object indices (row in the EAZY catalog)
+            ndraws (int, optional): Draws per object
+            rng (int or np.random.Generator, optional):
+            chunk_size (int, optional): Maximum number of values in memory at once
+
+        Returns:
+            np.ndarray: Redshifts, shape (n, ndraws);  NaN for objects with p(z)=0
+        """
+        rng = np.random.default_rng(rng)
+        idx = np.atleast_1d(idx)
+        zgrid = np.hstack([[0], self.zgrid])
+        sample_z = np.zeros((idx.size, ndraws))
+        nrow = max(1, chunk_size // (zgrid.size + ndraws))
+        for ss in range(0, idx.size, nrow):
+            ipz = self.pz(idx[ss:ss+nrow])
+            nn = ipz.shape[0]
+            cdf_z = np.cumsum(np.hstack([np.zeros((nn, 1)), ipz]), axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cdf_z /= cdf_z[:, -1:]
+            bad = ~np.isfinite(cdf_z[:, -1])
+            cdf_z[bad] = np.linspace(0., 1., zgrid.size)
+            # Offset each CDF by its row so one interpolation inverts them all
+            offset = np.arange(nn)[:, None]
+            sample_u = rng.random((nn, ndraws))
+            isample = np.interp((sample_u + offset).ravel(), (cdf_z + offset).ravel(),
+                                np.tile(zgrid, nn)).reshape(nn, ndraws)
+            isample[bad] = np.nan
+            sample_z[ss:ss+nn] = isample
+        return sample_z
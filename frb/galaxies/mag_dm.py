@@ -143,3 +143,89 @@ def r_vs_dm_figure(z_min, z_max, z, PzDM, outfile='fig_r_vs_z.png',
     plt.savefig(outfile, **kwargs)
     plt.close()
 
+
+
+def zrange_for_frbs(DM_FRB, coords, mag_limit, dm_host=50., dm_mwhalo=50.,
+                    EBV=None, DM_ISM=None, filt='DECaL_r',
+                    telescope='perfect', cl=(2.5, 97.5)):
+    """
+    Estimate p(z|DM) statistics and the limiting host luminosity
+    for a batch of FRBs
+
+    This is the calculation of the frb_pzdm_mag script for N bursts
+    in one pass over the p(z|DM) grid.
+
+    Args:
+        DM_FRB (float or np.ndarray): FRB DMs (pc/cm^3)
+        coords (SkyCoord): FRB coordinates;  N entries
+        mag_limit (float or np.ndarray): Magnitude limit in filt
+            *without* extinction correction
+        dm_host (float or np.ndarray, optional): Assumed DM of the hosts
+        dm_mwhalo (float or np.ndarray, optional): Assumed DM of the MW halo
+        EBV (np.ndarray, optional): E(B-V) values.  Queried from IRSA if not provided
+        DM_ISM (np.ndarray, optional): NE2001 DM values.  Calculated if not provided
+        filt (str, optional): Filter for the extinction correction.
+            Must be a Repo approved choice
+        telescope (str, optional): Telescope model for the DM-z grid.
+            See frb.dm.prob_dmz.telescope_dict
+        cl (tuple, optional): Confidence limits for z in percent
+
+    Returns:
+        astropy.table.Table: One row per FRB with the DMs, EBV,
+            z_min, z_max, z_50, z_mode, frac_Lstar_min and frac_Lstar_max
+    """
+    from astropy.table import Table
+    from frb import mw
+    from frb.dm import prob_dmz
+    from frb.galaxies import nebular
+    from frb.galaxies import photom
+
+    coords = coords.reshape(-1)
+    nfrb = len(coords)
+    DM_FRB = np.broadcast_to(np.asarray(DM_FRB, dtype=float), (nfrb,))
+
+    # EBV
+    if EBV is None:
+        EBV = [nebular.get_ebv(coord)['meanValue'] for coord in coords]
+    EBV = np.broadcast_to(np.asarray(EBV, dtype=float), (nfrb,))
+
+    # NE 2001
+    if DM_ISM is None:
+        DM_ISM = mw.ismDM(coords).value
+    DM_ISM = np.broadcast_to(np.asarray(DM_ISM, dtype=float), (nfrb,))
+
+    # DM cosmic and EG
+    DM_extragalactic = DM_FRB - DM_ISM - dm_mwhalo
+    DM_cosmic = DM_extragalactic - dm_host
+
+    # The perfect telescope grid uses DM_cosmic, the others DM_extragalactic
+    pzdm_grid = prob_dmz.PzDMGrid(telescope)
+    DM_use = DM_cosmic if telescope == 'perfect' else DM_extragalactic
+    stats = pzdm_grid.z_stats(DM_use, cl=cl)
+
+    # Extinction correct;  once per unique EBV
+    uEBV, inv = np.unique(EBV, return_inverse=True)
+    dust_correct = np.array([photom.extinction_correction(filt, iEBV)
+                             for iEBV in uEBV])[inv]
+    mag_dust = 2.5 * np.log10(1. / dust_correct)
+    mag_corr = mag_limit + mag_dust
+
+    # Convert to L
+    f_mL = frb_gal_u.load_f_mL()
+    frac_Lstar_min = 10**(-0.4*(mag_corr-f_mL(stats['z_min'])))
+    frac_Lstar_max = 10**(-0.4*(mag_corr-f_mL(stats['z_max'])))
+
+    # Table
+    tbl = Table()
+    tbl['DM_FRB'] = DM_FRB
+    tbl['DM_ISM'] = DM_ISM
+    tbl['DM_extragalactic'] = DM_extragalactic
+    tbl['DM_cosmic'] = DM_cosmic
+    tbl['EBV'] = EBV
+    for key in ['z_min', 'z_max', 'z_50', 'z_mode']:
+        tbl[key] = stats[key]
+    tbl['frac_Lstar_min'] = frac_Lstar_min
+    tbl['frac_Lstar_max'] = frac_Lstar_max
+
+    # Return
+    return tbl
@@ -1,15 +1,22 @@
+import glob
+import json
+import os
+import threading
 import warnings
 
 import numpy as np
+from scipy.integrate import cumulative_trapezoid
 from scipy.interpolate import InterpolatedUnivariateSpline as IUS
+from scipy.interpolate import RectBivariateSpline
+from scipy.spatial import cKDTree
 
 from astropy import units
 from astropy import constants
-from astropy.cosmology import z_at_value
 from astropy.table import Table
 
 from frb.halos.models import ModifiedNFW, ICM
 from frb.defs import frb_cosmo as cosmo
+from frb import io as frb_io
 
 from IPython import embed
 
@@ -26,7 +33,19 @@ def init_hmf():
     """
     # Hidden here to avoid it becoming a dependency
     import hmf_emulator
-    # Setup HMF
+    hmfe = hmf_emulator.hmf_emulator()
+    hmfe.set_cosmology(hmf_cosmo_dict())
+    # Return
+    return hmfe
+
+
+def hmf_cosmo_dict():
+    """
+    Cosmology handed to the Aemulus emulator
+
+    Returns:
+        dict:
+    """
     # https://github.com/astropy/astropy/blob/master/astropy/cosmology/parameters.py
     #sigma8 = 0.8159
     ns = 0.9667
@@ -38,19 +57,126 @@ def init_hmf():
                   "ln10As": 3.098, # THIS REPLACES sigma8
                   "H0":cosmo.H0.to('km/(s*Mpc)').value,
                   "n_s":ns,"w0":-1.0,"N_eff":Neff} # "wa":0.0 is assumed internally
-    hmfe = hmf_emulator.hmf_emulator()
-    hmfe.set_cosmology(cosmo_dict)
-    # Return
-    return hmfe
+    return cosmo_dict
 
-# Storing for use
-#  Needs to come after def init_hmf()
-try:
-    import hmf_emulator
-except:
-    warnings.warn("hmf_emulator not imported.  Hope you are not intending to use the hmf.py module..")
-else:
-    hmfe = init_hmf()
+# Shared emulator;  built on first use (see get_hmfe)
+_hmfe = None
+_hmfe_lock = threading.Lock()
+
+
+def get_hmfe():
+    """
+    Shared Aemulus halo mass function emulator
+
+    Created by init_hmf() on the first call (thread-safe) so that
+    importing this module stays cheap
+
+    Returns:
+        hmfe (hmf_emulator.hmf_emulator):
+    """
+    global _hmfe
+    if _hmfe is None:
+        with _hmfe_lock:
+            if _hmfe is None:
+                _hmfe = init_hmf()
+    return _hmfe
+
+
+def __getattr__(name):
+    # hmfe used to be built at import
+    if name == 'hmfe':
+        return get_hmfe()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+# Tabulated mass function
+HMF_TABLE_VERSION = 2
+hmf_table_z = np.linspace(0., 5., 101)
+# Down to 1e9 h^-1 Msun so that Mlow = 1e10 Msun is covered
+hmf_table_log10M = np.linspace(9., 16.5, 751)  # h^-1 Msun
+_hmf_splines = {}
+
+
+def hmf_table(cache_dir=None):
+    """
+    Load (or build and cache) the halo mass function on a (z, log10 M) grid
+
+    Built once per cosmology with the Aemulus emulator and written
+    to the frb user cache (see frb.io.user_cache_dir).  Masses are
+    in h^-1 Msun and densities in h^3 Mpc^-3, as for the emulator.
+
+    Args:
+        cache_dir (str, optional): Override the cache location
+
+    Returns:
+        dict: z, log10M (h^-1 Msun) and (nz, nM) arrays
+          dndlnM -- dn/dlnM
+          n_gtM -- number density of halos above M
+          rho_gtM -- mass density in halos above M (h^2 Msun Mpc^-3)
+    """
+    params = dict(cosmo=hmf_cosmo_dict(), z=hmf_table_z, log10M=hmf_table_log10M,
+                  version=HMF_TABLE_VERSION)
+    if cache_dir is None:
+        cache_dir = frb_io.user_cache_dir('HMF')
+    path = os.path.join(cache_dir, 'hmf_{}'.format(frb_io.hash_params(params)))
+    if not os.path.isdir(path):
+        hmfe = get_hmfe()
+        # Integrate well past the top of the table
+        lM = np.log(10.)*np.arange(hmf_table_log10M[0], 17.5+1e-8, 0.005)
+        M = np.exp(lM)
+        itbl = np.searchsorted(lM, np.log(10.)*hmf_table_log10M-1e-8)
+        dndlnM, n_gtM, rho_gtM = [], [], []
+        for z in hmf_table_z:
+            dndlM = M*hmfe.dndM(M, z)
+            n_lt = cumulative_trapezoid(dndlM, lM, initial=0.)
+            rho_lt = cumulative_trapezoid(M*dndlM, lM, initial=0.)
+            dndlnM.append(dndlM[itbl])
+            n_gtM.append((n_lt[-1]-n_lt)[itbl])
+            rho_gtM.append((rho_lt[-1]-rho_lt)[itbl])
+        frb_io.save_npy_dir(path, dict(z=hmf_table_z, log10M=hmf_table_log10M,
+                                       dndlnM=np.array(dndlnM), n_gtM=np.array(n_gtM),
+                                       rho_gtM=np.array(rho_gtM)),
+                            meta=dict(cosmo=hmf_cosmo_dict(), version=HMF_TABLE_VERSION))
+    return frb_io.load_npy_dir(path)
+
+
+def _hmf_interp(key, M, z):
+    """
+    Bicubic interpolation of one of the hmf_table quantities
+
+    Args:
+        key (str): dndlnM, n_gtM or rho_gtM
+        M (float or ndarray): Mass in h^-1 Msun
+        z (float or ndarray): Redshift
+
+    Returns:
+        ndarray: Broadcast over M and z
+    """
+    if key not in _hmf_splines:
+        tbl = hmf_table()
+        # Interpolate in log space;  the highest masses at high z underflow
+        _hmf_splines[key] = RectBivariateSpline(
+            tbl['z'], tbl['log10M'], np.log10(np.maximum(tbl[key], 1e-300)))
+    log10M, z = np.broadcast_arrays(np.log10(M), np.asarray(z, dtype=float))
+    if (np.any(log10M < hmf_table_log10M[0]-1e-8) or np.any(log10M > hmf_table_log10M[-1]+1e-8)
+            or np.any(z < hmf_table_z[0]) or np.any(z > hmf_table_z[-1])):
+        raise IOError("M or z is outside the halo mass function table")
+    return 10**_hmf_splines[key](z, log10M, grid=False)
+
+
+def n_in_bins(Mlow, Mhigh, zvals):
+    """
+    Number density of halos in a mass range from the tabulated mass function
+
+    Args:
+        Mlow (float): h^-1 Msun
+        Mhigh (float): h^-1 Msun
+        zvals (float or ndarray):
+
+    Returns:
+        ndarray: h^3 Mpc^-3
+    """
+    return _hmf_interp('n_gtM', Mlow, zvals) - _hmf_interp('n_gtM', Mhigh, zvals)
 
 
 def frac_in_halos(zvals, Mlow, Mhigh, rmax=1.):
@@ -61,14 +187,15 @@ def frac_in_halos(zvals, Mlow, Mhigh, rmax=1.):
     Note that the fraction of DM associated with these halos
     will be scaled down by an additional factor of f_diffuse
 
-    Requires Aemulus HMF to be installed
+    Interpolates the tabulated mass function (see hmf_table), which
+    requires Aemulus HMF to be installed the first time it is built
 
     Args:
         zvals: ndarray
         Mlow: float
-          In h^-1 units already so this will be applied for the halo mass function
+          Solar masses;  the h^-1 factors of the mass function are applied here
         Mhigh: float
-          In h^-1 units already
+          Solar masses
         rmax: float
           Extent of the halo in units of rvir
           WARNING: This calculation assumes a single concentration for all halos
@@ -78,30 +205,17 @@ def frac_in_halos(zvals, Mlow, Mhigh, rmax=1.):
           rho_halo / rho_m
     """
     # Deal with scalar input
-    if np.isscalar(zvals):
-        zvals = np.atleast_1d([zvals])
+    zvals = np.atleast_1d(zvals).astype(float)
     # Cheeky edge case
     if np.isclose(Mlow, Mhigh, rtol=1e-05):
        return np.zeros(len(zvals))
-    
-    M = np.logspace(np.log10(Mlow*cosmo.h), np.log10(Mhigh*cosmo.h), num=1000)
-    lM = np.log(M)
-
-    ratios = []
-    for z in zvals:
-        # Setup
-        #dndlM = np.array([hmfe.dndlnM(Mi, a)[0] for Mi in M])
-        dndlM = M*hmfe.dndM(M, z)
-        M_spl = IUS(lM, M * dndlM)
-
-        # Integrate
-        rho_tot = M_spl.integral(np.log(Mlow*cosmo.h), np.log(Mhigh*cosmo.h)) * units.M_sun / units.Mpc ** 3
-        # Cosmology
-        rho_M = cosmo.critical_density(z) * cosmo.Om(z)/(1+z)**3  # Tinker calculations are all mass
-        ratio = (rho_tot*cosmo.h**2 / rho_M).decompose()
-        #
-        ratios.append(ratio)
-    ratios = np.array(ratios)
+
+    # Mass density in the halos (h^2 Msun Mpc^-3)
+    rho_tot = (_hmf_interp('rho_gtM', Mlow*cosmo.h, zvals)
+               - _hmf_interp('rho_gtM', Mhigh*cosmo.h, zvals))
+    # Cosmology
+    rho_M = cosmo.critical_density(zvals) * cosmo.Om(zvals)/(1+zvals)**3  # Tinker calculations are all mass
+    ratios = (rho_tot*cosmo.h**2 * units.M_sun / units.Mpc**3 / rho_M).decompose().value
     # Boost halos if extend beyond rvir (homologous in mass, but constant concentration is an approx)
     if rmax != 1.:
         #from pyigm.cgm.models import ModifiedNFW
@@ -110,7 +224,7 @@ def frac_in_halos(zvals, Mlow, Mhigh, rmax=1.):
         M_ratio = nfw.fy_dm(rmax * nfw.c) / nfw.fy_dm(nfw.c)
         ratios *= M_ratio
     # Return
-    return np.array(ratios)
+    return ratios
 
 
 def halo_incidence(Mlow, zFRB, radius=None, hmfe=None, 
@@ -120,7 +234,9 @@ def halo_incidence(Mlow, zFRB, radius=None, hmfe=None,
     intersections to halos of a
     given minimum mass to a given zFRB.
 
-    Requires Aemulus HMF to be installed
+    Uses the tabulated mass function (see hmf_table) unless
+    an emulator is provided.  Requires Aemulus HMF to be installed
+    the first time the table is built.
 
     Args:
         Mlow: float
@@ -153,16 +269,16 @@ def halo_incidence(Mlow, zFRB, radius=None, hmfe=None,
     # Mlow limit
     if Mlow < 2e10:
         raise IOError("Calculations are limited to Mlow > 2e10")
-    # HMF
-    if hmfe is None:
-        hmfe = init_hmf()
     #
     zs = np.linspace(0., zFRB, nsample)
     # Mean density
-    ns = []
-    for iz in zs:
-        ins = hmfe.n_in_bins((Mlow * cosmo.h, Mhigh * cosmo.h), iz)
-        ns.append(ins*cosmo.h**3)  # * units.Mpc**-3
+    if hmfe is None:
+        ns = n_in_bins(Mlow * cosmo.h, Mhigh * cosmo.h, zs) * cosmo.h**3
+    else:
+        ns = []
+        for iz in zs:
+            ins = hmfe.n_in_bins((Mlow * cosmo.h, Mhigh * cosmo.h), iz)
+            ns.append(np.squeeze(ins)*cosmo.h**3)  # * units.Mpc**-3
     # Interpolate
     ns = units.Quantity(ns*units.Mpc**-3)
     # Radii
@@ -194,205 +310,257 @@ def halo_incidence(Mlow, zFRB, radius=None, hmfe=None,
         return Navg
 
 
-def build_grid(z_FRB=1., ntrial=10, seed=12345, Mlow=1e10, r_max=2., outfile=None, dz_box=0.1,
-    dz_grid=0.01, f_hot=0.75, verbose=True):
+def _slab_halos(rng, hmfe, zbox, D_lo, D_hi, base_l, Mlow, Mhigh, D_to_z, nM=1000):
+    """
+    Draw the halos in one slab of the simulation box
+
+    Args:
+        rng (np.random.Generator):
+        hmfe (hmf_emulator.hmf_emulator): None for the tabulated mass function
+        zbox (float): Redshift at which the mass function is evaluated
+        D_lo, D_hi (float): Comoving distances bounding the slab (Mpc)
+        base_l (float): Size of the box transverse to the sightlines (cMpc)
+        Mlow, Mhigh (float): Mass range in Solar masses
+        D_to_z (callable): Comoving distance (Mpc) to redshift
+        nM (int, optional): Number of masses used for the inverse CDF
+
+    Returns:
+        tuple: M (Msun), X, Y (cMpc), z of the halos
+    """
+    # Cumulative mass function (h units for the emulator)
+    lM = np.linspace(np.log(Mlow*cosmo.h), np.log(Mhigh*cosmo.h), nM)
+    M = np.exp(lM)
+    if hmfe is None:
+        dndlM = _hmf_interp('dndlnM', M, zbox)
+    else:
+        dndlM = M*hmfe.dndM(M, zbox)
+    cum_n = cumulative_trapezoid(dndlM, lM, initial=0.)
+    # Number of halos in the slab
+    V = (D_hi - D_lo) * base_l**2  # cMpc**3
+    N_halo = rng.poisson(cum_n[-1] * cosmo.h**3 * V)
+    # Masses from the inverse CDF; locations uniform in the slab
+    rM = np.exp(np.interp(rng.random(N_halo), cum_n/cum_n[-1], lM)) / cosmo.h
+    X_c = rng.random(N_halo) * base_l
+    Y_c = rng.random(N_halo) * base_l
+    Z_c = D_lo + rng.random(N_halo) * (D_hi - D_lo)
+    return rM, X_c, Y_c, D_to_z(Z_c)
+
+
+# Bump when the content of the build_grid slabs changes
+GRID_SLAB_VERSION = 1
+
+
+def _slab_file(outfile, ss):
+    return os.path.join(outfile+'_slabs', 'slab_{:03d}.npz'.format(ss))
+
+
+def _slab_files(outfile):
+    """ Slabs streamed to disk for outfile, in order """
+    return sorted(glob.glob(os.path.join(outfile+'_slabs', 'slab_*.npz')))
+
+
+def load_grid_halos(outfile):
+    """
+    Gather the intersected halos streamed to disk by build_grid
+
+    Args:
+        outfile (str): outfile given to build_grid
+
+    Returns:
+        Table: trial, M, R, DM, z of every intersected halo
+    """
+    files = _slab_files(outfile)
+    slabs = [np.load(ifile) for ifile in files]
+    halo_tbl = Table()
+    for key in ['trial', 'M', 'R', 'DM', 'z']:
+        halo_tbl[key] = np.concatenate([slab[key] for slab in slabs])
+    return halo_tbl
+
+
+def build_grid(z_FRB=1., ntrial=10, seed=12345, Mlow=1e10, Mhigh=1e16, r_max=2., outfile=None,
+    dz_box=0.1, dz_grid=0.01, f_hot=0.75, M_icm=1e14, spacing=2., hmfe=None, verbose=True):
     """
     Generate a universe of dark matter halos with DM measurements
     Mainly an internal function for generating useful output grids.
 
+    The sightlines lie on a square grid (in comoving coordinates)
+    through a box that is filled slab by slab with halos drawn from
+    the mass function.  Intersections for all sightlines are found
+    with KD-trees over the halo centers and the DMs are evaluated
+    in batches with ModifiedNFW.Ne_Rperp_many.  Halos more massive
+    than M_icm are treated with the ICM model one at a time.
+
+    Each slab has its own random stream spawned from seed, so the
+    output does not depend on which slabs were already on disk.
+
     Requires the Aemulus Halo Mass function
 
     Args:
         z_FRB: float, optional
         ntrial: int, optional
+          Number of sightlines
         seed: int, optional
         Mlow: float, optional
-          h^-1 mass
+          Minimum halo mass in Solar masses
+        Mhigh: float, optional
+          Maximum halo mass in Solar masses
         r_max: float, optional
           Extent of the halo in units of rvir
         outfile: str, optional
-          Write
+          Root for the output.  The intersected halos of each slab
+          are streamed to outfile_slabs/slab_NNN.npz and DM_grid is
+          written to outfile.npy.  Slabs already there are reused if
+          they were built with the same parameters (outfile_slabs/params.json)
+          and discarded otherwise
         dz_box: float, optional
           Size of the slice of the universe for each sub-calculation
         dz_grid: float, optional
           redshift spacing in the DM grid
         f_hot: float
           Fraction of the cosmic fraction of matter in diffuse gas (for DM)
+        M_icm: float, optional
+          Halos above this mass (Msun) use the ICM model
+        spacing: float, optional
+          Separation between sightlines in cMpc
+        hmfe (hmf_emulator.hmf_emulator, optional):
+          Halo mass function emulator from Aemulus;  the tabulated
+          mass function (see hmf_table) is used by default
+        verbose: bool, optional
 
     Returns:
         DM_grid: ndarray (ntrial, nz)
         halo_tbl: Table
-          Table of all the halos intersected
+          Table of all the halos intersected;  None if outfile
+          was given (see load_grid_halos)
 
     """
-    Mhigh = 1e16  # Msun
     # mNFW
-    y0 = 2.
-    alpha = 2.
-
     warnings.warn("Ought to do concentration properly someday!")
-    cgm = ModifiedNFW(alpha=alpha, y0=y0, f_hot=f_hot)
-    icm = ICM()
-
-    # Random numbers
-    rstate = np.random.RandomState(seed)
-
-    # Init HMF
-    hmfe = init_hmf()
-
-    # Boxes
-    nbox = int(z_FRB / dz_box)
-    nz = int(z_FRB / dz_grid)
-    dX = int(np.sqrt(ntrial))+1
-    #
-    npad = 6 # Mpc
-    base_l = 2*dX + npad
-    print('L_base = {} cMpc'.format(base_l))
-    warnings.warn("Worry about being big enough given cMpc vs pMpc")
+    cgm = ModifiedNFW(alpha=2., y0=2., f_hot=f_hot)
+
+    # Random numbers;  one stream per slab
+    nbox = int(np.ceil(z_FRB / dz_box - 1e-8))
+    slab_seeds = np.random.SeedSequence(seed).spawn(nbox)
+
+    # Sightlines
+    nz = int(np.round(z_FRB / dz_grid))
+    dX = int(np.ceil(np.sqrt(ntrial)))
+    # Pad by the largest halo
+    zbounds = np.minimum(np.arange(nbox+1)*dz_box, z_FRB)
+    r200_max, _ = cgm.halo_params_many(np.log10(Mhigh), zbounds)
+    pad = np.max(r_max * r200_max * (1+zbounds)) / 1000.  # cMpc
+    base_l = spacing*dX + 2*pad
+    if verbose:
+        print('L_base = {} cMpc'.format(base_l))
+    itrial = np.arange(ntrial)
+    sight_xy = np.array([pad + spacing*(itrial % dX),
+                         pad + spacing*(itrial // dX)]).T
+    sight_tree = cKDTree(sight_xy)
 
     DM_grid = np.zeros((ntrial,nz))
 
     # Spline distance to z
-    D_max = cosmo.comoving_distance(z_FRB)
-    D_val = np.linspace(1e-3,D_max.value,200) # IS THIS FINE ENOUGH?
-    z_val = np.array([z_at_value(cosmo.comoving_distance, iz) for iz in D_val*units.Mpc])
+    z_val = np.linspace(0., z_FRB, 1000)
+    D_val = cosmo.comoving_distance(z_val).to('Mpc').value
     D_to_z = IUS(D_val, z_val)
 
-    # Save halo info
-    #halos = [[] for i in range(ntrial)]
-    halo_i, M_i, R_i, DM_i, z_i = [], [], [], [], []
-
-    # Loop me
-    prev_zbox = 0.
-    #for ss in range(nbox):
-    #for ss in [0]:
-    for ss in [5]:
-        zbox = ss*dz_box + dz_box/2.
-        print('zbox = {}'.format(zbox))
-        a = 1./(1.0 + zbox) # Scale factor
-        # Mass function
-        M = np.logspace(np.log10(Mlow*cosmo.h), np.log10(Mhigh*cosmo.h), num=1000)
-        lM = np.log(M)
-        dndlM = np.array([hmf.dndlM(Mi, a) for Mi in M])
-        n_spl = IUS(lM, dndlM)
-        cum_n = np.array([n_spl.integral(np.log(Mlow*cosmo.h), ilM) for ilM in lM])
-        ncum_n = cum_n/cum_n[-1]
-        # As z increases, we have numerical issues at the high mass end (they are too rare)
-        try:
-            mhalo_spl = IUS(ncum_n, lM)
-        except ValueError:
-            # Kludge me
-            print("REDUCING Mhigh by 2x")
-            Mhigh /= 2.
-            M = np.logspace(np.log10(Mlow*cosmo.h), np.log10(Mhigh*cosmo.h), num=1000)
-            lM = np.log(M)
-            dndlM = np.array([hmf.dndlM(Mi, a) for Mi in M])
-            n_spl = IUS(lM, dndlM)
-            cum_n = np.array([n_spl.integral(np.log(Mlow*cosmo.h), ilM) for ilM in lM])
-            ncum_n = cum_n/cum_n[-1]
-            #
-            mhalo_spl = IUS(ncum_n, lM)
-
-        # Volume -- Box with base l = 2Mpc
-        D_zn = cosmo.comoving_distance(zbox + dz_box/2.) # Full box
-        D_zp = cosmo.comoving_distance(ss*dz_box) # Previous
-        D_z = D_zn - D_zp
-        V = D_z * (base_l*units.Mpc)**2
-
-        # Average N_halo
-        avg_n = hmf.n_bin(Mlow*cosmo.h, Mhigh*cosmo.h, a) * cosmo.h**3 * units.Mpc**-3
-        avg_N = (V * avg_n).value
-
-        # Assume Gaussian stats for number of halos
-        N_halo = int(np.round(avg_N + np.sqrt(avg_N)*rstate.randn(1)))
-
-        # Random masses
-        randM = rstate.random_sample(N_halo)
-        rM = np.exp(mhalo_spl(randM)) / cosmo.h
-
-        # r200
-        r200 = (((3*rM*units.M_sun.cgs) / (4*np.pi*200*cosmo.critical_density(zbox)))**(1/3)).to('kpc')
-
-        # Random locations (X,Y,Z)
-        X_c = rstate.random_sample(N_halo)*base_l # Mpc
-        Y_c = rstate.random_sample(N_halo)*base_l # Mpc
-        Z_c = (rstate.random_sample(N_halo)*D_z.to('Mpc') + D_zp).value
-
-        # Check mass fraction
-        if verbose:
-            Mtot = np.log10(np.sum(rM))
-            M_m = (cosmo.critical_density(zbox)*cosmo.Om(zbox) * V/(1+zbox)**3).to('M_sun')
-            #print("N_halo: {}  avg_N: {}".format(N_halo, avg_N))
-            print("z: {}  Mhalo/M_m = {}".format(zbox, 10**Mtot/M_m.value))
-            print(frac_in_halos([zbox], Mlow, Mhigh))
-
-        # Redshifts
-        z_ran = D_to_z(Z_c)
-
-        # Loop on trials
-        all_DMs = []
-        all_nhalo = []
-        all_r200 = []
-        for itrial in range(ntrial):
-            # X,Y trial
-            X_trial = npad//2 + (2*itrial%dX)  # Step by 2Mpc
-            Y_trial = npad//2 + 2*itrial // dX
-            # Impact parameters
-            try:
-                R_com = np.sqrt((X_c-X_trial)**2 + (Y_c-Y_trial)**2)  # Mpc
-            except:
-                embed()
-            R_phys = R_com * 1000. / (1+z_ran) * units.kpc
-            # Cut
-            intersect = R_phys < r_max*r200
-            print("We hit {} halos".format(np.sum(intersect)))
-            all_nhalo.append(np.sum(intersect))
-            if not np.any(intersect):
-                all_DMs.append(0.)
-                continue
-            # Loop -- FIND A WAY TO SPEED THIS UP!
-            DMs = []
-            for iobj in np.where(intersect)[0]:
-                # Init
-                if rM[iobj] > 1e14: # Use ICM model
-                    model = icm
-                else:
-                    model = cgm
-                model.log_Mhalo=np.log10(rM[iobj])
-                model.M_halo = 10.**model.log_Mhalo * constants.M_sun.cgs
-                model.z = zbox # To be consistent with above;  should be close enough
-                model.setup_param(cosmo=cosmo)
-                # DM
-                DM = model.Ne_Rperp(R_phys[iobj], rmax=r_max, add_units=False)/(1+model.z)
-                DMs.append(DM)
-                # Save halo info
-                halo_i.append(itrial)
-                M_i.append(model.M_halo.value)
-                R_i.append(R_phys[iobj].value)
-                DM_i.append(DM)
-                z_i.append(z_ran[iobj])
-                all_r200.append(cgm.r200.value)
-            # Save em
-            iz = (z_ran[intersect]/dz_grid).astype(int)
-            DM_grid[itrial,iz] += DMs
-            all_DMs.append(np.sum(DMs))
-            #print(DMs, np.log10(rM[intersect]), R_phys[intersect])
-            if (itrial % 100) == 0:
-                embed()
-
-    # Table the halos
-    halo_tbl = Table()
-    halo_tbl['trial'] = halo_i
-    halo_tbl['M'] = M_i
-    halo_tbl['R'] = R_i
-    halo_tbl['DM'] = DM_i
-    halo_tbl['z'] = z_i
+    if outfile is not None:
+        # Slabs on disk are reused only if built with the same parameters
+        os.makedirs(outfile+'_slabs', exist_ok=True)
+        params = dict(version=GRID_SLAB_VERSION, z_FRB=z_FRB, ntrial=ntrial, seed=seed,
+                      Mlow=Mlow, Mhigh=Mhigh, r_max=r_max, dz_box=dz_box, f_hot=f_hot,
+                      M_icm=M_icm, spacing=spacing,
+                      hmf='table' if hmfe is None else type(hmfe).__name__)
+        params_file = os.path.join(outfile+'_slabs', 'params.json')
+        if (not os.path.isfile(params_file)
+                or frb_io.loadjson(params_file).get('key') != frb_io.hash_params(params)):
+            old_slabs = _slab_files(outfile)
+            if verbose and len(old_slabs) > 0:
+                print("Parameters changed;  discarding {} slabs in {}".format(
+                    len(old_slabs), outfile+'_slabs'))
+            for ifile in old_slabs:
+                os.remove(ifile)
+            with open(params_file, 'wt') as fh:
+                json.dump(dict(key=frb_io.hash_params(params), params=params), fh)
+    else:
+        all_halos = []
+
+    # Loop on slabs
+    for ss in range(nbox):
+        slab_file = None if outfile is None else _slab_file(outfile, ss)
+        if slab_file is not None and os.path.isfile(slab_file):
+            halos = dict(np.load(slab_file))
+        else:
+            rng = np.random.default_rng(slab_seeds[ss])
+            zbox = (zbounds[ss] + zbounds[ss+1]) / 2.
+            D_lo, D_hi = cosmo.comoving_distance(zbounds[ss:ss+2]).to('Mpc').value
+            rM, X_c, Y_c, z_ran = _slab_halos(rng, hmfe, zbox, D_lo, D_hi, base_l,
+                                              Mlow, Mhigh, D_to_z)
+            log_M = np.log10(rM)
+
+            # Maximum impact parameter (cMpc)
+            r200, _ = cgm.halo_params_many(log_M, z_ran)
+            R_lim = r_max * r200 * (1+z_ran) / 1000.
+
+            # Intersections;  bin by mass so the search radius stays tight
+            halo_idx, trial_idx, R_com = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)]
+            lM_bins = np.arange(np.log10(Mlow), np.log10(Mhigh)+0.5, 0.5)
+            ibin = np.digitize(log_M, lM_bins)
+            for ib in np.unique(ibin):
+                in_bin = np.where(ibin == ib)[0]
+                halo_tree = cKDTree(np.array([X_c[in_bin], Y_c[in_bin]]).T)
+                pairs = halo_tree.sparse_distance_matrix(
+                    sight_tree, np.max(R_lim[in_bin]), output_type='ndarray')
+                keep = pairs['v'] < R_lim[in_bin[pairs['i']]]
+                halo_idx.append(in_bin[pairs['i'][keep]])
+                trial_idx.append(pairs['j'][keep])
+                R_com.append(pairs['v'][keep])
+            halo_idx = np.concatenate(halo_idx)
+            trial_idx = np.concatenate(trial_idx)
+            R_phys = np.concatenate(R_com) * 1000. / (1+z_ran[halo_idx])  # kpc
+
+            # DMs
+            z_hit = z_ran[halo_idx]
+            DM = np.zeros(halo_idx.size)
+            cgm_hit = rM[halo_idx] <= M_icm
+            DM[cgm_hit] = cgm.Ne_Rperp_many(R_phys[cgm_hit], log_M[halo_idx[cgm_hit]],
+                                            z_hit[cgm_hit], rmax=r_max, method='table',
+                                            add_units=False)
+            # ICM halos are rare;  one model per halo
+            for ihalo in np.unique(halo_idx[~cgm_hit]):
+                icm = ICM(log_Mhalo=log_M[ihalo], z=z_ran[ihalo])
+                for kk in np.where(halo_idx == ihalo)[0]:
+                    DM[kk] = icm.Ne_Rperp(R_phys[kk]*units.kpc, rmax=r_max, add_units=False)
+            DM /= (1+z_hit)
+
+            halos = dict(trial=trial_idx, M=rM[halo_idx], R=R_phys, DM=DM, z=z_hit)
+            if slab_file is not None:
+                tmp_file = slab_file.replace('.npz', '.tmp.npz')
+                np.savez(tmp_file, **halos)
+                os.replace(tmp_file, slab_file)
+            if verbose:
+                V = (D_hi-D_lo) * base_l**2 * units.Mpc**3
+                M_m = (cosmo.critical_density(zbox)*cosmo.Om(zbox) * V/(1+zbox)**3).to('M_sun')
+                print("z: {:.3f}  Mhalo/M_m = {:.3f}  N_halo = {}  N_hit = {}".format(
+                    zbox, np.sum(rM)/M_m.value, rM.size, halo_idx.size))
+
+        # Save em
+        iz = np.minimum((halos['z']/dz_grid).astype(int), nz-1)
+        DM_grid += np.bincount(halos['trial']*nz + iz, weights=halos['DM'],
+                               minlength=ntrial*nz).reshape(ntrial, nz)
+        if outfile is None:
+            all_halos.append(halos)
 
     # Write
     if outfile is not None:
-        print("Writing to {}".format(outfile))
+        if verbose:
+            print("Writing to {}".format(outfile))
         np.save(outfile, DM_grid, allow_pickle=False)
-        halo_tbl.write(outfile+'.fits', overwrite=True)
+        return DM_grid, None
 
-    return DM_grid, halo_tbl
+    # Table the halos
+    halo_tbl = Table()
+    for key in ['trial', 'M', 'R', 'DM', 'z']:
+        halo_tbl[key] = np.concatenate([halos[key] for halos in all_halos])
 
+    return DM_grid, halo_tbl
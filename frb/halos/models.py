@@ -3,6 +3,7 @@
 from __future__ import print_function, absolute_import, division, unicode_literals
 
 import numpy as np
+import os
 import pdb
 import warnings
 
@@ -11,6 +12,7 @@ import importlib_resources
 from scipy.interpolate import InterpolatedUnivariateSpline as IUS
 from scipy.special import hyp2f1
 from scipy.interpolate import interp1d
+from scipy.interpolate import RectBivariateSpline
 from scipy.optimize import fsolve
 
 from astropy.coordinates import SkyCoord,Angle
@@ -19,6 +21,7 @@ from astropy import constants
 from astropy.table import Table
 
 from frb.defs import frb_cosmo as cosmo
+from frb import io as frb_io
 
 from IPython import embed
 
@@ -32,116 +35,49 @@ def init_hmf():
     WARNING: This uses the original version which codes Tinker+2008
     We may refactor to use the more accurate, new version
 
+    See frb.halos.hmf.init_hmf, which this calls
+
     Returns:
+        hmfe (hmf_emulator.hmf_emulator): An Aemulus halo mass function emulator.
 
     """
-    # Hidden here to avoid it becoming a dependency
-    import hmf_emulator
-    # Setup HMF
-    # https://github.com/astropy/astropy/blob/master/astropy/cosmology/parameters.py
-    #sigma8 = 0.8159
-    ns = 0.9667
-    Neff = 3.046
-    #cosmo_dict = {"om":cosmo.Om0,"ob":cosmo.Ob0,"ol":1.-cosmo.Om0,"ok":0.0,
-    #              "h":cosmo.h,"s8":sigma8,"ns":ns,"w0":-1.0,"Neff":Neff} # "wa":0.0 is assumed internally
-    cosmo_dict = {"omega_cdm":(cosmo.Om0-cosmo.Ob0)*cosmo.h**2,
-                  "omega_b":cosmo.Ob0*cosmo.h**2,"ok":0.0,
-                  "ln10As": 3.098, # THIS REPLACES sigma8
-                  "H0":cosmo.H0.to('km/(s*Mpc)').value,
-                  "n_s":ns,"w0":-1.0,"N_eff":Neff} # "wa":0.0 is assumed internally
-    hmfe = hmf_emulator.hmf_emulator()
-    hmfe.set_cosmology(cosmo_dict)
-    # Return
-    return hmfe
-
-# Storing for use
-try:
-    import hmf_emulator
-except:
-    pass
-else:
-    hmfe = init_hmf()
+    # Imported here as hmf imports this module
+    from frb.halos import hmf
+    return hmf.init_hmf()
+
+def __getattr__(name):
+    # hmfe used to be built at import;  it is now shared with halos.hmf
+    if name == 'hmfe':
+        from frb.halos import hmf
+        return hmf.get_hmfe()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def frac_in_halos(zvals, Mlow, Mhigh, rmax=1.):
     """
     Calculate the fraction of matter in collapsed halos
      over a mass range and at a given redshift
 
-    Note that the fraction of DM associated with these halos
-    will be scaled down by an additional factor of f_diffuse
+    See frb.halos.hmf.frac_in_halos, which this calls
 
     Requires Aemulus HMF to be installed
 
-    Args:
-        zvals: ndarray
-        Mlow: float
-          In h^-1 units already so this will be applied for the halo mass function
-        Mhigh: float
-          In h^-1 units already
-        rmax: float
-          Extent of the halo in units of rvir
-          WARNING: This calculation assumes a single concentration for all halos
-
     Returns:
         ratios: ndarray
           rho_halo / rho_m
     """
+    # Imported here as hmf imports this module
+    from frb.halos import hmf
+    return hmf.frac_in_halos(zvals, Mlow, Mhigh, rmax=rmax)
 
-    M = np.logspace(np.log10(Mlow*cosmo.h), np.log10(Mhigh*cosmo.h), num=1000)
-    lM = np.log(M)
 
-    ratios = []
-    for z in zvals:
-        # Setup
-        #dndlM = np.array([hmfe.dndlnM(Mi, a)[0] for Mi in M])
-        dndlM = M*hmfe.dndM(M, z)
-        M_spl = IUS(lM, M * dndlM)
-
-        # Integrate
-        rho_tot = M_spl.integral(np.log(Mlow*cosmo.h), np.log(Mhigh*cosmo.h)) * units.M_sun / units.Mpc ** 3
-        # Cosmology
-        rho_M = cosmo.critical_density(z) * cosmo.Om(z)/(1+z)**3  # Tinker calculations are all mass 
-        ratio = (rho_tot*cosmo.h**2 / rho_M).decompose()
-        #
-        ratios.append(ratio)
-    ratios = np.array(ratios)
-    # Boost halos if extend beyond rvir (homologous in mass, but constant concentration is an approx)
-    if rmax != 1.:
-        #from pyigm.cgm.models import ModifiedNFW
-        c = 7.7
-        nfw = ModifiedNFW(c=c)
-        M_ratio = nfw.fy_dm(rmax * nfw.c) / nfw.fy_dm(nfw.c)
-        ratios *= M_ratio
-    # Return
-    return np.array(ratios)
-
-
-def halo_incidence(Mlow, zFRB, radius=None, hmfe=None, Mhigh=1e16, nsample=20,
-                   cumul=False):
+def halo_incidence(Mlow, zFRB, **kwargs):
     """
     Calculate the (approximate) average number of intersections to halos of a
     given minimum mass to a given zFRB.
 
-    Requires Aemulus HMF to be installed
+    See frb.halos.hmf.halo_incidence, which this calls
 
-    Args:
-        Mlow: float
-          Mass of minimum halo in Solar masses
-          The code deals with h^-1 factors so that you do not
-          The minimum value is 2e10
-        zFRB: float
-          Redshift of the FRB
-        radius: Quantity, optional
-          The calculation will specify this radius as rvir derived from
-           Mlow unless this is specified. And this rvir *will* vary with redshift
-        hmfe (hmf.hmf_emulator, optional): Halo mass function emulator from Aeumulus
-        Mhigh: float, optional
-          Mass of maximum halo in Solar masses
-        nsammple: int, optional
-          Number of samplings in redshift
-          20 should be enough
-        cumul: bool, optional
-          Return the cumulative quantities instead
+    Requires Aemulus HMF to be installed
 
     Returns:
         If cumul is False
@@ -150,75 +86,24 @@ def halo_incidence(Mlow, zFRB, radius=None, hmfe=None, Mhigh=1e16, nsample=20,
         elif cumul is True
         zeval: ndarray
         Ncumul: ndarray
+        None if Mlow < 2e10
     """
     # Mlow limit
     if Mlow < 2e10:
         warnings.warn("Calculations are limited to Mlow > 2e10")
         return
-    # HMF
-    if hmfe is None:
-        hmfe = init_hmf()
-    #
-    zs = np.linspace(0., zFRB, nsample)
-    # Mean density
-    ns = []
-    for iz in zs:
-        ns.append(hmfe.n_in_bins((Mlow * cosmo.h, Mhigh * cosmo.h), iz) * cosmo.h**3)  # * units.Mpc**-3
-    # Interpolate
-    ns = units.Quantity(ns*units.Mpc**-3).T
-    # Radii
-    if radius is None:
-        rhoc = cosmo.critical_density(zs)
-        #https://arxiv.org/pdf/1312.4629.pdf eq5
-        q = cosmo.Ode0/(cosmo.Ode0+cosmo.Om0*(1+zs)**3)
-        rhovir = (18*np.pi**2-82*q-39*q**2)*rhoc
-        r200 = (((3*Mlow*constants.M_sun.cgs) / (4*np.pi*rhovir))**(1/3)).to('kpc')
-    else:
-        r200 = np.ones_like(zs) * radius
-    # Ap
-    Ap = np.pi * r200**2
-
-    # l(X)
-    loX = ((constants.c/cosmo.H0) * ns * Ap).decompose().value
-
-    # dX
-    X = cosmo.absorption_distance(zs)
-    dX = X - np.roll(X,1)
-    dX[0] = 0.
-
-    # Finish
-    if cumul:
-        Navg = np.cumsum(loX * dX)
-        return zs, Navg
-    else:
-        Navg = np.sum(loX * dX)
-        return Navg
+    # Imported here as hmf imports this module
+    from frb.halos import hmf
+    return hmf.halo_incidence(Mlow, zFRB, **kwargs)
 
 
-def build_grid(z_FRB=1., ntrial=10, seed=12345, Mlow=1e10, r_max=2., outfile=None, dz_box=0.1,
-    dz_grid=0.01, f_hot=0.75, verbose=True):
+def build_grid(**kwargs):
     """
     Generate a universe of dark matter halos with DM measurements
-    Mainly an internal function for generating useful output grids.
 
-    Requires the Aemulus Halo Mass function
+    See frb.halos.hmf.build_grid, which this calls
 
-    Args:
-        z_FRB: float, optional
-        ntrial: int, optional
-        seed: int, optional
-        Mlow: float, optional
-          h^-1 mass
-        r_max: float, optional
-          Extent of the halo in units of rvir
-        outfile: str, optional
-          Write
-        dz_box: float, optional
-          Size of the slice of the universe for each sub-calculation
-        dz_grid: float, optional
-          redshift spacing in the DM grid
-        f_hot: float
-          Fraction of the cosmic fraction of matter in diffuse gas (for DM)
+    Requires the Aemulus Halo Mass function
 
     Returns:
         DM_grid: ndarray (ntrial, nz)
@@ -226,176 +111,9 @@ def build_grid(z_FRB=1., ntrial=10, seed=12345, Mlow=1e10, r_max=2., outfile=Non
           Table of all the halos intersected
 
     """
-    Mhigh = 1e16  # Msun
-    # mNFW
-    y0 = 2.
-    alpha = 2.
-
-    warnings.warn("Ought to do concentration properly someday!")
-    cgm = ModifiedNFW(alpha=alpha, y0=y0, f_hot=f_hot)
-    icm = ICM()
-
-    # Random numbers
-    rstate = np.random.RandomState(seed)
-
-    # Init HMF
-    hmfe = init_hmf()
-
-    # Boxes
-    nbox = int(z_FRB / dz_box)
-    nz = int(z_FRB / dz_grid)
-    dX = int(np.sqrt(ntrial))+1
-    #
-    npad = 6 # Mpc
-    base_l = 2*dX + npad
-    print('L_base = {} cMpc'.format(base_l))
-    warnings.warn("Worry about being big enough given cMpc vs pMpc")
-
-    DM_grid = np.zeros((ntrial,nz))
-
-    # Spline distance to z
-    D_max = cosmo.comoving_distance(z_FRB)
-    D_val = np.linspace(1e-3,D_max.value,200) # IS THIS FINE ENOUGH?
-    z_val = np.array([z_at_value(cosmo.comoving_distance, iz) for iz in D_val*units.Mpc])
-    D_to_z = IUS(D_val, z_val)
-
-    # Save halo info
-    #halos = [[] for i in range(ntrial)]
-    halo_i, M_i, R_i, DM_i, z_i = [], [], [], [], []
-
-    # Loop me
-    prev_zbox = 0.
-    #for ss in range(nbox):
-    #for ss in [0]:
-    for ss in [5]:
-        zbox = ss*dz_box + dz_box/2.
-        print('zbox = {}'.format(zbox))
-        a = 1./(1.0 + zbox) # Scale factor
-        # Mass function
-        M = np.logspace(np.log10(Mlow*cosmo.h), np.log10(Mhigh*cosmo.h), num=1000)
-        lM = np.log(M)
-        dndlM = np.array([hmf.dndlM(Mi, a) for Mi in M])
-        n_spl = IUS(lM, dndlM)
-        cum_n = np.array([n_spl.integral(np.log(Mlow*cosmo.h), ilM) for ilM in lM])
-        ncum_n = cum_n/cum_n[-1]
-        # As z increases, we have numerical issues at the high mass end (they are too rare)
-        try:
-            mhalo_spl = IUS(ncum_n, lM)
-        except ValueError:
-            # Kludge me
-            print("REDUCING Mhigh by 2x")
-            Mhigh /= 2.
-            M = np.logspace(np.log10(Mlow*cosmo.h), np.log10(Mhigh*cosmo.h), num=1000)
-            lM = np.log(M)
-            dndlM = np.array([hmf.dndlM(Mi, a) for Mi in M])
-            n_spl = IUS(lM, dndlM)
-            cum_n = np.array([n_spl.integral(np.log(Mlow*cosmo.h), ilM) for ilM in lM])
-            ncum_n = cum_n/cum_n[-1]
-            #
-            mhalo_spl = IUS(ncum_n, lM)
-
-        # Volume -- Box with base l = 2Mpc
-        D_zn = cosmo.comoving_distance(zbox + dz_box/2.) # Full box
-        D_zp = cosmo.comoving_distance(ss*dz_box) # Previous
-        D_z = D_zn - D_zp
-        V = D_z * (base_l*units.Mpc)**2
-
-        # Average N_halo
-        avg_n = hmf.n_bin(Mlow*cosmo.h, Mhigh*cosmo.h, a) * cosmo.h**3 * units.Mpc**-3
-        avg_N = (V * avg_n).value
-
-        # Assume Gaussian stats for number of halos
-        N_halo = int(np.round(avg_N + np.sqrt(avg_N)*rstate.randn(1)))
-
-        # Random masses
-        randM = rstate.random_sample(N_halo)
-        rM = np.exp(mhalo_spl(randM)) / cosmo.h
-
-        # r200
-        r200 = (((3*rM*units.M_sun.cgs) / (4*np.pi*200*cosmo.critical_density(zbox)))**(1/3)).to('kpc')
-
-        # Random locations (X,Y,Z)
-        X_c = rstate.random_sample(N_halo)*base_l # Mpc
-        Y_c = rstate.random_sample(N_halo)*base_l # Mpc
-        Z_c = (rstate.random_sample(N_halo)*D_z.to('Mpc') + D_zp).value
-
-        # Check mass fraction
-        if verbose:
-            Mtot = np.log10(np.sum(rM))
-            M_m = (cosmo.critical_density(zbox)*cosmo.Om(zbox) * V/(1+zbox)**3).to('M_sun')
-            #print("N_halo: {}  avg_N: {}".format(N_halo, avg_N))
-            print("z: {}  Mhalo/M_m = {}".format(zbox, 10**Mtot/M_m.value))
-            print(frac_in_halos([zbox], Mlow, Mhigh))
-
-        # Redshifts
-        z_ran = D_to_z(Z_c)
-
-        # Loop on trials
-        all_DMs = []
-        all_nhalo = []
-        all_r200 = []
-        for itrial in range(ntrial):
-            # X,Y trial
-            X_trial = npad//2 + (2*itrial%dX)  # Step by 2Mpc
-            Y_trial = npad//2 + 2*itrial // dX
-            # Impact parameters
-            try:
-                R_com = np.sqrt((X_c-X_trial)**2 + (Y_c-Y_trial)**2)  # Mpc
-            except:
-                pdb.set_trace()
-            R_phys = R_com * 1000. / (1+z_ran) * units.kpc
-            # Cut
-            intersect = R_phys < r_max*r200
-            print("We hit {} halos".format(np.sum(intersect)))
-            all_nhalo.append(np.sum(intersect))
-            if not np.any(intersect):
-                all_DMs.append(0.)
-                continue
-            # Loop -- FIND A WAY TO SPEED THIS UP!
-            DMs = []
-            for iobj in np.where(intersect)[0]:
-                # Init
-                if rM[iobj] > 1e14: # Use ICM model
-                    model = icm
-                else:
-                    model = cgm
-                model.log_Mhalo=np.log10(rM[iobj])
-                model.M_halo = 10.**model.log_Mhalo * constants.M_sun.cgs
-                model.z = zbox # To be consistent with above;  should be close enough
-                model.setup_param(cosmo=cosmo)
-                # DM
-                DM = model.Ne_Rperp(R_phys[iobj], rmax=r_max, add_units=False)/(1+model.z)
-                DMs.append(DM)
-                # Save halo info
-                halo_i.append(itrial)
-                M_i.append(model.M_halo.value)
-                R_i.append(R_phys[iobj].value)
-                DM_i.append(DM)
-                z_i.append(z_ran[iobj])
-                all_r200.append(cgm.r200.value)
-            # Save em
-            iz = (z_ran[intersect]/dz_grid).astype(int)
-            DM_grid[itrial,iz] += DMs
-            all_DMs.append(np.sum(DMs))
-            #print(DMs, np.log10(rM[intersect]), R_phys[intersect])
-            if (itrial % 100) == 0:
-                pdb.set_trace()
-
-    # Table the halos
-    halo_tbl = Table()
-    halo_tbl['trial'] = halo_i
-    halo_tbl['M'] = M_i
-    halo_tbl['R'] = R_i
-    halo_tbl['DM'] = DM_i
-    halo_tbl['z'] = z_i
-
-    # Write
-    if outfile is not None:
-        print("Writing to {}".format(outfile))
-        np.save(outfile, DM_grid, allow_pickle=False)
-        halo_tbl.write(outfile+'.fits', overwrite=True)
-
-    return DM_grid, halo_tbl
+    # Imported here as hmf imports this module
+    from frb.halos import hmf
+    return hmf.build_grid(**kwargs)
 
 
 def rad3d2(xyz):
@@ -414,6 +132,11 @@ def rad3d2(xyz):
     return xyz[0]**2 + xyz[1]**2 + xyz[-1]**2
 
 
+# Moster+2013 SHMR parameters (Table 1);  N10, N11, beta10, beta11, gamma10, gamma11, M10, M11
+moster13_params = np.array([0.0351, -0.0247, 1.376, -0.826, 0.608, 0.329, 11.59, 1.195])
+moster13_errors = np.array([0.0058, 0.0069, 0.153, 0.225, 0.059, 0.173, 0.236, 0.353])
+
+
 def stellarmass_from_halomass(log_Mhalo,z=0, params=None):
     """ Stellar mass from Halo Mass from Moster+2013
     https://doi.org/10.1093/mnras/sts261
@@ -423,6 +146,8 @@ def stellarmass_from_halomass(log_Mhalo,z=0, params=None):
             in solar mass units. 
         z (float, optional): halo redshift.
             Assumed to be 0 by default.
+        params (list, optional): N10,N11,beta10,beta11,gamma10,gamma11,M10,M11
+            Each may be an array that broadcasts with log_Mhalo and z.
     Returns:
         log_mstar (float): log_10 galaxy stellar mass
             in solar mass units.
@@ -431,16 +156,8 @@ def stellarmass_from_halomass(log_Mhalo,z=0, params=None):
     # Define model parameters from Table 1
     # of the paper if not supplied
     if params is None:
-        N10 = 0.0351
-        N11 = -0.0247
-        beta10 = 1.376
-        beta11 = -0.826
-        gamma10 = 0.608
-        gamma11 = 0.329
-        M10 = 11.59
-        M11 = 1.195
-    else:
-        N10,N11,beta10,beta11,gamma10,gamma11,M10,M11 = params
+        params = moster13_params
+    N10,N11,beta10,beta11,gamma10,gamma11,M10,M11 = params
 
     # Get redshift dependent parameters
     # from equations 11-14.
@@ -449,16 +166,65 @@ def stellarmass_from_halomass(log_Mhalo,z=0, params=None):
     beta = beta10 + beta11*z_factor
     gamma = gamma10 + gamma11*z_factor
     logM1 = M10 + M11*z_factor
-    M1 = 10**logM1
 
-    M_halo = 10**log_Mhalo
-    
-    # Simple
-    log_mstar = log_Mhalo + np.log10(2*N) - np.log10((M_halo/M1)**-beta+(M_halo/M1)**gamma)
+    # Simple;  in terms of log10(M_halo/M1) to avoid overflows
+    x = log_Mhalo - logM1
+    log_mstar = log_Mhalo + np.log10(2*N) - np.log10(10**(-beta*x)+10**(gamma*x))
     # Done
     return log_mstar
 
 
+def _invert_shmr(log_mstar, z=0, params=None, niter=60, tol=1e-10):
+    """ Vectorized inversion of stellarmass_from_halomass
+
+    Newton steps, starting from the broken power-law asymptotes,
+    safeguarded by bisection on the bracket [log_mstar, log_mstar+12]
+    for the halo mass
+
+    Args:
+        log_mstar (float or numpy.ndarray): log_10 stellar mass
+        z (float or numpy.ndarray, optional): redshift
+        params (list, optional): Passed to stellarmass_from_halomass
+        niter (int, optional): Maximum number of iterations
+        tol (float, optional): Convergence in dex
+
+    Returns:
+        numpy.ndarray: log_10 halo mass, broadcast over the inputs
+    """
+    if params is None:
+        params = moster13_params
+    N10,N11,beta10,beta11,gamma10,gamma11,M10,M11 = params
+    z_factor = z/(1+z)
+    log2N = np.log10(2*(N10 + N11*z_factor))
+    beta = beta10 + beta11*z_factor
+    gamma = gamma10 + gamma11*z_factor
+    logM1 = M10 + M11*z_factor
+    bg = (beta+gamma)*np.log(10.)
+
+    log_mstar = np.asarray(log_mstar, dtype=float)
+    lo = log_mstar + 0*(log2N+logM1+bg)
+    hi = lo + 12.
+    # Start from the broken power-law asymptotes
+    y = log_mstar - logM1 - log2N
+    log_Mhalo = np.clip(logM1 + np.where(y < 0, y/(1+beta), y/(1-gamma)), lo, hi)
+    for _ in range(niter):
+        # log_mstar(log_Mhalo) - target and its derivative
+        x = log_Mhalo - logM1
+        t = np.exp(-bg*x)
+        f = log_Mhalo + log2N - gamma*x - np.log1p(t)/np.log(10.) - log_mstar
+        df = 1 - gamma + (beta+gamma) * t/(1+t)
+        # Update the bracket
+        hi = np.where(f > 0, log_Mhalo, hi)
+        lo = np.where(f > 0, lo, log_Mhalo)
+        # Newton step;  bisect if it leaves the bracket
+        new = log_Mhalo - f/df
+        new = np.where((new >= lo) & (new <= hi), new, (lo + hi)/2.)
+        if np.all(np.abs(new - log_Mhalo) < tol):
+            return new
+        log_Mhalo = new
+    return log_Mhalo
+
+
 def halomass_from_stellarmass(log_mstar,z=0, randomize=False):
     """ Halo mass from Stellar mass (Moster+2013).
     Inverts the function `stellarmass_from_halomass`
@@ -468,6 +234,9 @@ def halomass_from_stellarmass(log_mstar,z=0, randomize=False):
         log_mstar (float or numpy.ndarray): log_10 stellar mass
             in solar mass units.
         z (float, optional): galaxy redshift
+        randomize (bool, optional): Draw one set of the SHMR
+            parameters from their uncertainties.
+            See halomass_realizations for many draws
 
     Returns:
         log_Mhalo (float): log_10 halo mass
@@ -479,24 +248,156 @@ def halomass_from_stellarmass(log_mstar,z=0, randomize=False):
         raise TypeError("log_mstar and z can't be broadcast together for root finding. Use numpy arrays of same length or scalar values.")
 
     if not randomize:
-        f = lambda x: stellarmass_from_halomass(x, z = z)-log_mstar
+        params = None
     else:
         np.random.seed()
-        N10 = np.random.normal(0.0351, 0.0058)
-        N11 = np.random.normal(-0.0247, 0.0069)
-        beta10 = np.random.normal(1.376, 0.153)
-        beta11 = np.random.normal(-0.826, 0.225)
-        gamma10 = np.random.normal(0.608, 0.059)
-        gamma11 = np.random.normal(0.329, 0.173)
-        M10 = np.random.normal(11.59, 0.236)
-        M11 = np.random.normal(1.195, 0.353)
-        params = [N10,N11,beta10,beta11,gamma10,gamma11,M10,M11]
-        f = lambda x: stellarmass_from_halomass(x, z = z, params = params)-log_mstar
-    guess = 2+log_mstar
+        params = np.random.normal(moster13_params, moster13_errors)
+    log_Mhalo = _invert_shmr(log_mstar, z=z, params=params)
     if hasattr(log_mstar, "__iter__"):
-        return fsolve(f, guess)
+        return log_Mhalo
     else:
-        return fsolve(f, guess)[0]
+        return float(log_Mhalo)
+
+
+def halomass_realizations(log_mstar, z=0, n_halo=1000, seed=None, chunk_size=2**22):
+    """ Realizations of the halo mass for each stellar mass
+    drawing the Moster+2013 SHMR parameters from their uncertainties.
+    Vectorized version of halomass_from_stellarmass(randomize=True)
+
+    Each column uses one draw of the SHMR parameters for all stellar masses.
+
+    Args:
+        log_mstar (float or numpy.ndarray): log_10 stellar masses
+            in solar mass units;  shape (n_mstar,)
+        z (float or numpy.ndarray, optional): redshift(s);  broadcast with log_mstar
+        n_halo (int, optional): Number of realizations
+        seed (int or numpy.random.Generator, optional):
+        chunk_size (int, optional): Maximum number of elements solved at once
+
+    Returns:
+        numpy.ndarray: log_10 halo masses, shape (n_mstar, n_halo)
+    """
+    rng = np.random.default_rng(seed)
+    params = rng.normal(moster13_params[:, None], moster13_errors[:, None], size=(8, n_halo))
+    log_mstar, z = np.broadcast_arrays(np.atleast_1d(np.asarray(log_mstar, dtype=float)),
+                                       np.atleast_1d(np.asarray(z, dtype=float)))
+    log_Mhalo = np.zeros((log_mstar.size, n_halo))
+    nrow = max(1, chunk_size // n_halo)
+    for ss in range(0, log_mstar.size, nrow):
+        rows = slice(ss, ss+nrow)
+        log_Mhalo[rows] = _invert_shmr(log_mstar[rows, None], z=z[rows, None], params=params)
+    return log_Mhalo
+
+
+# Projected mNFW profile
+MNFW_TABLE_VERSION = 1
+mnfw_table_log_ymax = np.linspace(-1., 2.5, 141)  # log10(rmax*c)
+mnfw_table_log_x = np.linspace(-6., 0., 241)  # log10(yR/ymax)
+_mnfw_splines = {}
+
+
+def _mnfw_column(yR, ymax, alpha, y0, nquad=64, chunk_size=2**16):
+    """ Dimensionless column of the mNFW profile
+
+    Integrates y**(alpha-1) / (y0+y)**(2+alpha) along a sightline
+    at scaled impact parameter yR through a sphere of radius ymax
+    (both in units of r200/c).  Uses Gauss-Legendre quadrature
+    in s = asinh(l/yR), which absorbs the cusp at small yR.
+
+    Args:
+        yR (float or ndarray): Scaled impact parameters, > 0
+        ymax (float or ndarray): Scaled truncation radii, >= yR
+        alpha (float):
+        y0 (float):
+        nquad (int, optional): Number of quadrature nodes
+        chunk_size (int, optional): Sightlines per pass (limits memory)
+
+    Returns:
+        ndarray: Column for each sightline, shape of the broadcast inputs
+    """
+    yR, ymax = np.broadcast_arrays(np.asarray(yR, dtype=float),
+                                   np.asarray(ymax, dtype=float))
+    shape = yR.shape
+    yR, ymax = yR.ravel(), ymax.ravel()
+    # Gauss-Legendre nodes on [0,1]
+    xq, wq = np.polynomial.legendre.leggauss(nquad)
+    xq, wq = (xq+1)/2, wq/2
+
+    column = np.zeros(yR.size)
+    for ss in range(0, yR.size, chunk_size):
+        ii = slice(ss, ss+chunk_size)
+        smax = np.arcsinh(np.sqrt(np.maximum(ymax[ii]**2 - yR[ii]**2, 0.)) / yR[ii])
+        # y along the sightline;  dl = y ds
+        y = yR[ii, None] * np.cosh(smax[:, None] * xq[None, :])
+        integrand = y**alpha / (y0 + y)**(2+alpha)
+        column[ii] = 2 * smax * (integrand @ wq)
+    return column.reshape(shape)
+
+
+def mnfw_projected_table(alpha, y0, cache_dir=None):
+    """ Load (or build and cache) the projected mNFW profile table
+
+    The mNFW profile is self-similar in y = c*r/r200 so the column
+    through a halo is a normalization times a function of
+    ymax = rmax*c and x = yR/ymax.  The table holds that function
+    divided by sqrt(1-x**2), which removes the edge behaviour and
+    leaves a smooth surface in (log10 ymax, log10 x).
+
+    Written to the frb user cache (see frb.io.user_cache_dir)
+
+    Args:
+        alpha (float):
+        y0 (float):
+        cache_dir (str, optional): Override the cache location
+
+    Returns:
+        dict: log_ymax, log_x and column (nymax, nx) arrays
+    """
+    log_ymax, log_x = mnfw_table_log_ymax, mnfw_table_log_x
+    params = dict(alpha=float(alpha), y0=float(y0), log_ymax=log_ymax,
+                  log_x=log_x, version=MNFW_TABLE_VERSION)
+    if cache_dir is None:
+        cache_dir = frb_io.user_cache_dir('mNFW')
+    path = os.path.join(cache_dir, 'projected_{}'.format(frb_io.hash_params(params)))
+    if not os.path.isdir(path):
+        ymax = 10.**log_ymax[:, None]
+        x = 10.**log_x[None, :]
+        column = _mnfw_column(x*ymax, ymax, alpha, y0, nquad=128)
+        # Edge values (x=1) from the limit
+        column[:, -1] = 2*ymax[:, 0]**alpha / (y0 + ymax[:, 0])**(2+alpha)
+        column[:, :-1] /= np.sqrt(1 - x[:, :-1]**2)
+        frb_io.save_npy_dir(path, dict(log_ymax=log_ymax, log_x=log_x, column=column),
+                            meta=dict(alpha=float(alpha), y0=float(y0),
+                                      version=MNFW_TABLE_VERSION))
+    return frb_io.load_npy_dir(path)
+
+
+def mnfw_projected_column(yR, ymax, alpha, y0):
+    """ Dimensionless mNFW column interpolated from mnfw_projected_table
+
+    Args:
+        yR (float or ndarray): Scaled impact parameters
+        ymax (float or ndarray): Scaled truncation radii
+
+    Returns:
+        ndarray: Column for each sightline;  0 for yR > ymax
+    """
+    key = (float(alpha), float(y0))
+    if key not in _mnfw_splines:
+        tbl = mnfw_projected_table(alpha, y0)
+        _mnfw_splines[key] = RectBivariateSpline(tbl['log_ymax'], tbl['log_x'],
+                                                 tbl['column'])
+    yR, ymax = np.broadcast_arrays(np.asarray(yR, dtype=float),
+                                   np.asarray(ymax, dtype=float))
+    log_ymax = np.log10(ymax)
+    if np.any(log_ymax < mnfw_table_log_ymax[0]) or np.any(log_ymax > mnfw_table_log_ymax[-1]):
+        raise IOError("rmax*c is outside the range of the mNFW table")
+    x = yR / ymax
+    inside = x <= 1.
+    log_x = np.log10(np.clip(x, 10.**mnfw_table_log_x[0], 1.))
+    column = _mnfw_splines[key](log_ymax, log_x, grid=False)
+    column *= np.sqrt(1 - np.minimum(x, 1.)**2)
+    return np.where(inside, column, 0.)
 
 
 class ModifiedNFW(object):
@@ -570,7 +471,7 @@ class ModifiedNFW(object):
         self.rho0 = self.rhovir/3 * self.c**3 / self.fy_dm(self.c)   # Central density
         # Baryons
         self.M_b = self.M_halo * self.fb
-        self.rho0_b = (self.M_b / (4*np.pi) * (self.c/self.r200)**3 / self.fy_b(self.c)).cgs
+        self.rho0_b = (self.M_b / (4*np.pi) * (self.c/self.r200)**3 / self.fy_b(self.c)).to(units.g/units.cm**3)
         # Misc
         self.mu = 1.33   # Reduced mass correction for Helium
 
@@ -674,9 +575,11 @@ class ModifiedNFW(object):
         # Return
         return rho
 
-    def Ne_Rperp(self, Rperp, step_size=0.1*units.kpc, rmax=1., add_units=True, cumul=False):
+    def Ne_Rperp(self, Rperp, step_size=0.1*units.kpc, rmax=1., add_units=True, cumul=False,
+                 method='sum'):
         """ Calculate N_e at an input impact parameter Rperp
         Just a simple sum in steps of step_size
+        or an interpolation in the projected mNFW table
 
         Parameters
         ----------
@@ -689,6 +592,10 @@ class ModifiedNFW(object):
         add_units : bool, optional
           Speed up calculations by avoiding units
         cumul: bool, optional
+        method : str, optional
+          'sum' -- Sum along the sightline
+          'table' -- Interpolate mnfw_projected_table (mNFW profile only)
+            Rperp may then be an array;  cumul is not supported
 
         Returns
         -------
@@ -701,6 +608,16 @@ class ModifiedNFW(object):
           Ne: Quantity
              Column density of total electrons
         """
+        if method == 'table':
+            if cumul:
+                raise IOError("cumul is not supported with method='table'")
+            Ne = self.Ne_Rperp_table(Rperp, rmax=rmax)
+            if add_units:
+                return Ne * units.pc / units.cm**3
+            else:
+                return Ne
+        elif method != 'sum':
+            raise IOError("Bad method: {}".format(method))
         dz = step_size.to('kpc').value
 
         # Cut at rmax*rvir
@@ -730,10 +647,142 @@ class ModifiedNFW(object):
         else:
             return Ne
 
+    def halo_params_many(self, log_Mhalo, z):
+        """ r200 and rho0_b for many halos sharing this
+        profile (c, alpha, y0) and cosmology
+
+        Follows setup_param without touching the attributes
+
+        Parameters
+        ----------
+        log_Mhalo : float or ndarray
+          log10 of the Halo masses (solar masses)
+        z : float or ndarray
+          Redshifts of the halos
+
+        Returns
+        -------
+        r200 : ndarray
+          Virial radii in kpc
+        rho0_b : ndarray
+          Baryon density normalizations in g/cm**3
+        """
+        log_Mhalo, z = np.broadcast_arrays(np.asarray(log_Mhalo, dtype=float),
+                                           np.asarray(z, dtype=float))
+        M_halo = 10.**log_Mhalo * constants.M_sun.cgs.value  # g
+        rhoc = self.cosmo.critical_density(z).to('g/cm**3').value
+        q = self.cosmo.Ode0/(self.cosmo.Ode0+self.cosmo.Om0*(1+z)**3)
+        rhovir = (18*np.pi**2-82*q-39*q**2)*rhoc
+        r200 = ((3*M_halo) / (4*np.pi*rhovir))**(1/3)  # cm
+        fb = self.cosmo.Ob0/self.cosmo.Om0
+        rho0_b = M_halo*fb / (4*np.pi) * (self.c/r200)**3 / self.fy_b(self.c)
+        return r200 / units.kpc.to('cm'), rho0_b
+
+    def Ne_Rperp_many(self, Rperp, log_Mhalo, z, rmax=1., add_units=True,
+                      method='quad', nquad=64):
+        """ Calculate N_e for many (impact parameter, halo) pairs at once
+
+        The halos share this model's concentration, f_hot, alpha, y0
+        and cosmology while their masses and redshifts vary.  Each
+        sightline integral is evaluated with Gauss-Legendre quadrature
+        in s = asinh(l/Rperp), which absorbs the cusp at small Rperp,
+        so the result matches Ne_Rperp in the limit of a small step_size.
+
+        Parameters
+        ----------
+        Rperp : Quantity or ndarray
+          Impact parameters; kpc if not a Quantity
+        log_Mhalo : float or ndarray
+          log10 of the Halo masses (solar masses)
+        z : float or ndarray
+          Redshifts of the halos
+          All three inputs are broadcast against one another
+        rmax : float, optional
+          Maximum radius for integration in units of r200
+        add_units : bool, optional
+        method : str, optional
+          'quad' -- Quadrature along each sightline
+          'table' -- Interpolate the cached mnfw_projected_table
+        nquad : int, optional
+          Number of quadrature nodes per sightline
+
+        Returns
+        -------
+        Ne : Quantity or ndarray
+          Column density of total electrons (pc cm**-3)
+          for each pair;  0 beyond rmax*r200
+        """
+        self._check_mnfw_profile()
+        if isinstance(Rperp, units.Quantity):
+            Rperp = Rperp.to('kpc').value
+        Rperp, log_Mhalo, z = np.broadcast_arrays(np.asarray(Rperp, dtype=float),
+                                                  np.asarray(log_Mhalo, dtype=float),
+                                                  np.asarray(z, dtype=float))
+
+        # Halo properties
+        r200, rho0_b = self.halo_params_many(log_Mhalo, z)
+        ne0 = rho0_b * self.f_hot / self.mu / m_p * 1.1667  # cm**-3
+
+        # Dimensionless impact parameter;  floor it to keep asinh finite
+        ymax = rmax * self.c
+        yR = np.maximum(self.c * Rperp / r200, 1e-10*ymax)
+        inside = yR <= ymax
+
+        Ne = np.zeros(yR.shape)
+        if method == 'quad':
+            Ne[inside] = _mnfw_column(yR[inside], ymax, self.alpha, self.y0, nquad=nquad)
+        elif method == 'table':
+            Ne[inside] = mnfw_projected_column(yR[inside], ymax, self.alpha, self.y0)
+        else:
+            raise IOError("Bad method: {}".format(method))
+        # Scale to pc cm**-3
+        Ne *= ne0 * r200 / self.c * 1000
+
+        # Return
+        if add_units:
+            return Ne * units.pc / units.cm**3
+        else:
+            return Ne
+
+    def _check_mnfw_profile(self):
+        """ Raise an error unless this model has the plain mNFW
+        profile, i.e. one that the projected table describes
+        """
+        if (type(self).rho_b is not ModifiedNFW.rho_b or type(self).nH is not ModifiedNFW.nH
+                or type(self).ne is not ModifiedNFW.ne):
+            raise NotImplementedError("Only the ModifiedNFW profile is supported")
+        if self.zero_inner_ne > 0.:
+            raise NotImplementedError("zero_inner_ne is not supported")
+
+    def Ne_Rperp_table(self, Rperp, rmax=1.):
+        """ N_e at impact parameter(s) Rperp from the projected
+        mNFW table (see mnfw_projected_table)
+
+        Parameters
+        ----------
+        Rperp : Quantity
+          Impact parameter(s)
+        rmax : float, optional
+          Maximum radius for integration in units of r200
+
+        Returns
+        -------
+        Ne : float or ndarray
+          Column density of total electrons (pc cm**-3)
+        """
+        self._check_mnfw_profile()
+        r200 = self.r200.to('kpc').value
+        ymax = rmax * self.c
+        yR = np.maximum(self.c * Rperp.to('kpc').value / r200, 1e-10*ymax)
+        ne0 = (self.rho0_b * self.f_hot / self.mu / m_p).cgs.value * 1.1667  # cm**-3
+        return ne0 * r200 / self.c * 1000 * mnfw_projected_column(
+            yR, ymax, self.alpha, self.y0)
+
     def RM_Rperp(self, Rperp, Bparallel, step_size=0.1*units.kpc, rmax=1.,
-                 add_units=True, cumul=False, zmax=None):
+                 add_units=True, cumul=False, zmax=None, method='sum'):
         """ Calculate RM at an input impact parameter Rperp
         Just a simple sum in steps of step_size
+        or an interpolation in the projected mNFW table
         Assumes a constant Magnetic field
 
         Parameters
@@ -752,6 +801,10 @@ class ModifiedNFW(object):
         zmax: float, optional
           Maximum distance along the sightline to integrate.
           Default is rmax*rvir
+        method : str, optional
+          'sum' -- Sum along the sightline
+          'table' -- Interpolate mnfw_projected_table (mNFW profile only)
+            Rperp may then be an array;  cumul and zmax are not supported
 
         Returns
         -------
@@ -764,6 +817,18 @@ class ModifiedNFW(object):
           RM: Quantity
              Column density of total electrons
         """
+        if method == 'table':
+            if cumul or zmax is not None:
+                raise IOError("cumul and zmax are not supported with method='table'")
+            # Using Akahori & Ryu 2011
+            RM = 8.12e5 * Bparallel.to('microGauss').value * \
+                 self.Ne_Rperp_table(Rperp, rmax=rmax) / 1e6  # rad m**-2
+            if add_units:
+                return RM * units.rad / units.m**2
+            else:
+                return RM
+        elif method != 'sum':
+            raise IOError("Bad method: {}".format(method))
         dz = step_size.to('kpc').value
 
         # Cut at rmax*rvir
@@ -798,7 +863,7 @@ class ModifiedNFW(object):
         else:
             return RM
 
-    def mass_r(self, r, step_size=0.1*units.kpc):
+    def mass_r(self, r, step_size=0.1*units.kpc, method='sum'):
         """ Calculate baryonic halo mass (not total) to a given radius
         Just a simple sum in steps of step_size
 
@@ -808,6 +873,10 @@ class ModifiedNFW(object):
           Radius, typically in kpc
         step_size : Quantity, optional
           Step size used for numerical integration (sum)
+        method : str, optional
+          'sum' -- Sum in radius
+          'table' -- Closed form from the enclosed mass function fy_b
+            (mNFW profile only);  r may then be an array
 
         Returns
         -------
@@ -815,6 +884,13 @@ class ModifiedNFW(object):
              Enclosed baryonic mass within r
              Msun units
         """
+        if method == 'table':
+            self._check_mnfw_profile()
+            y = self.c * (r / self.r200).decompose().value
+            Mr = self.f_hot * self.M_b * self.fy_b(y) / self.fy_b(self.c)
+            return Mr.to('M_sun')
+        elif method != 'sum':
+            raise IOError("Bad method: {}".format(method))
         dr = step_size.to('kpc').value
 
         # Generate a sightline to rvir
@@ -1,32 +1,27 @@
 import numpy as np, os, glob
+import multiprocessing
+from functools import partial
 
 from astropy.table import Table, vstack, join
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from astropy.stats import sigma_clipped_stats
 
-from scipy.interpolate import interp1d, interp2d, RegularGridInterpolator
-from scipy.sparse import lil_matrix, save_npz
+from scipy.interpolate import interp1d, RegularGridInterpolator
+from scipy.sparse import csr_matrix, save_npz
+from scipy.sparse import vstack as sparse_vstack
 
-from frb.halos.models import ModifiedNFW, halomass_from_stellarmass
+from frb.halos.models import ModifiedNFW, halomass_realizations
 from frb.frb import FRB
 from frb.galaxies import cigale as frbcig
 from frb.galaxies import eazy as frb_ez
 from frb.surveys import des
 from frb import defs
 
-try:
-    from pathos.multiprocessing import ProcessingPool as Pool
-except ImportError:
-    print("You will need to run 'pip install pathos' to use some functions in this module.")
 try:
     import progressbar
 except ImportError:
     print("You will need to run 'pip install progressbar2' to use some functions in this module.")
-try:
-    from threedhst import eazyPy as ez
-except ImportError:
-    print("You will need to run 'pip install threedhst' to read EAZY output.")
 
 DEFAULT_DATA_FOLDER = "data"
 
@@ -173,39 +168,25 @@ def _gen_cigale_tab(stacked_photom:Table, n_chunks:int=10, n_cores:int=25, outdi
     Args:
         stacked_photom (Table): Table with a group for each galaxy. Output of _create_cigale_in.
         n_chunks (int, optional): How many chunks do you want to split stacked_photom.groups into?
-            Just so that galaxies are not redone in case of a crash.
-        n_cores (int, optional): Number of CPU threads to be used.
+            Completed chunks are not redone after a crash or a failed chunk.
+        n_cores (int, optional): Number of CPU threads to be used, shared by the chunks
+            run at the same time.
         outdir (str, optional): Path to the output directory.
     Returns:
         full_results (Table): CIGALE output with stellar mass and error for all entries
             in stakced_photom.
     """
-    chunk_size = int(len(stacked_photom.groups)/n_chunks)
-
     # Only compute SFH and Stellar mass.
     compute_variables = ['stellar.m_star']
 
-    for num in range(n_chunks):
-        cigale_outdir = os.path.join(outdir,"out_minz_zfrb_chunk{}".format(num))
-        # Check if a chunk has already been computed
-        if os.path.isdir(cigale_outdir):
-            print("Chunk {} has already been analyzed.".format(num))
-            continue
-        else:
-            cig_photom = stacked_photom.groups[num*chunk_size:(num+1)*chunk_size]
-            # Run cigale on each chunk of galaxies.
-            frbcig.run(cig_photom, 'redshift', plot=False,
-                outdir=cigale_outdir, cores=n_cores, variables=compute_variables, save_sed=False)
-    
-    # Read and combine the CIGALE results
-    cigfolders = glob.glob(os.path.join(outdir, "out_minz_zfrb_chunk*"))
-    relevant_cols = ['id', 'bayes.stellar.m_star', 'bayes.stellar.m_star_err']
-    all_results = []
-    for folder in cigfolders:
-        results = Table.read(os.path.join(folder, "results.fits"))
-        all_results.append(results[relevant_cols])
+    # Run the chunks in parallel;  a re-run only redoes missing chunks
+    n_procs = max(1, min(n_chunks, n_cores))
+    results = frbcig.run_batch(stacked_photom, 'redshift', outdir=os.path.join(outdir, "cigale_minz_zfrb"),
+                               n_shards=n_chunks, n_procs=n_procs, cores=max(1, n_cores//n_procs),
+                               variables=compute_variables, save_sed=False)
 
-    full_results = vstack(all_results)
+    relevant_cols = ['id', 'bayes.stellar.m_star', 'bayes.stellar.m_star_err']
+    full_results = results[relevant_cols]
     full_results.write(os.path.join(outdir, "cigale_full_output.fits"), overwrite=True)
     return full_results 
 
@@ -252,7 +233,8 @@ def _load_cigale_results(cigale_input:str, cigale_output:str)->Table:
 
     return trim_tab
 
-def _sample_eazy_redshifts(gal_ID:int, eazy_outdir:str, ndraws:int = 1000)->np.ndarray:
+def _sample_eazy_redshifts(gal_ID:int, eazy_outdir:str, ndraws:int = 1000,
+                           rng:np.random.Generator=None)->np.ndarray:
     """
     Returns a sample of redshifts drawn from the
     EAZY photo-z PDF of galaxy <gal_iD>.
@@ -260,28 +242,18 @@ def _sample_eazy_redshifts(gal_ID:int, eazy_outdir:str, ndraws:int = 1000)->np.n
         gal_ID(int): ID number of the galaxy in the EAZY table.
         eazy_outdir(str): Path to the EAZY results folder
         ndraws(int, optional): Number of redshift samples desired.
+        rng(np.random.Generator, optional): Random number generator.
     Returns:
         sample_z (np.ndarray): Redshift sample array of length ndraws.
     """
-    # Get posterior
-    zgrid, pz = ez.getEazyPz(gal_ID-1,OUTPUT_DIRECTORY=eazy_outdir)
-    # Force a value of 0 at z = 0
-    zgrid = np.hstack([[0],zgrid])
-    pz = np.hstack([[0],pz])
-    if np.all(np.diff(zgrid) == 0):
+    # Draw from the memory-mapped posterior, shared by all galaxies of the run
+    eazy_output = frb_ez.EazyOutput.open(OUTPUT_DIRECTORY=eazy_outdir)
+    sample_z = eazy_output.sample_z(gal_ID-1, ndraws, rng=rng)[0]
+    if np.any(np.isnan(sample_z)):
         return -99
-
-    # make a CDF
-    cdf_z = np.cumsum(pz)
-    cdf_z /= np.max(cdf_z)
-    cdf_interp = interp1d(cdf_z, zgrid, kind="linear", fill_value=0, bounds_error=False)
-
-    # Use uniform distribution to produce random draws from the CDF
-    sample_u = np.random.rand(ndraws)
-    sample_z = cdf_interp(sample_u)
     return sample_z
 
-def _mhalo_lookup_table(z:float, npz_out:str = "m_halo_realizations", n_cores:int = 8):
+def _mhalo_lookup_table(z:float, npz_out:str = "m_halo_realizations", n_cores:int = 8, seed=None):
     """
     For a given z, produce realizations of m_halo for relevant
     m_star values using only the uncertainty in the SHMR relation.
@@ -289,38 +261,23 @@ def _mhalo_lookup_table(z:float, npz_out:str = "m_halo_realizations", n_cores:in
     Args:
         z (float): redshift
         npz_out(str, optional): output .npz file path.
-        n_cores(int, optional): Number of CPU threads used for parallel processing.
+        n_cores(int, optional): Unused; the realizations are drawn in one vectorized pass.
+        seed (int or np.random.Generator, optional): Seed for the SHMR parameter draws.
     """
 
     # Define a range of stellar masses
     n_star = 1000
     log_mstar_array = np.linspace(6, 11, n_star)
 
-    # Instantiate a 2D array
+    # One draw of the SHMR parameters per column, shared by all stellar masses
     n_halo = 10000
-    log_mhalo_array = np.zeros((n_star, n_halo))
-
-    def mhalo_factory(log_mstar:float, z:float, n_cores = n_cores)->np.ndarray:
-        """
-        Parallelize m_halo computations for a given log_mstar array.
-        """    
-        p = Pool(n_cores)
-        func = lambda x: halomass_from_stellarmass(x, z = z, randomize=True)
-        log_mhalo_array = p.map(func, log_mstar)
-        
-        return log_mhalo_array
-
-
-    # Loop over log_mstar:
-    for idx, log_mstar in enumerate(log_mstar_array):
-        temp_log_mstar = np.full(n_halo, log_mstar)
-        log_mhalo_array[idx] = mhalo_factory(temp_log_mstar, z = z, n_cores = n_cores)
-    
+    log_mhalo_array = halomass_realizations(log_mstar_array, z=z, n_halo=n_halo, seed=seed)
+
     # Store this in an .npz file
     np.savez_compressed(npz_out, MSTAR=log_mstar_array, MHALO=log_mhalo_array)
     return
 
-def mhalo_lookup_tables(z_grid:list, datafolder:str=DEFAULT_DATA_FOLDER, n_cores:int=8):
+def mhalo_lookup_tables(z_grid:list, datafolder:str=DEFAULT_DATA_FOLDER, n_cores:int=8, seed=None):
     """
     For each z in z_grid, produces a fits file containing m_halo values
     corresponding to a fixed grid of m_star values. The values are produced
@@ -330,58 +287,130 @@ def mhalo_lookup_tables(z_grid:list, datafolder:str=DEFAULT_DATA_FOLDER, n_cores
     Args:
         z_grid (list or np.ndarray): List of redshift values to be sampled.
         datafolder (str, optional): Path to the directory where the results will be stored.
-        n_cores (int, optional): Number of CPU threads used for parallel processing.
+        n_cores (int, optional): Unused; kept for backwards compatibility.
+        seed (int, optional): Seed for the SHMR parameter draws.
     """
 
     # Just loop over z_grid and produce the fits files.
     for z in z_grid:
         realization_file = os.path.join(datafolder, "mhalo_realization_z_{:0.2f}".format(z))
-        _mhalo_lookup_table(z, realization_file, n_cores)
+        _mhalo_lookup_table(z, realization_file, n_cores, seed=seed)
 
     return
 
 def _mhalo_realizations(log_mstar:float, log_mstar_err:float, z:float,
-                        mean_interp:interp2d, stddev_interp:interp2d,
-                        n_mstar:int=100, n_norm:int=10, max_log_mhalo:float=12.8)->np.ndarray:
+                        mean_interp:callable, stddev_interp:callable,
+                        n_mstar:int=100, n_norm:int=10, max_log_mhalo:float=12.8,
+                        rng:np.random.Generator=None)->np.ndarray:
     """
     Using the lookup tables generated (see function mhalo_lookup_tables), produce
     realiztions of mhalo. This takes into account both the stellar mass uncertainty
     and the uncertainty in the SMHR relation from Moster+13.
     Args:
-        log_mstar (float): log stellar mass in M_sun.
-        log_mstar_err (float): log error in log_mstar
-        z (float): redshift
-        mean_interp (interp2d): <log_mhalo(log_mstar, z)> (based on SHMR)
-        stddev_interp (interp2d): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
+        log_mstar (float or np.ndarray): log stellar mass in M_sun.
+        log_mstar_err (float or np.ndarray): log error in log_mstar
+        z (float or np.ndarray): redshift
+        mean_interp (callable): <log_mhalo(log_mstar, z)> (based on SHMR)
+        stddev_interp (callable): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
         n_mstrar (int, optional): Number of m_star samples to be produced.
         n_norm (int, optional): Number of m_halo samples for each m_star sample.
         max_log_mhalo (float, optional): Maximum allowed log halo mass. log halo masses
             are capped artificially to this value if any exceed.
+        rng (np.random.Generator, optional): Random number generator.
     Returns:
-        mhalo_reals (np.ndarray): log_mhalo realizations.
+        mhalo_reals (np.ndarray): log_mhalo realizations. Shape (n_norm*n_mstar,)
+            for scalar inputs, else one such row per input (log_mstar, z).
     """
+    rng = np.random.default_rng(rng)
+    scalar = np.ndim(log_mstar) == 0
+    log_mstar, log_mstar_err, z = [np.ravel(arr) for arr in
+                                   np.broadcast_arrays(log_mstar, log_mstar_err, z)]
 
     # First produce realizations of mstar from a normal distribution.
-    mstar_reals = np.random.normal(log_mstar, log_mstar_err, n_mstar)
+    mstar_reals = rng.normal(log_mstar[:,None], log_mstar_err[:,None], (log_mstar.size, n_mstar))
+    zz = np.broadcast_to(z[:,None], mstar_reals.shape)
 
     # Then get mean values of halo masses for each stellar mass.
-    mean_mhalo_reals = mean_interp(mstar_reals, z)
+    mean_mhalo_reals = mean_interp(mstar_reals, zz)
     mean_mhalo_reals = np.minimum(mean_mhalo_reals, max_log_mhalo) # Set a cutoff for the mean halo mass
 
     # Then get the std. dev of the halo masses for each stellar mass.
-    stddev_mhalo_reals = stddev_interp(mstar_reals, z)
+    stddev_mhalo_reals = stddev_interp(mstar_reals, zz)
 
     # Finally, produce mhalo realizations assuming a normal distribution
     # with the means and std.devs from above.
-    dummy_normal = np.random.normal(0,1, (n_norm,n_mstar))
-    mhalo_reals = np.ravel(stddev_mhalo_reals*dummy_normal+mean_mhalo_reals)
+    dummy_normal = rng.normal(0,1, (log_mstar.size, n_norm, n_mstar))
+    mhalo_reals = stddev_mhalo_reals[:,None,:]*dummy_normal+mean_mhalo_reals[:,None,:]
+    mhalo_reals = mhalo_reals.reshape(log_mstar.size, n_norm*n_mstar)
 
+    if scalar:
+        return mhalo_reals[0]
     return mhalo_reals
 
+def _dm_pdf_batch(cigale_tabs:list, eazy_outdir:str,
+                  mean_interp:callable, stddev_interp:callable,
+                  ang_dia_interp:interp1d, dm_interpolator:RegularGridInterpolator,
+                  rng:np.random.Generator=None):
+    """
+    For a batch of galaxies, compute their PDFs of
+    DM from the CIGALE and EAZY inputs with a single
+    evaluation of the DM interpolator.
+    Args:
+        cigale_tabs (list): Groups from the full cigale result,
+            one per galaxy (see _dm_pdf).  None entries are skipped.
+        eazy_outdir (str): Path to the directory with EAZY output
+        mean_interp (callable): <log_mhalo(log_mstar, z)> (based on SHMR)
+        stddev_interp (callable): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
+        ang_dia_interp (interp1d): angular_diameter_distance(z) (default Repo cosmology)
+        dm_interpolator (RegularGridInterpolator): DM(z, offset_kpc, log_mhalo)
+        rng (np.random.Generator, optional): Random number generator.
+    Returns:
+        dm_values (np.ndarray): DM realizations, one row per good galaxy.
+        z_draws (np.ndarray): Redshift draws from which dm_values were produced,
+            one float32 row per good galaxy.
+        good (np.ndarray): Boolean flags for the galaxies with DM realizations.
+    """
+    rng = np.random.default_rng(rng)
+    good = np.zeros(len(cigale_tabs), dtype=bool)
+    # Get 1000 random redshift draws from EAZY for every galaxy at once
+    has_tab = [idx for idx, cigale_tab in enumerate(cigale_tabs) if cigale_tab is not None]
+    if len(has_tab) > 0:
+        gal_IDs = np.array([cigale_tabs[idx]['gal_ID'][0] for idx in has_tab])
+        eazy_output = frb_ez.EazyOutput.open(OUTPUT_DIRECTORY=eazy_outdir)
+        all_z_draws = dict(zip(has_tab, eazy_output.sample_z(gal_IDs-1, 1000, rng=rng)))
+    z_list, mstar_list, mstar_err_list, sep_list = [], [], [], []
+    for idx in has_tab:
+        cigale_tab = cigale_tabs[idx]
+        z_draws = all_z_draws[idx]
+        if np.any(np.isnan(z_draws)):
+            continue
+        # Convert the photo-z draws to mean stellar masses and errors
+        log_mstar_interp = interp1d(cigale_tab['redshift'], cigale_tab['log_mstar'], bounds_error=False, fill_value=1)
+        log_mstar_err_interp = interp1d(cigale_tab['redshift'], cigale_tab['log_mstar_err'], bounds_error=False, fill_value=1)
+        good[idx] = True
+        z_list.append(z_draws)
+        mstar_list.append(log_mstar_interp(z_draws))
+        mstar_err_list.append(log_mstar_err_interp(z_draws))
+        sep_list.append(cigale_tab['sep_ang'][0])
+    if not np.any(good):
+        return np.zeros((0, 0)), np.zeros((0, 0), dtype='float32'), good
+
+    z_draws = np.array(z_list)
+    # Draw stellar mass values from a normal distribution and produce halo
+    # masses for every galaxy and redshift draw at once
+    log_mhalos = _mhalo_realizations(np.ravel(mstar_list), np.ravel(mstar_err_list), z_draws.ravel(),
+                                     mean_interp, stddev_interp, rng=rng)
+    offsets = ang_dia_interp(z_draws)*np.array(sep_list)[:,None]*u.arcmin.to('rad')
+    zz_draws = np.broadcast_to(z_draws.reshape(-1, 1), log_mhalos.shape)
+    oo_draws = np.broadcast_to(offsets.reshape(-1, 1), log_mhalos.shape)
+    dm_values = dm_interpolator((zz_draws, oo_draws, log_mhalos))
+
+    return dm_values.reshape(len(z_list), -1), z_draws.astype('float32'), good
+
 def _dm_pdf(cigale_tab:Table, eazy_outdir:str,
-            mean_interp:interp2d, stddev_interp:interp2d,
+            mean_interp:callable, stddev_interp:callable,
             ang_dia_interp:interp1d, dm_interpolator:RegularGridInterpolator,
-            n_cores:int = 8):
+            n_cores:int = 8, rng:np.random.Generator=None):
     """
     For a given galaxy, compute its PDF of
     DM from the CIGALE and EAZY inputs.
@@ -391,49 +420,65 @@ def _dm_pdf(cigale_tab:Table, eazy_outdir:str,
             group contains data on only one galaxy
             at various assumed redshifts. 
         eazy_outdir (str): Path to the directory with EAZY output
-        mean_interp (interp2d): <log_mhalo(log_mstar, z)> (based on SHMR)
-        stddev_interp (interp2d): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
+        mean_interp (callable): <log_mhalo(log_mstar, z)> (based on SHMR)
+        stddev_interp (callable): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
         ang_dia_interp (interp1d): angular_diameter_distance(z) (default Repo cosmology)
         dm_interpolator (RegularGridInterpolator): DM(z, offset_kpc, log_mhalo)
-        n_cores (int, optional): Number of CPU threads to use.
+        n_cores (int, optional): Unused; the realizations are vectorized.
+        rng (np.random.Generator, optional): Random number generator.
     Returns:
         dm_values (np.ndarray): Array containing DM realizations for the galaxy.
         z_draws (np.ndarray): Array containing redshift draws from which dm_values were produced.
     """
-    
-    # Prepare interpolation functions from the
-    # CIGALE table
-    log_mstar_interp = interp1d(cigale_tab['redshift'], cigale_tab['log_mstar'], bounds_error=False, fill_value=1)
-    log_mstar_err_interp = interp1d(cigale_tab['redshift'], cigale_tab['log_mstar_err'], bounds_error=False, fill_value=1)
-
-    # Get 1000 random redshift draws from EAZY
-    z_draws = _sample_eazy_redshifts(cigale_tab['gal_ID'][0], eazy_outdir)
-    if np.isscalar(z_draws):
+    dm_values, z_draws, good = _dm_pdf_batch([cigale_tab], eazy_outdir, mean_interp, stddev_interp,
+                                             ang_dia_interp, dm_interpolator, rng=rng)
+    if not good[0]:
         return -99.
 
-    # Convert the photo-z draws to mean stellar masses and errors
-    log_mstar_array = log_mstar_interp(z_draws)
-    log_mstar_err_array = log_mstar_err_interp(z_draws)
-
-    func = lambda idx: _mhalo_realizations(log_mstar_array[idx], log_mstar_err_array[idx], z_draws[idx], mean_interp, stddev_interp)
+    return dm_values[0], z_draws[0]
 
-    # Draw stellar mass values from a normal distribution and produce halo
-    # masses, halo_mass errors
-    p = Pool(n_cores)
-    log_mhalos = p.map(func, np.arange(len(z_draws)))
-    zz_draws = np.repeat(z_draws, len(log_mhalos[0]))
-    offsets = ang_dia_interp(z_draws)*cigale_tab['sep_ang'][0]*u.arcmin.to('rad')
-    oo_draws = np.repeat(offsets, len(log_mhalos[0]))
-    dm_values = dm_interpolator((zz_draws, oo_draws, np.concatenate(log_mhalos)))
+def _dm_grid_slices(partial_file:str, done_file:str, iz_list:list, redshifts:np.ndarray,
+                    offsets:np.ndarray, log_halo_masses:np.ndarray, max_log_mhalo:float):
+    """
+    Fill the redshift slices iz_list of a partial halo DM grid on disk.
+    Internal function for dm_grid; each call opens the memory-mapped files
+    itself so it can run in a worker process.
+    Args:
+        partial_file (str): .npy file holding the float32 (n_z, n_o, n_m) grid.
+        done_file (str): .npy file flagging the completed redshift slices.
+        iz_list (list): Indices of the redshift slices to compute.
+        redshifts, offsets, log_halo_masses (np.ndarray): Grid axes.
+        max_log_mhalo (float): DM for larger halo masses is set to -99.0
+    """
+    dm = np.load(partial_file, mmap_mode='r+')
+    done = np.load(done_file, mmap_mode='r+')
+    OO, MM = np.meshgrid(offsets, log_halo_masses, indexing='ij')
+    # The mNFW profile is self-similar so only its projected table is integrated
+    mnfw = ModifiedNFW(alpha = 2, y0 = 2)
+    for iz in iz_list:
+        z = redshifts[iz]
+        dm_z = mnfw.Ne_Rperp_many(OO, MM, z, add_units=False, method='table')/(1+z)
+        dm_z[MM > max_log_mhalo] = -99.0 # Not necessary but just in case.
+        dm[iz] = dm_z
+        dm.flush()
+        done[iz] = 1
+        done.flush()
+    return
 
-    return dm_values, z_draws.astype('float32') # Save memory by switching to a 32 bit representation.
+def _dm_grid_slices_star(args):
+    """ Unpack the arguments of _dm_grid_slices for Pool.map """
+    return _dm_grid_slices(*args)
 
 def dm_grid(frb_z:float, n_z:int = 100, n_o:int = 100, n_m:int =100, max_log_mhalo:float=12.8,
-            outdir:str=DEFAULT_DATA_FOLDER, outfile:str=None)->None:
+            outdir:str=DEFAULT_DATA_FOLDER, outfile:str=None, n_cores:int=1)->None:
     """
     Produce DM estimates for a 3D grid of
     redshift, offsets and log_halo_masses and write
     them to disk.
+
+    The grid is filled one redshift slice at a time into a float32
+    memory-mapped file next to outfile, so an interrupted run resumes
+    from the completed slices when called again with the same arguments.
     Args:
         frb_z(float): frb redshift
         n_z(int, optional): size of the redshift grid. i.e. np.linspace(0, frb_z, n_z)
@@ -443,6 +488,7 @@ def dm_grid(frb_z:float, n_z:int = 100, n_o:int = 100, n_m:int =100, max_log_mha
             set to -99.0 to prevent weirdly large DM contributions from galactic halos. 
         outdir(str, optional): data directory to store results
         outfile(str, optional): name of results .npz file (within outdir).
+        n_cores(int, optional): Number of processes filling the grid.
     """
     # Redshift grid
     redshifts = np.linspace(0, frb_z, n_z)
@@ -453,30 +499,62 @@ def dm_grid(frb_z:float, n_z:int = 100, n_o:int = 100, n_m:int =100, max_log_mha
     # Mass grid
     log_halo_masses = np.linspace(8, 16, n_m)
 
-    ZZ, OO, MM = np.meshgrid(redshifts, offsets, log_halo_masses, indexing='ij')
-    raveled_z = ZZ.ravel()
-    raveled_o = OO.ravel()
-    raveled_m = MM.ravel()
+    if not outfile:
+        outfile = os.path.join(outdir, "halo_dm_data.npz")
 
-    def halo_dm(idx):
-        if raveled_m[idx] > max_log_mhalo: # Not necessary but just in case.
-            return -99.0
+    # Partial grid on disk;  restart it if the grid has changed
+    root = outfile[:-4] if outfile.endswith('.npz') else outfile
+    partial_file = root+'_partial.npy'
+    done_file = root+'_partial_done.npy'
+    axes_file = root+'_partial_axes.npz'
+    resume = os.path.isfile(partial_file) and os.path.isfile(done_file) and os.path.isfile(axes_file)
+    if resume:
+        axes = np.load(axes_file)
+        resume = (np.array_equal(axes['redshifts'], redshifts) and np.array_equal(axes['offsets'], offsets)
+                  and np.array_equal(axes['m_halo'], log_halo_masses)
+                  and float(axes['max_log_mhalo']) == max_log_mhalo)
+    if not resume:
+        np.lib.format.open_memmap(partial_file, mode='w+', dtype=np.float32, shape=(n_z, n_o, n_m))
+        np.save(done_file, np.zeros(n_z, dtype=np.uint8))
+        np.savez(axes_file, redshifts=redshifts, offsets=offsets, m_halo=log_halo_masses,
+                 max_log_mhalo=max_log_mhalo)
+    todo = np.where(np.load(done_file) == 0)[0]
+
+    # Fill the missing slices
+    if todo.size > 0:
+        # Build the projected profile table once, before any workers need it
+        ModifiedNFW(alpha = 2, y0 = 2).Ne_Rperp(10*u.kpc, method='table')
+        n_cores = max(1, min(n_cores, todo.size))
+        args = [(partial_file, done_file, list(todo[ii::n_cores]), redshifts, offsets,
+                 log_halo_masses, max_log_mhalo) for ii in range(n_cores)]
+        if n_cores > 1:
+            with multiprocessing.get_context('spawn').Pool(n_cores) as p:
+                p.map(_dm_grid_slices_star, args)
         else:
-            mnfw = ModifiedNFW(raveled_m[idx], alpha = 2, y0 = 2, z = raveled_z[idx])
-        return mnfw.Ne_Rperp(raveled_o[idx]*u.kpc).to('pc/cm**3').value/(1+raveled_z[idx])
-
-    p = Pool(8)
+            _dm_grid_slices(*args[0])
 
-    raveled_dm = np.array(p.map(halo_dm, np.arange(n_z*n_o*n_m)))
     # Dm grid
-    dm_grid = raveled_dm.reshape((n_z, n_o, n_m))
-    if not outfile:
-        outfile = os.path.join(outdir, "halo_dm_data.npz")
-
+    dm_grid = np.load(partial_file, mmap_mode='r')
     np.savez_compressed(outfile, redshifts=redshifts, offsets=offsets, m_halo=log_halo_masses, dm=dm_grid)
+    del dm_grid
+    for ifile in [partial_file, done_file, axes_file]:
+        os.remove(ifile)
 
     return
 
+def _shmr_moment(moment_interp:RegularGridInterpolator, log_mstar:np.ndarray, z:np.ndarray)->np.ndarray:
+    """
+    Evaluate a moment of log_mhalo(log_mstar, z) pointwise, holding it
+    fixed beyond the edges of the (z, log_mstar) grid.
+    Args:
+        moment_interp (RegularGridInterpolator): Moment on the (z, log_mstar) grid.
+        log_mstar, z (np.ndarray): Broadcastable evaluation points.
+    Returns:
+        np.ndarray: Moment values
+    """
+    zgrid, mgrid = moment_interp.grid
+    return moment_interp((np.clip(z, zgrid[0], zgrid[-1]), np.clip(log_mstar, mgrid[0], mgrid[-1])))
+
 def _instantiate_intepolators(datafolder:str=DEFAULT_DATA_FOLDER, dmfilename:str=None, frb_name:str="FRB180924")->list:
     """
     Produce interpolator functions
@@ -488,8 +566,8 @@ def _instantiate_intepolators(datafolder:str=DEFAULT_DATA_FOLDER, dmfilename:str
         frb_name(str, optional): Assumes "FRB180924" by default.
     Returns:
         dm_interpolator (RegularGridInterpolator): DM(z, offset_kpc, log_mhalo)
-        mean_interp (interp2d): <log_mhalo(log_mstar, z)> (based on SHMR)
-        stddev_interp (interp2d): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
+        mean_interp (callable): <log_mhalo(log_mstar, z)> (based on SHMR)
+        stddev_interp (callable): std.dev. log_mhalo(log_mstar, z) (based on SHMR)
         ang_dia_interp (interp1d): angular_diameter_distance(z) (default Repo cosmology)
     """
 
@@ -527,8 +605,8 @@ def _instantiate_intepolators(datafolder:str=DEFAULT_DATA_FOLDER, dmfilename:str
     # laoded is going to be from the last file in the loop. The first entry contains
     # a stellar mass array.
     log_mstar = loaded['MSTAR']
-    mean_interp = interp2d(log_mstar, zgrid, np.array(mean_arrays), bounds_error=False)
-    stddev_interp = interp2d(log_mstar, zgrid, np.array(stddev_arrays), bounds_error=False)
+    mean_interp = partial(_shmr_moment, RegularGridInterpolator((zgrid, log_mstar), np.array(mean_arrays)))
+    stddev_interp = partial(_shmr_moment, RegularGridInterpolator((zgrid, log_mstar), np.array(stddev_arrays)))
 
     # Angular diameter distance
     z = np.linspace(0,7, 10000)
@@ -539,7 +617,7 @@ def _instantiate_intepolators(datafolder:str=DEFAULT_DATA_FOLDER, dmfilename:str
     return dm_interpolator, mean_interp, stddev_interp, ang_dia_interp
 
 def dm_for_all_galaxies(frb:FRB, input_catfile:str, datafolder:str,
-                        n_cores:int=8, n_gals:int = None):
+                        n_cores:int=8, n_gals:int = None, batch_size:int = 8, seed:int = None):
     """
     Produce DM estimates for all the galaxies provided by the user. Creates
     two files : "DM_halos_zdraws.npz" which contains all the redshift draws
@@ -553,6 +631,9 @@ def dm_for_all_galaxies(frb:FRB, input_catfile:str, datafolder:str,
         datafolder (str): Path to the folder in which results will be saved.
         n_cores (int, optional): Number of CPU threads to be used for computation.
         n_gals (int, optional): Limit analysis to n_gals galaxies for testing purposes.
+        batch_size (int, optional): Number of galaxies whose DM realizations are
+            computed together. Each galaxy holds 1e6 realizations in memory.
+        seed (int, optional): Seed for the random draws.
     
     """
     # Load the input catalog
@@ -582,27 +663,36 @@ def dm_for_all_galaxies(frb:FRB, input_catfile:str, datafolder:str,
     if (n_gals!=None) & (type(n_gals)==int):
         eazy_tab = eazy_tab[:n_gals]
     
-    # Loop through galaxies
+    # Loop through galaxies in batches
     print("Computing DM realizations for all galaxies ...")
+    rng = np.random.default_rng(seed)
+    cigale_tab = cigale_tab.group_by('gal_ID')
+    cigale_galaxies = {group['gal_ID'][0]: group for group in cigale_tab.groups}
     # Initialize storage for the DM realizations and the redshifts at which these are computed.
-    dm_realizations = lil_matrix((len(eazy_tab), 1000000))
+    dm_rows = []
     z_draws = np.zeros((len(eazy_tab),1000), dtype='float32')
 
     # Begin calculating
-    with progressbar.ProgressBar(max_value=len(eazy_tab)-1) as bar:
-        for idx, ez_entry in enumerate(eazy_tab):
-            cigale_galaxy = cigale_tab[cigale_tab['gal_ID']==ez_entry['ID']]
-            if np.any(np.isnan(cigale_galaxy['log_mstar'])):
-                continue
-            else:
-                dm_realizations[idx], z_draws[idx] = _dm_pdf(cigale_galaxy, eazy_outdir, mean_interp,
-                                        stddev_interp, ang_dia_interp, dm_interpolator,
-                                        n_cores = 20)
-                
-            bar.update(idx)
+    with progressbar.ProgressBar(max_value=len(eazy_tab)) as bar:
+        for start in range(0, len(eazy_tab), batch_size):
+            stop = min(start+batch_size, len(eazy_tab))
+            batch = []
+            for ez_entry in eazy_tab[start:stop]:
+                cigale_galaxy = cigale_galaxies.get(ez_entry['ID'])
+                if (cigale_galaxy is None) or np.any(np.isnan(cigale_galaxy['log_mstar'])):
+                    cigale_galaxy = None
+                batch.append(cigale_galaxy)
+            dm_values, batch_z, good = _dm_pdf_batch(batch, eazy_outdir, mean_interp, stddev_interp,
+                                                     ang_dia_interp, dm_interpolator, rng=rng)
+            batch_dm = np.zeros((stop-start, 1000000))
+            batch_dm[good] = dm_values
+            z_draws[start:stop][good] = batch_z
+            dm_rows.append(csr_matrix(batch_dm))
+            bar.update(stop)
+    dm_realizations = sparse_vstack(dm_rows, format='csr')
     # Save results to file
     np.savez_compressed(os.path.join(datafolder, "DM_halos_zdraws.npz"), z_draws=z_draws)
-    save_npz(os.path.join(datafolder,"DM_halos_final.npz"), dm_realizations.tocsr())
+    save_npz(os.path.join(datafolder,"DM_halos_final.npz"), dm_realizations)
     print("Done calculating")
 
     return
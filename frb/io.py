@@ -4,8 +4,13 @@ from __future__ import print_function, absolute_import, division, unicode_litera
 
 import importlib_resources
 import gzip
+import hashlib
 import json
 import os
+import shutil
+import tempfile
+
+import numpy as np
 
 
 
@@ -36,3 +41,105 @@ def loadjson(filename):
 
     return obj
 
+
+
+def user_cache_dir(subdir=None):
+    """ Directory for files generated and cached by the FRB repo
+
+    Defaults to ~/.cache/frb and may be set with the
+    FRB_CACHE_DIR environment variable.  It is created if needed.
+
+    Parameters
+    ----------
+    subdir : str, optional
+      Sub-directory within the cache
+
+    Returns
+    -------
+    path : str
+    """
+    path = os.environ.get('FRB_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'frb'))
+    if subdir is not None:
+        path = os.path.join(path, subdir)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def hash_params(params):
+    """ Content hash of a dict of parameters
+
+    numpy arrays are hashed by their float64 values; everything
+    else by its JSON (or repr) representation.
+
+    Parameters
+    ----------
+    params : dict
+
+    Returns
+    -------
+    key : str
+      Hexadecimal SHA1 digest
+    """
+    sha = hashlib.sha1()
+    for key in sorted(params):
+        sha.update(key.encode())
+        value = params[key]
+        if isinstance(value, np.ndarray):
+            sha.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+        else:
+            sha.update(json.dumps(value, sort_keys=True, default=repr).encode())
+    return sha.hexdigest()
+
+
+def save_npy_dir(outdir, arrays, meta=None):
+    """ Atomically write a set of arrays as .npy files in a directory
+
+    The files are written to a temporary directory alongside outdir
+    which is then renamed, so concurrent readers never see a partial
+    write.  If another process wins the race, its copy is kept.
+
+    Parameters
+    ----------
+    outdir : str
+    arrays : dict
+      name -> np.ndarray
+    meta : dict, optional
+      Written to meta.json
+    """
+    parent = os.path.dirname(os.path.abspath(outdir))
+    os.makedirs(parent, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    try:
+        for key, arr in arrays.items():
+            np.save(os.path.join(tmpdir, key+'.npy'), np.asarray(arr))
+        if meta is not None:
+            with open(os.path.join(tmpdir, 'meta.json'), 'wt') as fh:
+                json.dump(meta, fh, default=repr)
+        os.rename(tmpdir, outdir)
+    except OSError:
+        # Lost the race (or failed);  keep the existing copy
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        if not os.path.isdir(outdir):
+            raise
+
+
+def load_npy_dir(indir, mmap_mode='r'):
+    """ Load the arrays written by save_npy_dir
+
+    Parameters
+    ----------
+    indir : str
+    mmap_mode : str, optional
+      Passed to np.load
+
+    Returns
+    -------
+    arrays : dict
+      name -> np.ndarray (memory-mapped by default)
+    """
+    arrays = {}
+    for ifile in sorted(os.listdir(indir)):
+        if ifile.endswith('.npy'):
+            arrays[ifile[:-4]] = np.load(os.path.join(indir, ifile), mmap_mode=mmap_mode)
+    return arrays
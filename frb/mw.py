@@ -9,18 +9,140 @@ from astropy import units
 import warnings
 
 from frb.halos.models import ModifiedNFW
+from frb import io as frb_io
 
 from ne2001 import density
 
-def ismDM(coord):
+# DM_ISM map
+ISM_MAP_VERSION = 1
+_ism_maps = {}
+_ne2001 = None
+
+
+def _get_ne2001():
+    """ Shared NE2001 electron density model """
+    global _ne2001
+    if _ne2001 is None:
+        _ne2001 = density.ElectronDensity()
+    return _ne2001
+
+
+def _ism_map_pixels(pixels, nside, distance, npts):
+    """ NE2001 DM to a set of HEALPix pixel centers
+
+    The sightline is sampled on a grid that is logarithmic in distance,
+    which follows the concentration of the electrons near the Sun,
+    and integrated with the trapezoidal rule (~0.1% from quad).
+
+    Args:
+        pixels (np.ndarray): RING pixel indices, in Galactic coordinates
+        nside (int):
+        distance (float): Distance to integrate to, kpc
+        npts (int): Number of samples per sightline
+
+    Returns:
+        np.ndarray: DM in pc/cm**3
+    """
+    import healpy as hp
+    from ne2001.utils import galactic_to_galactocentric
+    ne = _get_ne2001()
+    l, b = hp.pix2ang(nside, pixels, lonlat=True)
+    dist = np.concatenate([[0.], np.geomspace(1e-3, distance, npts)])
+    DM = np.zeros(len(pixels))
+    for kk in range(len(pixels)):
+        xyz = galactic_to_galactocentric(l[kk], b[kk], dist, density.XYZ_SUN)
+        DM[kk] = np.trapz(ne.ne(xyz), dist) * 1000
+    return DM
+
+
+def _ism_map_pixels_star(args):
+    """ Unpack the arguments of _ism_map_pixels for Pool.map """
+    return _ism_map_pixels(*args)
+
+
+def ism_map(nside=16, distance=100., npts=2000, n_cores=1, cache_dir=None):
+    """ HEALPix map of the NE2001 DM_ISM in Galactic coordinates
+
+    Built once (in parallel with n_cores) and cached on disk;
+    this takes ~1 s per pixel per core.
+
+    Args:
+        nside (int, optional): HEALPix nside
+        distance (float, optional): Distance to integrate to, kpc
+        npts (int, optional): Number of samples per sightline
+        n_cores (int, optional): Number of processes building the map
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('NE2001')
+
+    Returns:
+        np.ndarray: RING-ordered map of DM_ISM, pc/cm**3
+    """
+    import healpy as hp
+    params = dict(version=ISM_MAP_VERSION, nside=nside, distance=distance, npts=npts)
+    key = frb_io.hash_params(params)
+    if key in _ism_maps:
+        return _ism_maps[key]
+    if cache_dir is None:
+        cache_dir = frb_io.user_cache_dir('NE2001')
+    outdir = os.path.join(cache_dir, 'ism_'+key)
+    if os.path.isdir(outdir):
+        _ism_maps[key] = frb_io.load_npy_dir(outdir, mmap_mode=None)['DM']
+        return _ism_maps[key]
+
+    # Build
+    npix = hp.nside2npix(nside)
+    n_cores = max(1, min(n_cores, npix))
+    chunks = np.array_split(np.arange(npix), 4*n_cores if n_cores > 1 else 1)
+    args = [(chunk, nside, distance, npts) for chunk in chunks]
+    if n_cores > 1:
+        import multiprocessing
+        with multiprocessing.get_context('spawn').Pool(n_cores) as p:
+            DM = np.concatenate(p.map(_ism_map_pixels_star, args))
+    else:
+        DM = _ism_map_pixels(*args[0])
+    frb_io.save_npy_dir(outdir, dict(DM=DM), meta=params)
+    _ism_maps[key] = frb_io.load_npy_dir(outdir, mmap_mode=None)['DM']
+    return _ism_maps[key]
+
+
+def ismDM(coord, use_map=False, b_exact=5., **kwargs):
+    """ NE2001 DM from the Galactic ISM, to 100 kpc
+
+    Args:
+        coord (SkyCoord): One or many coordinates
+        use_map (bool, optional): Interpolate (bilinear) the cached
+            ism_map() instead of integrating each sightline.
+            Sightlines with |b| < b_exact are still integrated.
+        b_exact (float, optional): Latitude (deg) below which the map is not used
+        **kwargs: Passed to ism_map(), e.g. nside, n_cores.
+            A distance other than 100 kpc also applies to the exact integrals
+
+    Returns:
+        Quantity: DM_ISM;  shape of coord
+    """
     gcoord = coord.transform_to('galactic')
     l, b = gcoord.l.value, gcoord.b.value
+    distance = kwargs.get('distance', 100.)
     
-    ne = density.ElectronDensity()#**PARAMS)
-    ismDM = ne.DM(l, b, 100.)
+    ne = _get_ne2001()
+    if gcoord.isscalar:
+        if use_map and np.abs(b) >= b_exact:
+            import healpy as hp
+            return hp.get_interp_val(ism_map(**kwargs), l, b, lonlat=True) * units.pc / units.cm**3
+        return ne.DM(l, b, distance)
+
+    # Many coordinates
+    l, b = np.atleast_1d(l), np.atleast_1d(b)
+    ismDM = np.zeros(l.shape)
+    exact = np.ones(l.shape, dtype=bool)
+    if use_map:
+        import healpy as hp
+        exact = np.abs(b) < b_exact
+        ismDM[~exact] = hp.get_interp_val(ism_map(**kwargs), l[~exact], b[~exact], lonlat=True)
+    for idx in zip(*np.where(exact)):
+        ismDM[idx] = ne.DM(l[idx], b[idx], distance).value
     
     # Return
-    return ismDM
+    return ismDM * units.pc / units.cm**3
 
 def haloDM(coord, f_diffuse=0.75, zero=True):
 
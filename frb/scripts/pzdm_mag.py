@@ -35,7 +35,6 @@ def parser(options=None):
 def main(pargs):
     """ Run
     """
-    import numpy as np
 
     from linetools import utils as ltu
     from linetools.scripts.utils import coord_arg_to_coord
@@ -44,8 +43,6 @@ def main(pargs):
     from frb.dm import prob_dmz
     from frb.galaxies import mag_dm
     from frb.galaxies import nebular
-    from frb.galaxies import photom
-    from frb.galaxies import utils as frb_gal_u
 
 
     # Deal with coord
@@ -61,59 +58,17 @@ def main(pargs):
     print("-----------------------------------------------------")
     print(f"NE2001 = {DM_ISM:.2f}")
 
-    # DM cosmic and EG
-    DM_extragalactic = pargs.DM_FRB - DM_ISM.value - pargs.dm_mwhalo
-    DM_cosmic = DM_extragalactic - pargs.dm_host
-     
-
-    # Load the telescope specific grid
-    telescope_dict = prob_dmz.telescope_dict
-
-    # Get the perfect telescope grid (default)
-    if not pargs.telescope or pargs.telescope == 'perfect':
-        sdict = prob_dmz.grab_repo_grid(telescope_dict['perfect'])
-        DM = sdict['DM']
-        PDM_z = sdict['PDM_z']
-        PDM_z = PDM_z.T # Perfect is opposite of the rest 
-        iDM = np.argmin(np.abs(DM - DM_cosmic))
-    else: # Grab a non-perfect telescope grid, which use DM_extragalactic
-        sdict = prob_dmz.grab_repo_grid(telescope_dict[pargs.telescope])
-        PDM_z = sdict['pzdm']
-        DM = sdict['DM']
-        iDM = np.argmin(np.abs(DM - DM_extragalactic))
-
-    # Grab the right entry
-    z = sdict['z']
-    PzDM = PDM_z[:,iDM] / np.sum(PDM_z[:,iDM])
-    
-    cum_sum = np.cumsum(PzDM)
+    # p(z|DM) and L* for this FRB
+    telescope = pargs.telescope if pargs.telescope else 'perfect'
     limits = [float(item) for item in pargs.cl.split(',')]
-
-    z_min = z[np.argmin(np.abs(cum_sum-limits[0]/100.))]
-    z_max = z[np.argmin(np.abs(cum_sum-limits[1]/100.))]
-    
-    z_50 = z[np.argmin(np.abs(cum_sum-50./100.))]
-    z_mode = z[np.argmax(PzDM)]
-
-
-    # Setup Luminosity
-
-    # Extinction correct
-    dust_correct = photom.extinction_correction(pargs.filter, EBV)
-    mag_dust = 2.5 * np.log10(1. / dust_correct)
-    mag_corr = pargs.mag_limit + mag_dust
-
-    # ##########################3
-    # Convert to L
-
-    # Load f_mL
-    f_mL = frb_gal_u.load_f_mL()
-    # m_r(L*)
-    m_r_Lstar_min = float(f_mL(z_min))
-    m_r_Lstar_max = float(f_mL(z_max))
-
-    frac_Lstar_min = 10**(-0.4*(mag_corr-m_r_Lstar_min))
-    frac_Lstar_max = 10**(-0.4*(mag_corr-m_r_Lstar_max))
+    tbl = mag_dm.zrange_for_frbs(pargs.DM_FRB, icoord, pargs.mag_limit,
+                                 dm_host=pargs.dm_host, dm_mwhalo=pargs.dm_mwhalo,
+                                 EBV=EBV, DM_ISM=DM_ISM.value, filt=pargs.filter,
+                                 telescope=telescope, cl=limits)
+    z_min, z_max = tbl['z_min'][0], tbl['z_max'][0]
+    z_50, z_mode = tbl['z_50'][0], tbl['z_mode'][0]
+    frac_Lstar_min = tbl['frac_Lstar_min'][0]
+    frac_Lstar_max = tbl['frac_Lstar_max'][0]
 
 
     # Finish
@@ -139,6 +94,9 @@ def main(pargs):
 
     # make the magnitude vs redshift plot with z-range if requested
     if pargs.magdm_plot:
+        pzdm_grid = prob_dmz.PzDMGrid(telescope)
+        DM_use = tbl['DM_cosmic'][0] if telescope == 'perfect' else tbl['DM_extragalactic'][0]
+        z, PzDM = pzdm_grid.z, pzdm_grid.pz_given_dm(DM_use)
         mag_dm.r_vs_dm_figure(z_min, z_max, z, PzDM, outfile='fig_r_vs_z.png',
                flipy=True, known_hosts=False, title=pargs.fig_title, logz_scale=False)
 
@@ -2,9 +2,10 @@
 from astropy.table.table import QTable
 import numpy as np
 
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import SkyCoord, Angle
 from astropy.cosmology import Planck18 as cosmo
-from astropy.table import Table, hstack, vstack, setdiff, join
+from astropy.table import Table, Column, MaskedColumn
+from astropy.utils import metadata
 from astropy import units
 from frb.galaxies.defs import valid_filters
 import warnings
@@ -164,10 +165,63 @@ def summarize_catalog(frbc, catalog, summary_radius, photom_column, magnitude):
     return summary_list
 
 
+def _sky_xyz(ra, dec):
+    """ Unit vectors of RA, Dec in degrees """
+    ra, dec = np.radians(np.asarray(ra, dtype=float)), np.radians(np.asarray(dec, dtype=float))
+    return np.column_stack([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)])
+
+
+def match_unique(ra1, dec1, ra2, dec2, skydist:units.Quantity=5*units.arcsec)->tuple:
+    """
+    One-to-one sky match of two sets of positions
+
+    Pairs closer than skydist are found with a KD-tree on 3-D unit
+    vectors and assigned greedily, closest first, so every entry
+    is matched at most once.
+
+    Args:
+        ra1, dec1, ra2, dec2 (np.ndarray): Positions in degrees
+        skydist (Quantity, optional): Maximum separation for a valid match
+
+    Returns:
+        idx1, idx2, d2d: Indices of the matched entries, sorted by idx1,
+            and their separations (Angle)
+    """
+    from scipy.spatial import cKDTree
+    xyz1, xyz2 = _sky_xyz(ra1, dec1), _sky_xyz(ra2, dec2)
+    chord = 2*np.sin(min(skydist.to('rad').value, np.pi)/2)
+    if len(xyz1) == 0 or len(xyz2) == 0:
+        pairs = np.zeros(0, dtype=[('i', np.intp), ('j', np.intp), ('v', float)])
+    else:
+        pairs = cKDTree(xyz1).sparse_distance_matrix(cKDTree(xyz2), chord, output_type='ndarray')
+        pairs = pairs[pairs['v'] < chord]
+    # Closest first
+    srt = np.lexsort((pairs['j'], pairs['i'], pairs['v']))
+    idx1, idx2, dist = pairs['i'][srt], pairs['j'][srt], pairs['v'][srt]
+    keep1, keep2, keepd = [], [], []
+    while len(idx1) > 0:
+        # Pairs closest for both of their entries are taken; this
+        # is the same as walking through the pairs one at a time
+        _, first1 = np.unique(idx1, return_index=True)
+        _, first2 = np.unique(idx2, return_index=True)
+        mutual = np.intersect1d(first1, first2)
+        keep1.append(idx1[mutual])
+        keep2.append(idx2[mutual])
+        keepd.append(dist[mutual])
+        left = ~np.isin(idx1, idx1[mutual]) & ~np.isin(idx2, idx2[mutual])
+        idx1, idx2, dist = idx1[left], idx2[left], dist[left]
+    idx1 = np.concatenate(keep1 + [np.zeros(0, dtype=np.intp)])
+    idx2 = np.concatenate(keep2 + [np.zeros(0, dtype=np.intp)])
+    dist = np.concatenate(keepd + [np.zeros(0)])
+    srt = np.argsort(idx1)
+    d2d = Angle(2*np.arcsin(np.clip(dist[srt]/2, 0., 1.)), unit='rad').to('deg')
+    return idx1[srt], idx2[srt], d2d
+
+
 def xmatch_catalogs(cat1:Table, cat2:Table, skydist:units.Quantity = 5*units.arcsec,
                      RACol1:str = "ra", DecCol1:str = "dec",
                      RACol2:str = "ra", DecCol2:str = "dec",
-                     return_match_idx:bool=False)->tuple:
+                     return_match_idx:bool=False, unique:bool=False)->tuple:
     """
     Cross matches two astronomical catalogs and returns
     the matched tables.
@@ -187,16 +241,31 @@ def xmatch_catalogs(cat1:Table, cat2:Table, skydist:units.Quantity = 5*units.arc
         return_match_idx: bool, optional
             Return the indices of the matched entries with
             with the distance instead?
+        unique: bool, optional
+            Match each entry of cat2 at most once (see match_unique)?
+            By default, the nearest cat2 entry of each cat1 entry is taken.
     returns:
         match1, match2: astropy Table
             Tables of matched rows from cat1 and cat2.
         idx, d2d (if return_match_idx): ndarrays
             Indices of matched entries from table 2
             and an array of separations to go with.
+            If unique, idx is -1 and d2d is NaN for unmatched entries.
     """
     assert isinstance(cat1, (Table, QTable))&isinstance(cat1, (Table, QTable)), "Catalogs must be astropy Table instances."
     assert (RACol1 in cat1.colnames)&(DecCol1 in cat1.colnames), " Could not find either {:s} or {:s} in cat1".format(RACol1, DecCol1)
     assert (RACol2 in cat2.colnames)&(DecCol2 in cat2.colnames), " Could not find either {:s} or {:s} in cat2".format(RACol2, DecCol2)
+    if unique:
+        idx1, idx2, d2d = match_unique(cat1[RACol1], cat1[DecCol1], cat2[RACol2], cat2[DecCol2],
+                                       skydist=skydist)
+        if return_match_idx:
+            idx = np.full(len(cat1), -1, dtype=int)
+            idx[idx1] = idx2
+            sep = np.full(len(cat1), np.nan)
+            sep[idx1] = d2d.to('deg').value
+            return idx, Angle(sep, unit='deg')
+        return cat1[idx1], cat2[idx2]
+
     # Get corodinates
     cat1_coord = SkyCoord(cat1[RACol1], cat1[DecCol1], unit = "deg")
     cat2_coord = SkyCoord(cat2[RACol2], cat2[DecCol2], unit = "deg")
@@ -394,6 +463,61 @@ def remove_duplicates(tab:Table, idcol:str)->Table:
     unique_tab.remove_rows(duplicate_ids)
     return unique_tab
     
+def _fill_value(dtype):
+    """ -999 in the given dtype, the filler of merged catalogs """
+    if dtype.kind == 'u':
+        dtype = np.dtype(np.int64)
+    return np.array(-999.).astype(dtype), dtype
+
+
+def _merge_columns(tables:list, rows:list, ngroup:int, table_names:tuple,
+                   ra:np.ndarray, dec:np.ndarray)->Table:
+    """
+    Build a merged catalog, column by column
+
+    Args:
+        tables (list of Table): Catalogs to merge
+        rows (list of np.ndarray): For each catalog, the output row of
+            each of its entries
+        ngroup (int): Number of output rows
+        table_names (tuple of str): Used to rename the columns that appear in
+            more than one catalog, as col_<table_name>
+        ra, dec (np.ndarray): Coordinates of the output rows
+
+    Returns:
+        Table: Merged catalog; missing entries are -999
+    """
+    counts = {}
+    for tab in tables:
+        for colname in tab.colnames:
+            counts[colname] = counts.get(colname, 0) + 1
+    merged = Table(meta=metadata.merge(tables[0].meta, {}, metadata_conflicts='silent'))
+    for tab in tables[1:]:
+        merged.meta = metadata.merge(merged.meta, tab.meta, metadata_conflicts='silent')
+    for tab, trows, tname in zip(tables, rows, table_names):
+        for colname in tab.colnames:
+            if colname in ['ra', 'dec']:
+                if 'ra' not in merged.colnames:
+                    merged['ra'] = Column(ra, unit=tab['ra'].unit)
+                    merged['dec'] = Column(dec, unit=tab['dec'].unit)
+                continue
+            col = tab[colname]
+            newname = colname
+            if counts[colname] > 1:
+                newname = '{:s}_{:s}'.format(colname, tname)
+            while newname in merged.colnames:
+                newname = '{:s}_{:s}'.format(newname, tname)
+            fill, dtype = _fill_value(col.dtype)
+            data = np.full((ngroup,)+col.shape[1:], fill, dtype=dtype)
+            if isinstance(col, MaskedColumn):
+                data[trows] = col.filled(fill)
+            else:
+                data[trows] = col
+            merged[newname] = Column(data, unit=col.unit, description=col.info.description,
+                                     format=col.info.format)
+    return merged
+
+
 def xmatch_and_merge_cats(tab1:Table, tab2:Table, tol:units.Quantity=1*units.arcsec,
                         table_names:tuple=('1','2'), **kwargs)->Table:
     """
@@ -401,6 +525,11 @@ def xmatch_and_merge_cats(tab1:Table, tab2:Table, tol:units.Quantity=1*units.arc
     ensures there is a unique match between tables as opposed to the default join_skycoord
     behavior which matches multiple objects on the right table to
     a source on the left. The two tables must contain the columns 'ra' and 'dec' (case-sensitive).
+
+    The match is one-to-one (see match_unique).  The matched rows come
+    first, in the order of tab1, followed by the unmatched rows of both
+    tables sorted by ra, dec.  Columns present in both tables are
+    suffixed with the table names and missing entries are -999.
     Args:
         tab1, tab2 (Table): Photometry catalogs. Must contain columns named
             ra and dec.
@@ -414,52 +543,83 @@ def xmatch_and_merge_cats(tab1:Table, tab2:Table, tol:units.Quantity=1*units.arc
     if table_names is not None:
         assert len(table_names)==2, "Invalid number of table names for two tables."
         assert (type(table_names[0])==str)&(type(table_names[1])==str), "Table names should be strings."
+    else:
+        table_names = ('1', '2')
     
     assert np.all(np.isin(['ra','dec'],tab1.colnames)), "Table 1 doesn't have column 'ra' and/or 'dec'."
     assert np.all(np.isin(['ra','dec'],tab2.colnames)), "Table 2 doesn't have column 'ra' and/or 'dec'."
 
     # Cross-match tables for tab1 INTERSECTION tab2.
-    matched_tab1, matched_tab2 = xmatch_catalogs(tab1, tab2, tol, **kwargs)
-
-    # tab1 INTERSECTION tab2
-    inner_join = hstack([matched_tab1, matched_tab2],
-                        table_names=table_names)
-    # Remove unnecessary ra/dec columns and rename remaining coordinate
-    # columns corectly. 
-    tab1_coord_cols = ['ra_'+table_names[0],"dec_"+table_names[0]]
-    tab2_coord_cols = ['ra_'+table_names[1],"dec_"+table_names[1]]
-
-
-    inner_join.remove_columns(tab2_coord_cols)
-    inner_join.rename_columns(tab1_coord_cols, ['ra', 'dec'])
-
-    # Now get all objects that weren't matched.
-    not_matched_tab1 = setdiff(tab1, matched_tab1)
-    not_matched_tab2 = setdiff(tab2, matched_tab2)
-
-    # (tab1 UNION tab2) - (tab1 INTERSECTION tab2)
-
-    # Are there unmatched entries in both tables?
-    if (len(not_matched_tab1)!=0)&(len(not_matched_tab2)!=0):
-        outer_join = join(not_matched_tab1, not_matched_tab2,
-                    keys=['ra','dec'], join_type='outer', table_names=table_names)
-        merged = vstack([inner_join, outer_join]).filled(-999.)
-    # Only table 1 has unmatched entries?
-    elif (len(not_matched_tab1)!=0)&(len(not_matched_tab2)==0):
-        merged = vstack([inner_join, not_matched_tab1])
-    # Only table 2?
-    elif (len(not_matched_tab1)==0)&(len(not_matched_tab2)!=0):
-        merged = vstack([inner_join, not_matched_tab2])
-    # Neither?
-    else:
-        merged = inner_join
-    # Final cleanup. Just in case.
-    weird_cols = np.isin(['ra_1','dec_1','ra_2','dec_2'],merged.colnames)
-    if np.any(weird_cols):
-        merged.remove_columns(np.array(['ra_1','dec_1','ra_2','dec_2'])[weird_cols])
-    # Fill and return.
-    return merged.filled(-999.)
-    
+    idx, _ = xmatch_catalogs(tab1, tab2, tol, return_match_idx=True, unique=True, **kwargs)
+    matched1 = np.where(idx >= 0)[0]
+    matched2 = idx[matched1]
+    not_matched1 = np.where(idx < 0)[0]
+    not_matched2 = np.setdiff1d(np.arange(len(tab2)), matched2)
+
+    # Unmatched rows of both tables, sorted by coordinates
+    ra_un = np.concatenate([np.asarray(tab1['ra'])[not_matched1], np.asarray(tab2['ra'])[not_matched2]])
+    dec_un = np.concatenate([np.asarray(tab1['dec'])[not_matched1], np.asarray(tab2['dec'])[not_matched2]])
+    srt = np.lexsort((dec_un, ra_un))
+    rank = np.empty_like(srt)
+    rank[srt] = np.arange(len(srt))
+    rank += len(matched1)
+
+    # Output row of each entry
+    rows1 = np.empty(len(tab1), dtype=int)
+    rows1[matched1] = np.arange(len(matched1))
+    rows1[not_matched1] = rank[:len(not_matched1)]
+    rows2 = np.empty(len(tab2), dtype=int)
+    rows2[matched2] = np.arange(len(matched1))
+    rows2[not_matched2] = rank[len(not_matched1):]
+
+    ra = np.concatenate([np.asarray(tab1['ra'])[matched1], ra_un[srt]])
+    dec = np.concatenate([np.asarray(tab1['dec'])[matched1], dec_un[srt]])
+    return _merge_columns([tab1, tab2], [rows1, rows2], len(ra), table_names, ra, dec)
+
+
+def xmatch_and_merge_many(tables:list, tol:units.Quantity=1*units.arcsec,
+                          table_names:tuple=None)->Table:
+    """
+    Cross-match and merge any number of source catalogs at once.
+
+    Each catalog is matched one-to-one (see match_unique) against the
+    sources of the catalogs before it, keeping the coordinates of the
+    first catalog a source appears in.  The merged table is built once,
+    at the end.  Columns present in more than one catalog are suffixed
+    with the table names and missing entries are -999.
+    Args:
+        tables (list of Table): Photometry catalogs. Must contain columns named
+            ra and dec.
+        tol (Quantity[Angle], optional): Maximum separation for cross-matching.
+        table_names (tuple of str, optional): Names of the tables for
+            naming unique columns in the merged table.
+            Defaults to '1', '2', ...
+    Returns:
+        merged_table (Table): Merged catalog, with the sources in order of
+            appearance.
+    """
+    if table_names is None:
+        table_names = tuple(str(ii+1) for ii in range(len(tables)))
+    assert len(table_names)==len(tables), "Invalid number of table names."
+    for ii, tab in enumerate(tables):
+        assert np.all(np.isin(['ra','dec'],tab.colnames)), "Table {:d} doesn't have column 'ra' and/or 'dec'.".format(ii+1)
+
+    ra = np.zeros(0)
+    dec = np.zeros(0)
+    rows = []
+    for tab in tables:
+        tra, tdec = np.asarray(tab['ra'], dtype=float), np.asarray(tab['dec'], dtype=float)
+        idx_tab, idx_src, _ = match_unique(tra, tdec, ra, dec, skydist=tol)
+        trows = np.full(len(tab), -1, dtype=int)
+        trows[idx_tab] = idx_src
+        # New sources
+        new = trows < 0
+        trows[new] = len(ra) + np.arange(new.sum())
+        ra = np.concatenate([ra, tra[new]])
+        dec = np.concatenate([dec, tdec[new]])
+        rows.append(trows)
+    return _merge_columns(tables, rows, len(ra), table_names, ra, dec)
+
     '''
     TODO: Write this function once CDS starts working again (through astroquery) 
     def xmatch_gaia(catalog,max_sep = 5*u.arcsec,racol='ra',deccol='dec'):
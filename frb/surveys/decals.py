@@ -6,6 +6,7 @@ from astropy.table import Table
 
 from frb.surveys import dlsurvey
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 from frb.surveys import defs
 
 # Dependencies
@@ -55,6 +56,7 @@ class DECaL_Survey(dlsurvey.DL_Survey):
         self.database = "ls_dr10.tractor"
         self.default_query_fields = list(photom['DECaL'].values())
 
+    @query_cache.cached_catalog
     def get_catalog(self, query=None, query_fields=None, print_query=False,exclude_stars=False,**kwargs):
         """
         Grab a catalog of sources around the input coordinate to the search radius
@@ -5,6 +5,7 @@ from astropy import units, io, utils
 
 from frb.surveys import dlsurvey
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 from frb.surveys import defs
 
 from IPython import embed
@@ -54,6 +55,7 @@ class DES_Survey(dlsurvey.DL_Survey):
         self.database = "des_dr2.main"
         self.default_query_fields = list(photom['DES'].values())
 
+    @query_cache.cached_catalog
     def get_catalog(self, query=None, query_fields=None, 
                     print_query=False, **kwargs):
         """
@@ -8,6 +8,7 @@ from astropy import units, io, utils
 import warnings
 
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 
 # Dependencies
 try:
@@ -116,6 +117,7 @@ class DL_Survey(surveycoord.SurveyCoord):
         imagedat = io.fits.open(utils.data.download_file(url,cache=True,show_progress=False,timeout=timeout))
         return imagedat
 
+    @query_cache.cached_catalog
     def get_catalog(self, query=None, query_fields=None, print_query=False,timeout=120, photomdict=None):
         """
         Get catalog sources around the given coordinates
@@ -201,6 +203,7 @@ class DL_Survey(surveycoord.SurveyCoord):
             img_hdu = None
         return img_hdu
     
+    @query_cache.cached_cutout
     def get_cutout(self, imsize, band=None):
         """
         Get cutout (and header)
@@ -0,0 +1,248 @@
+""" Survey footprints as HEALPix coverage maps
+
+Each footprint is a boolean HEALPix map (NESTED ordering, ICRS)
+marking the pixels covered by a survey.  Maps are looked up in
+frb/data/Surveys/footprints/ (shipped with the repo) and then in the
+user cache (see frb.io.user_cache_dir), as <survey>.fits.  They can be
+built from a Multi-Order Coverage map (MOC) FITS file, from the CDS
+MOC server, or from the positions of a survey catalog.
+
+Membership is resolved at the pixel scale of the map (~3.4 arcmin
+for nside=1024), so positions right at the edge of a survey are
+uncertain.
+"""
+
+import os
+
+import numpy as np
+
+import importlib_resources
+
+from astropy.io import fits
+
+from frb import io as frb_io
+
+# IDs of survey coverages on the CDS MOC server
+moc_ids = {'Pan-STARRS': 'CDS/P/PanSTARRS/DR1/color-z-zg-g',
+           'SDSS': 'CDS/P/SDSS9/color',
+           'DES': 'CDS/P/DES-DR2/ColorIRG',
+           'DECaL': 'CDS/P/DECaLS/DR5/color',
+           }
+# Surveys covering the whole sky
+all_sky = ['WISE']
+
+MOC_SERVER_URL = 'https://alasky.cds.unistra.fr/MocServer/query'
+DEFAULT_NSIDE = 1024
+
+# Maps loaded so far
+_footprints = {}
+
+
+def _footprint_file(surveyname, cache_dir=None):
+    """ Path of the footprint map of a survey; None if there is none """
+    filename = '{:s}.fits'.format(surveyname)
+    shipped = importlib_resources.files('frb.data') / 'Surveys' / 'footprints' / filename
+    if os.path.isfile(str(shipped)):
+        return str(shipped)
+    if cache_dir is None:
+        cache_dir = frb_io.user_cache_dir('footprints')
+    cached = os.path.join(cache_dir, filename)
+    if os.path.isfile(cached):
+        return cached
+    return None
+
+
+def has_footprint(surveyname, cache_dir=None):
+    """
+    Is the footprint of a survey available locally?
+
+    Args:
+        surveyname (str): Name of the survey
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('footprints')
+
+    Returns:
+        bool
+    """
+    return (surveyname in all_sky) or (surveyname in _footprints) or \
+        (_footprint_file(surveyname, cache_dir=cache_dir) is not None)
+
+
+def load_footprint(surveyname, cache_dir=None):
+    """
+    Load the footprint map of a survey
+
+    Args:
+        surveyname (str): Name of the survey
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('footprints')
+
+    Returns:
+        np.ndarray: Boolean NESTED HEALPix map
+    """
+    if surveyname in _footprints:
+        return _footprints[surveyname]
+    if surveyname in all_sky:
+        return np.ones(12, dtype=bool)
+    filename = _footprint_file(surveyname, cache_dir=cache_dir)
+    if filename is None:
+        raise IOError("No footprint for {:s}.  Build one with build_footprint()".format(surveyname))
+    data = fits.getdata(filename, 1)
+    _footprints[surveyname] = np.asarray(data['COVERED'], dtype=bool).ravel()
+    return _footprints[surveyname]
+
+
+def save_footprint(surveyname, footprint, cache_dir=None):
+    """
+    Write a footprint map to the cache
+
+    Args:
+        surveyname (str): Name of the survey
+        footprint (np.ndarray): Boolean NESTED HEALPix map
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('footprints')
+
+    Returns:
+        str: Name of the file written
+    """
+    import healpy as hp
+    footprint = np.asarray(footprint, dtype=bool)
+    nside = hp.npix2nside(footprint.size)
+    if cache_dir is None:
+        cache_dir = frb_io.user_cache_dir('footprints')
+    outfile = os.path.join(cache_dir, '{:s}.fits'.format(surveyname))
+    hdu = fits.BinTableHDU.from_columns([fits.Column(name='COVERED', format='L', array=footprint)])
+    hdu.header['PIXTYPE'] = 'HEALPIX'
+    hdu.header['ORDERING'] = 'NESTED'
+    hdu.header['COORDSYS'] = 'C'
+    hdu.header['NSIDE'] = nside
+    hdu.header['SURVEY'] = surveyname
+    tmpfile = outfile + '.tmp'
+    hdu.writeto(tmpfile, overwrite=True)
+    os.replace(tmpfile, outfile)
+    _footprints[surveyname] = footprint
+    return outfile
+
+
+def moc_to_footprint(uniq, nside=DEFAULT_NSIDE):
+    """
+    Convert the cells of a MOC to a HEALPix coverage map
+
+    Cells finer than nside flag their parent pixel.
+
+    Args:
+        uniq (np.ndarray): NUNIQ cell numbers of the MOC
+        nside (int, optional): nside of the output map
+
+    Returns:
+        np.ndarray: Boolean NESTED HEALPix map
+    """
+    uniq = np.asarray(uniq, dtype=np.int64)
+    order_out = int(np.log2(nside))
+    if 2**order_out != nside:
+        raise IOError("nside must be a power of 2")
+    # uniq = 4 * 4**order + ipix
+    order = np.searchsorted(4**np.arange(2, 31, dtype=np.int64), uniq, side='right')
+    ipix = uniq - 4 * 4**order.astype(np.int64)
+    footprint = np.zeros(12 * nside**2, dtype=bool)
+    # Finer cells
+    fine = order >= order_out
+    footprint[ipix[fine] >> (2 * (order[fine] - order_out))] = True
+    # Coarser cells cover a range of pixels
+    for iorder in np.unique(order[~fine]):
+        cells = ipix[~fine & (order == iorder)]
+        shift = 4**(order_out - iorder)
+        pix = (cells[:, None] * shift + np.arange(shift)[None, :]).ravel()
+        footprint[pix] = True
+    return footprint
+
+
+def read_moc(moc_file, nside=DEFAULT_NSIDE):
+    """
+    Read a MOC FITS file into a HEALPix coverage map
+
+    Args:
+        moc_file (str): MOC FITS file (IVOA standard, NUNIQ column)
+        nside (int, optional): nside of the output map
+
+    Returns:
+        np.ndarray: Boolean NESTED HEALPix map
+    """
+    data = fits.getdata(moc_file, 1)
+    return moc_to_footprint(data.field(0), nside=nside)
+
+
+def coords_to_footprint(coords, nside=DEFAULT_NSIDE, min_count=1):
+    """
+    Coverage map from the positions of survey sources
+
+    Args:
+        coords (SkyCoord): Positions of catalog sources
+        nside (int, optional): nside of the output map
+        min_count (int, optional): Minimum number of sources per covered pixel
+
+    Returns:
+        np.ndarray: Boolean NESTED HEALPix map
+    """
+    import healpy as hp
+    icrs = coords.icrs
+    pix = hp.ang2pix(nside, icrs.ra.deg, icrs.dec.deg, nest=True, lonlat=True)
+    return np.bincount(np.atleast_1d(pix), minlength=hp.nside2npix(nside)) >= min_count
+
+
+def build_footprint(surveyname, moc_file=None, coords=None, nside=DEFAULT_NSIDE,
+                    cache_dir=None, timeout=120):
+    """
+    Build and cache the footprint of a survey
+
+    From a MOC file if given, else from catalog positions if given,
+    else by downloading the MOC of the survey from the CDS MOC server.
+
+    Args:
+        surveyname (str): Name of the survey
+        moc_file (str, optional): MOC FITS file
+        coords (SkyCoord, optional): Positions of survey sources
+        nside (int, optional): nside of the map
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('footprints')
+        timeout (float, optional): Seconds to wait for the MOC server
+
+    Returns:
+        np.ndarray: Boolean NESTED HEALPix map
+    """
+    if moc_file is not None:
+        footprint = read_moc(moc_file, nside=nside)
+    elif coords is not None:
+        footprint = coords_to_footprint(coords, nside=nside)
+    else:
+        if surveyname not in moc_ids:
+            raise IOError("No MOC known for {:s}.  Provide moc_file or coords".format(surveyname))
+        import requests
+        from io import BytesIO
+        order = int(np.log2(nside))
+        rtv = requests.get(MOC_SERVER_URL, params={'ID': moc_ids[surveyname], 'get': 'moc',
+                                                   'order': order, 'fmt': 'fits'},
+                           timeout=timeout)
+        rtv.raise_for_status()
+        footprint = read_moc(BytesIO(rtv.content), nside=nside)
+    save_footprint(surveyname, footprint, cache_dir=cache_dir)
+    return footprint
+
+
+def in_footprint(surveyname, coords, cache_dir=None):
+    """
+    Are the coordinates inside the footprint of a survey?
+
+    Args:
+        surveyname (str): Name of the survey
+        coords (SkyCoord): One or many coordinates
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('footprints')
+
+    Returns:
+        bool or np.ndarray: Shape of coords
+    """
+    import healpy as hp
+    footprint = load_footprint(surveyname, cache_dir=cache_dir)
+    nside = hp.npix2nside(footprint.size)
+    icrs = coords.icrs
+    pix = hp.ang2pix(nside, icrs.ra.deg, icrs.dec.deg, nest=True, lonlat=True)
+    inside = footprint[pix]
+    if coords.isscalar:
+        return bool(inside)
+    return inside
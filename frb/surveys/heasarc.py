@@ -13,6 +13,7 @@ except ImportError:
 
 from frb.surveys import surveycoord
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 
 
 class HEASARC_Survey(surveycoord.SurveyCoord):
@@ -34,6 +35,7 @@ class HEASARC_Survey(surveycoord.SurveyCoord):
         # Instantiate astroquery object
         self.heasarc = Heasarc()
 
+    @query_cache.cached_catalog
     def get_catalog(self):
         """
         Grab a catalog of sources around the input coordinate to the search radius
@@ -88,6 +90,7 @@ class SkyView_Survey(surveycoord.SurveyCoord):
         # Instantiate astroquery object
         self.skyview = SkyView()
 
+    @query_cache.cached_cutout
     def get_cutout(self, radius=None):
         radius = radius if radius is not None else self.radius
         self.cutout_size = 2*radius
@@ -13,6 +13,7 @@ import ssl
 from io import StringIO
 from . import surveycoord
 from . import catalog_utils
+from . import query_cache
 from pandas import read_csv
 from astropy.table import Table
 from .defs import HSC_API_URL as api_url
@@ -54,6 +55,7 @@ class HSC_Survey(surveycoord.SurveyCoord):
         self.data_release = 'pdr3'
 
 
+    @query_cache.cached_catalog
     def get_catalog(self, query_fields=None, query=None, max_time=120,
                     print_query=False, query_table='pdr3_wide.summary',
                     photoz_table = 'mizuki'):
@@ -2,13 +2,161 @@
 import os
 import os.path
 from . import surveycoord
-from astropy.table import Table
+from astropy.table import Table, Column, MaskedColumn
 from frb.defs import frb_cosmo
+from frb import io as frb_io
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 
 import numpy as np
 
+# Bump when the layout of the store changes
+STORE_VERSION = 1
+
+# Stores opened in this process, keyed by the LVS file
+_stores = {}
+
+
+class LVSStore(object):
+    """
+    Columnar, memory-mapped copy of the NED-LVS table
+
+    The rows are sorted by their NESTED HEALPix pixel and
+    pix_start[ipix]:pix_start[ipix+1] are the rows of pixel ipix,
+    so a cone search only reads the rows of the pixels it touches.
+    The row array holds the index of each row in the LVS file.
+
+    Built once from the LVS file and cached in
+    frb.io.user_cache_dir('NEDLVS').  Use LVSStore.open() to share
+    one store between the NEDLVS objects of a process.
+
+    Args:
+        datapath (str): LVS file
+        nside (int, optional): nside of the HEALPix index
+        cache_dir (str, optional): Defaults to frb.io.user_cache_dir('NEDLVS')
+    """
+
+    def __init__(self, datapath, nside=64, cache_dir=None):
+        self.datapath = datapath
+        self.nside = nside
+        stat = os.stat(datapath)
+        params = dict(version=STORE_VERSION, datapath=os.path.abspath(datapath),
+                      size=stat.st_size, mtime=stat.st_mtime, nside=nside)
+        if cache_dir is None:
+            cache_dir = frb_io.user_cache_dir('NEDLVS')
+        self.store_dir = os.path.join(cache_dir, 'lvs_'+frb_io.hash_params(params))
+        if not os.path.isdir(self.store_dir):
+            self._build()
+        self.meta = frb_io.loadjson(os.path.join(self.store_dir, 'meta.json'))
+        self.arrays = frb_io.load_npy_dir(self.store_dir, mmap_mode='r')
+        self.pix_start = np.asarray(self.arrays['pix_start'])
+
+    @classmethod
+    def open(cls, datapath, **kwargs):
+        """
+        Store of an LVS file, shared within the process
+
+        Args:
+            datapath (str): LVS file
+            **kwargs: Passed to LVSStore
+
+        Returns:
+            LVSStore
+        """
+        key = (os.path.abspath(datapath), kwargs.get('nside', 64))
+        if key not in _stores:
+            _stores[key] = cls(datapath, **kwargs)
+        return _stores[key]
+
+    def __len__(self):
+        return int(self.pix_start[-1])
+
+    def __repr__(self):
+        txt = '<{:s}: datapath={:s}, nrows={:d}, nside={:d}'.format(
+            self.__class__.__name__, self.datapath, len(self), self.nside)
+        return txt + '>'
+
+    @property
+    def colnames(self):
+        return [col['name'] for col in self.meta['columns']]
+
+    def _build(self):
+        """ Convert the LVS file into the store """
+        import healpy as hp
+        tbl = Table.read(self.datapath)
+        pix = hp.ang2pix(self.nside, np.asarray(tbl['ra'], dtype=float),
+                         np.asarray(tbl['dec'], dtype=float), nest=True, lonlat=True)
+        srt = np.argsort(pix, kind='stable')
+        arrays = dict(pix_start=np.searchsorted(pix[srt], np.arange(hp.nside2npix(self.nside)+1)),
+                      row=srt)
+        columns = []
+        for ii, colname in enumerate(tbl.colnames):
+            col = tbl[colname]
+            data = np.asarray(col)[srt]
+            if data.dtype.kind == 'O':
+                data = data.astype(str)
+            if data.dtype.kind == 'S':
+                data = np.char.decode(data)
+            arrays['col{:03d}'.format(ii)] = data
+            masked = isinstance(col, MaskedColumn) and np.any(col.mask)
+            if masked:
+                arrays['mask{:03d}'.format(ii)] = np.asarray(col.mask)[srt]
+            columns.append(dict(name=colname, masked=bool(masked),
+                                unit=None if col.unit is None else col.unit.to_string()))
+        frb_io.save_npy_dir(self.store_dir, arrays,
+                            meta=dict(columns=columns, datapath=self.datapath, nside=self.nside))
+
+    def column(self, colname, rows=None):
+        """
+        Read a column
+
+        Args:
+            colname (str): Column name
+            rows (np.ndarray, optional): Rows to read; defaults to all
+
+        Returns:
+            astropy.table.Column or MaskedColumn
+        """
+        ii = self.colnames.index(colname)
+        info = self.meta['columns'][ii]
+        data = self.arrays['col{:03d}'.format(ii)]
+        data = np.array(data if rows is None else data[rows])
+        if info['masked']:
+            mask = self.arrays['mask{:03d}'.format(ii)]
+            mask = np.array(mask if rows is None else mask[rows])
+            return MaskedColumn(data, name=colname, mask=mask, unit=info['unit'])
+        return Column(data, name=colname, unit=info['unit'])
+
+    def cone_rows(self, coord, radius):
+        """
+        Rows within a cone
+
+        Args:
+            coord (SkyCoord): Center of the cone
+            radius (Quantity): Radius of the cone
+
+        Returns:
+            np.ndarray, Angle: Row indices, in the order of the LVS file,
+                and their separation from coord
+        """
+        import healpy as hp
+        icrs = coord.icrs
+        vec = hp.ang2vec(icrs.ra.deg, icrs.dec.deg, lonlat=True)
+        rad = min(radius.to('rad').value, np.pi)
+        pixels = hp.query_disc(self.nside, vec, rad, inclusive=True, nest=True)
+        starts, stops = self.pix_start[pixels], self.pix_start[pixels+1]
+        keep = stops > starts
+        starts, stops = starts[keep], stops[keep]
+        # Candidate rows of the touched pixels
+        lengths = stops - starts
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        rows = rows[np.argsort(self.arrays['row'][rows])]
+        ra = np.asarray(self.arrays['col{:03d}'.format(self.colnames.index('ra'))][rows], dtype=float)
+        dec = np.asarray(self.arrays['col{:03d}'.format(self.colnames.index('dec'))][rows], dtype=float)
+        seps = icrs.separation(SkyCoord(ra, dec, unit='deg'))
+        inside = seps <= radius
+        return rows[inside], seps[inside]
+
 
 class NEDLVS(surveycoord.SurveyCoord):
     """
@@ -16,14 +164,17 @@ class NEDLVS(surveycoord.SurveyCoord):
     This requires the LVS table to be downloaded
     from https://ned.ipac.caltech.edu/NED::LVS/
     and linked via the environment variable NEDLVS
+
+    The table is read through an LVSStore, converted on first
+    use and shared by all NEDLVS objects.
     """
 
 
     def __init__(self, coord, radius, cosmo=None, **kwargs):
         surveycoord.SurveyCoord.__init__(self, coord, radius, **kwargs)
-        assert 'NEDLVS' in os.environ, "NEDLVS environment variable not set. Please download the LVS table from https://ned.ipac.caltech.edu/NED::LVS/ and set the environment variable NEDLVS to the path of the downloaded file."        
+        assert 'NEDLVS' in os.environ, "NEDLVS environment variable not set. Please download the LVS table from https://ned.ipac.caltech.edu/NED::LVS/ and set the environment variable NEDLVS to the path of the downloaded file."
         self.survey = 'NEDLVS'
-        self.coord = coord 
+        self.coord = coord
         self.radius = radius.to('deg').value
         self.datapath = os.environ['NEDLVS']
         if cosmo is None:
@@ -31,21 +182,18 @@ class NEDLVS(surveycoord.SurveyCoord):
         else:
             self.cosmo = cosmo
 
-        # Read in the data and store in memory
-        self.datatab = Table.read(self.datapath)
-        self.datatab['coord'] = SkyCoord(self.datatab['ra'], self.datatab['dec'], unit="deg")
-        self.datatab['coord'] = SkyCoord(self.datatab['ra'], self.datatab['dec'], unit="deg")
-        self.datatab['ang_sep'] = self.coord.separation(self.datatab['coord']).to('arcmin')
-        self.datatab['phys_sep'] = self.datatab['DistMpc']*u.Mpc*np.sin(self.datatab['ang_sep'].to('rad').value)
-    
+        # Memory-mapped store, shared across instances
+        self.store = LVSStore.open(self.datapath)
+
     def get_column_names(self):
-        return self.datatab.colnames
+        return self.store.colnames + ['coord', 'ang_sep', 'phys_sep']
 
     def get_catalog(self, z_lim=np.inf,
                     impact_par_lim=np.inf*u.Mpc,
                     ang_sep_lim=90*u.deg, query_fields=None):
         """
         Get the catalog of objects within the given limits of redshift, impact parameter, and angular separation.
+        Only the rows in the cone allowed by the limits are read.
         Args:
             z_lim (float): The maximum redshift of the objects to include in the catalog.
             impact_par_lim (Quantity): The maximum impact parameter of the objects to include in the catalog.
@@ -57,13 +205,36 @@ class NEDLVS(surveycoord.SurveyCoord):
         if query_fields is None:
             query_fields = ['objname', 'ra', 'dec', 'ebv', 'z', 'z_unc', 'z_tech', 'DistMpc', 'DistMpc_unc', 'DistMpc_method', 'Mstar', 'Mstar_unc']
         else:
-            assert np.isin(query_fields, self.datatab.colnames).all(), "One or more of the requested fields is not in the NEDLVS table. Check the column names with get_column_names()."
+            assert np.isin(query_fields, self.get_column_names()).all(), "One or more of the requested fields is not in the NEDLVS table. Check the column names with get_column_names()."
+        # Galaxies beyond the Local Group (DistMpc > 2) within the impact
+        # parameter are within arcsin(impact_par_lim/2 Mpc) on the sky
+        cone = ang_sep_lim.to('deg')
+        if cone <= 90*u.deg:
+            sin_max = (impact_par_lim/(2*u.Mpc)).decompose().value
+            if sin_max < 1.:
+                cone = min(cone, np.arcsin(sin_max)*u.rad)
+        rows, ang_sep = self.store.cone_rows(self.coord, cone)
+        DistMpc = self.store.column('DistMpc', rows)
+        if isinstance(DistMpc, MaskedColumn):
+            DistMpc = DistMpc.filled(np.nan)
+        DistMpc = np.asarray(DistMpc, dtype=float)
+        phys_sep = DistMpc*u.Mpc*np.sin(ang_sep.to('rad').value)
         # ...
-        distance_cut = self.datatab['DistMpc']<self.cosmo.luminosity_distance(z_lim).to('Mpc').value #Only need foreground objects
-        valid_distances = self.datatab['DistMpc']>2 # Exclude local group
-        phys_sep_cut = self.datatab['phys_sep']<impact_par_lim # Impact param within limit
-        ang_sep_cut = self.datatab['ang_sep']<ang_sep_lim # Make sure the earth is not between the FRB and the galaxy
+        distance_cut = DistMpc<self.cosmo.luminosity_distance(z_lim).to('Mpc').value #Only need foreground objects
+        valid_distances = DistMpc>2 # Exclude local group
+        phys_sep_cut = phys_sep<impact_par_lim # Impact param within limit
+        ang_sep_cut = ang_sep<ang_sep_lim # Make sure the earth is not between the FRB and the galaxy
         is_nearby_fg = valid_distances&distance_cut & phys_sep_cut & ang_sep_cut
-        
-        close_by = self.datatab[is_nearby_fg][query_fields]
-        return close_by
\ No newline at end of file
+
+        close_by = Table()
+        for field in query_fields:
+            if field == 'coord':
+                close_by['coord'] = SkyCoord(self.store.column('ra', rows[is_nearby_fg]),
+                                             self.store.column('dec', rows[is_nearby_fg]), unit='deg')
+            elif field == 'ang_sep':
+                close_by['ang_sep'] = ang_sep[is_nearby_fg].to('arcmin')
+            elif field == 'phys_sep':
+                close_by['phys_sep'] = phys_sep[is_nearby_fg]
+            else:
+                close_by[field] = self.store.column(field, rows[is_nearby_fg])
+        return close_by
@@ -3,7 +3,7 @@
 import numpy as np
 from astropy import units, io, utils
 
-from frb.surveys import dlsurvey, defs
+from frb.surveys import dlsurvey, defs, query_cache
 from frb.surveys import catalog_utils
 
 # Dependencies
@@ -48,6 +48,7 @@ class NSC_Survey(dlsurvey.DL_Survey):
         self.database = "nsc_dr2.object"
         self.default_query_fields = list(photom['NSC'].values())
 
+    @query_cache.cached_catalog
     def get_catalog(self, query=None, query_fields=None, print_query=False,**kwargs):
         """
         Grab a catalog of sources around the input coordinate to the search radius
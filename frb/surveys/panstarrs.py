@@ -18,7 +18,7 @@ from .images import grab_from_url
 import warnings
 import requests
 
-from frb.surveys import surveycoord,catalog_utils,images
+from frb.surveys import surveycoord,catalog_utils,images,query_cache
 
 from IPython import embed
 
@@ -63,6 +63,7 @@ class Pan_STARRS_Survey(surveycoord.SurveyCoord):
 
         self.Survey = "Pan_STARRS"
     
+    @query_cache.cached_catalog
     def get_catalog(self,query_fields=None,release="dr2",
                     table="stack",print_query=False,
                     use_psf=False):
@@ -152,6 +153,7 @@ class Pan_STARRS_Survey(surveycoord.SurveyCoord):
         #Return
         return self.catalog.copy()
 
+    @query_cache.cached_cutout
     def get_cutout(self,imsize=30*u.arcsec,filt="irg",output_size=None):
         """
         Grab a color cutout (PNG) from Pan-STARRS
@@ -0,0 +1,446 @@
+""" Persistent local cache of survey catalogs and cutouts
+
+Queries are keyed by the survey, its release/database, the query
+arguments and the cone (coordinate and radius).  Catalogs are stored
+as Parquet (if pyarrow is installed) or FITS tables and cutouts as FITS
+files under the user cache (see frb.io.user_cache_dir), indexed by a
+small sqlite database.  Entries expire after a time-to-live and the
+least recently used ones are evicted once the cache exceeds its size.
+
+A cone that lies within a cached, larger cone of the same query is
+served from it without going back to the archive.
+
+Caching is opt-in:  set FRB_SURVEY_CACHE=1 or call
+set_default_cache(QueryCache(ttl=...)) before creating survey objects.
+"""
+
+import os
+import time
+import sqlite3
+import inspect
+import tempfile
+import functools
+import contextlib
+import warnings
+
+import numpy as np
+
+from astropy.coordinates import SkyCoord
+from astropy.io import fits
+from astropy.table import Table
+from astropy import units
+
+from frb import io as frb_io
+from frb.surveys import catalog_utils
+
+try:
+    import pyarrow
+except ImportError:
+    flg_parquet = False
+else:
+    flg_parquet = True
+
+DEFAULT_TTL = 30 * 24 * 3600.  # seconds
+DEFAULT_MAX_SIZE = 2 * 1024**3  # bytes
+
+# Arguments of get_catalog/get_cutout that do not change the result
+_IGNORED_ARGS = ('print_query', 'timeout', 'max_time', 'verbose')
+
+_default_cache = None
+
+
+class QueryCache(object):
+    """
+    On-disk cache of survey catalogs and cutouts
+
+    Args:
+        cache_dir (str, optional): Cache folder.
+            Defaults to the 'surveys' folder of the user cache.
+        ttl (float, optional): Time-to-live of an entry in seconds
+        max_size (int, optional): Maximum size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = frb_io.user_cache_dir('surveys')
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_file = os.path.join(self.cache_dir, 'index.sqlite')
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                       "key TEXT PRIMARY KEY, survey TEXT, kind TEXT, params TEXT, "
+                       "ra REAL, dec REAL, radius REAL, path TEXT, size INTEGER, "
+                       "created REAL, accessed REAL)")
+
+    def __repr__(self):
+        txt = '<{:s}: cache_dir={:s}, ttl={:g}s, max_size={:d}'.format(
+            self.__class__.__name__, self.cache_dir, self.ttl, int(self.max_size))
+        return txt + '>'
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.index_file, timeout=60.)
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def _remove(self, db, key, path):
+        db.execute("DELETE FROM entries WHERE key=?", (key,))
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def _add(self, survey, kind, params_hash, coord, radius, write, ext):
+        """ Write a new entry with write(filename) and index it """
+        key = frb_io.hash_params(dict(survey=survey, kind=kind, params=params_hash,
+                                      ra=coord.ra.deg, dec=coord.dec.deg, radius=radius))
+        path = os.path.join(self.cache_dir, kind, key+ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_', suffix=ext)
+        os.close(fd)
+        try:
+            write(tmpfile)
+            os.replace(tmpfile, path)
+        finally:
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                       (key, survey, kind, params_hash, coord.ra.deg, coord.dec.deg,
+                        radius, path, os.path.getsize(path), now, now))
+        self.evict()
+
+    def get_catalog(self, survey, coord, radius, params):
+        """
+        Look for a cached catalog covering the cone
+
+        Args:
+            survey (str): Survey name
+            coord (SkyCoord): Center of the cone
+            radius (Quantity): Radius of the cone
+            params (dict): Query parameters
+
+        Returns:
+            astropy.table.Table or None: Catalog of the cone, if cached
+        """
+        coord = coord.icrs
+        rad = radius.to('deg').value
+        params_hash = frb_io.hash_params(params)
+        with self._connect() as db:
+            rows = db.execute("SELECT key, ra, dec, radius, path FROM entries "
+                              "WHERE kind='catalog' AND survey=? AND params=? AND radius>=? "
+                              "AND created>=? ORDER BY radius",
+                              (survey, params_hash, rad, time.time()-self.ttl)).fetchall()
+            for key, ra, dec, cached_rad, path in rows:
+                sep = coord.separation(SkyCoord(ra=ra, dec=dec, unit='deg')).deg
+                if sep + rad > cached_rad * (1 + 1e-9):
+                    continue
+                try:
+                    catalog = _read_catalog(path)
+                except (OSError, ValueError):
+                    # Lost or damaged
+                    self._remove(db, key, path)
+                    continue
+                db.execute("UPDATE entries SET accessed=? WHERE key=?", (time.time(), key))
+                break
+            else:
+                return None
+        # Cut down a larger cone
+        if (sep > 0. or rad < cached_rad) and len(catalog) > 0:
+            cat_coords = SkyCoord(ra=catalog['ra'], dec=catalog['dec'], unit='deg')
+            catalog = catalog[coord.separation(cat_coords).deg <= rad]
+            if 'separation' in catalog.colnames:
+                catalog = catalog_utils.sort_by_separation(catalog, coord)
+        catalog.meta['radius'] = radius
+        catalog.meta['survey'] = survey
+        return catalog
+
+    def put_catalog(self, survey, coord, radius, params, catalog):
+        """
+        Cache the catalog of a cone
+
+        Args:
+            survey (str): Survey name
+            coord (SkyCoord): Center of the cone
+            radius (Quantity): Radius of the cone
+            params (dict): Query parameters
+            catalog (astropy.table.Table): Catalog to cache
+        """
+        tbl = Table(catalog, copy=False)
+        tbl.meta = {}
+        if flg_parquet:
+            write, ext = functools.partial(tbl.write, format='parquet', overwrite=True), '.parquet'
+        else:
+            write, ext = functools.partial(tbl.write, format='fits', overwrite=True), '.fits'
+        try:
+            self._add(survey, 'catalog', frb_io.hash_params(params), coord.icrs,
+                      radius.to('deg').value, write, ext)
+        except (TypeError, ValueError) as err:
+            warnings.warn("Could not cache the {:s} catalog: {}".format(survey, err), RuntimeWarning)
+
+    def get_cutout(self, survey, coord, params):
+        """
+        Look for a cached cutout
+
+        Args:
+            survey (str): Survey name
+            coord (SkyCoord): Center of the cutout
+            params (dict): Cutout parameters
+
+        Returns:
+            tuple or None: (state, returned), see put_cutout, if cached
+        """
+        coord = coord.icrs
+        params_hash = frb_io.hash_params(dict(params, ra=coord.ra.deg, dec=coord.dec.deg))
+        with self._connect() as db:
+            row = db.execute("SELECT key, path FROM entries WHERE kind='cutout' AND survey=? "
+                             "AND params=? AND created>=?",
+                             (survey, params_hash, time.time()-self.ttl)).fetchone()
+            if row is None:
+                return None
+            key, path = row
+            try:
+                cutout = _read_items(path)
+            except (OSError, ValueError):
+                self._remove(db, key, path)
+                return None
+            db.execute("UPDATE entries SET accessed=? WHERE key=?", (time.time(), key))
+        return cutout
+
+    def put_cutout(self, survey, coord, params, state, returned):
+        """
+        Cache a cutout
+
+        Args:
+            survey (str): Survey name
+            coord (SkyCoord): Center of the cutout
+            params (dict): Cutout parameters
+            state (dict): cutout, cutout_hdr and cutout_size attributes of the survey
+            returned (object): Value returned by get_cutout
+        """
+        coord = coord.icrs
+        params_hash = frb_io.hash_params(dict(params, ra=coord.ra.deg, dec=coord.dec.deg))
+        try:
+            self._add(survey, 'cutout', params_hash, coord, 0.,
+                      functools.partial(_write_items, state=state, returned=returned), '.fits')
+        except (TypeError, ValueError) as err:
+            warnings.warn("Could not cache the {:s} cutout: {}".format(survey, err), RuntimeWarning)
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used ones
+        until the cache fits in max_size
+        """
+        with self._connect() as db:
+            for key, path in db.execute("SELECT key, path FROM entries WHERE created<?",
+                                        (time.time()-self.ttl,)).fetchall():
+                self._remove(db, key, path)
+            rows = db.execute("SELECT key, path, size FROM entries ORDER BY accessed DESC").fetchall()
+            sizes = np.cumsum([row[2] for row in rows])
+            for (key, path, _), size in zip(rows, sizes):
+                if size > self.max_size:
+                    self._remove(db, key, path)
+
+    def clear(self):
+        """ Empty the cache """
+        with self._connect() as db:
+            for key, path in db.execute("SELECT key, path FROM entries").fetchall():
+                self._remove(db, key, path)
+
+
+def _read_catalog(path):
+    if path.endswith('.parquet'):
+        return Table.read(path, format='parquet')
+    # Keep NaN and '' as the archive returned them, not masked
+    return Table.read(path, format='fits', character_as_bytes=False, mask_invalid=False)
+
+
+def _write_items(path, state, returned):
+    """
+    Write the cutout state and the returned value(s) of get_cutout
+    as the HDUs of one FITS file
+    """
+    prihdu = fits.PrimaryHDU()
+    items = [state['cutout'], state['cutout_hdr']]
+    if isinstance(returned, tuple):
+        prihdu.header['RETTUPLE'] = True
+        items += list(returned)
+    else:
+        prihdu.header['RETTUPLE'] = False
+        items.append(returned)
+    if state['cutout_size'] is not None:
+        size = units.Quantity(state['cutout_size'])
+        prihdu.header['CUTSIZE'] = size.value
+        prihdu.header['CUTUNIT'] = size.unit.to_string()
+    hdus = [prihdu]
+    for item in items:
+        if item is None:
+            hdu = fits.ImageHDU()
+            kind = 'none'
+        elif isinstance(item, fits.Header):
+            hdu = fits.ImageHDU(header=item.copy())
+            kind = 'header'
+        elif isinstance(item, (fits.PrimaryHDU, fits.ImageHDU)):
+            hdu = fits.ImageHDU(data=item.data, header=item.header.copy())
+            kind = 'hdu'
+        elif isinstance(item, np.ndarray):
+            hdu = fits.ImageHDU(data=item)
+            kind = 'array'
+        elif hasattr(item, 'mode') and hasattr(item, 'getdata'):
+            # PIL image
+            hdu = fits.ImageHDU(data=np.asarray(item))
+            hdu.header['PILMODE'] = item.mode
+            kind = 'image'
+        else:
+            raise TypeError("Cannot cache a cutout of type {}".format(type(item)))
+        hdu.header['FRBKIND'] = kind
+        hdus.append(hdu)
+    fits.HDUList(hdus).writeto(path, overwrite=True)
+
+
+def _read_items(path):
+    """
+    Read back a cutout written by _write_items
+
+    Returns:
+        dict, object: cutout state, value returned by get_cutout
+    """
+    items = []
+    with fits.open(path, lazy_load_hdus=False) as hdul:
+        prihdr = hdul[0].header
+        for hdu in hdul[1:]:
+            kind = hdu.header['FRBKIND']
+            if kind == 'none':
+                items.append(None)
+                continue
+            header = hdu.header.copy()
+            for card in ('FRBKIND', 'PILMODE'):
+                header.remove(card, ignore_missing=True)
+            data = None if hdu.data is None else hdu.data.copy()
+            if kind == 'header':
+                items.append(header)
+            elif kind == 'hdu':
+                items.append(fits.PrimaryHDU(data=data, header=header))
+            elif kind == 'array':
+                items.append(data)
+            elif kind == 'image':
+                from PIL import Image
+                items.append(Image.fromarray(data, mode=hdu.header['PILMODE']))
+    state = dict(cutout=items[0], cutout_hdr=items[1], cutout_size=None)
+    if 'CUTSIZE' in prihdr:
+        state['cutout_size'] = prihdr['CUTSIZE'] * units.Unit(prihdr['CUTUNIT'])
+    returned = tuple(items[2:]) if prihdr['RETTUPLE'] else items[2]
+    return state, returned
+
+
+def default_cache():
+    """
+    Cache used by new survey objects
+
+    Caching is off unless enabled with set_default_cache() or by
+    setting the FRB_SURVEY_CACHE environment variable to 1, which
+    uses a QueryCache with the default TTL (DEFAULT_TTL, 30 days)
+    and size limit (DEFAULT_MAX_SIZE, 2 GB).
+
+    Returns:
+        QueryCache or None
+    """
+    global _default_cache
+    if _default_cache is None and \
+            os.environ.get('FRB_SURVEY_CACHE', '0').lower() in ('1', 'true', 'yes'):
+        _default_cache = QueryCache()
+    return _default_cache
+
+
+def set_default_cache(cache):
+    """
+    Set the cache used by new survey objects
+
+    Args:
+        cache (QueryCache or None): None disables caching
+    """
+    global _default_cache
+    if cache is None:
+        os.environ.pop('FRB_SURVEY_CACHE', None)
+    _default_cache = cache
+
+
+def _query_params(survey_obj, method, args, kwargs):
+    """ Cache key parameters of a get_catalog/get_cutout call """
+    bound = inspect.signature(method).bind(survey_obj, *args, **kwargs)
+    bound.apply_defaults()
+    params = {key: value for key, value in bound.arguments.items()
+              if key != 'self' and key not in _IGNORED_ARGS}
+    params['_method'] = method.__qualname__
+    for attr in ('data_release', 'database'):
+        params['_'+attr] = getattr(survey_obj, attr, None)
+    return params
+
+
+def _survey_name(survey_obj):
+    return survey_obj.survey if survey_obj.survey is not None else survey_obj.__class__.__name__
+
+
+def cached_catalog(get_catalog):
+    """
+    Decorator serving SurveyCoord.get_catalog from the cache of the survey
+
+    Calls with a custom SQL query are not cached.
+    """
+    @functools.wraps(get_catalog)
+    def wrapper(self, *args, **kwargs):
+        cache = getattr(self, 'cache', None)
+        if cache is None or getattr(self, '_in_cached_call', False):
+            return get_catalog(self, *args, **kwargs)
+        params = _query_params(self, get_catalog, args, kwargs)
+        if params.get('query') is not None:
+            return get_catalog(self, *args, **kwargs)
+        survey = _survey_name(self)
+        catalog = cache.get_catalog(survey, self.coord, self.radius, params)
+        if catalog is not None:
+            self.catalog = catalog
+            return self.catalog.copy()
+        self._in_cached_call = True
+        try:
+            result = get_catalog(self, *args, **kwargs)
+        finally:
+            self._in_cached_call = False
+        catalog = result if isinstance(result, Table) else self.catalog
+        if catalog is not None:
+            cache.put_catalog(survey, self.coord, self.radius, params, catalog)
+        return result
+    return wrapper
+
+
+def cached_cutout(get_cutout):
+    """
+    Decorator serving SurveyCoord.get_cutout from the cache of the survey
+    """
+    @functools.wraps(get_cutout)
+    def wrapper(self, *args, **kwargs):
+        cache = getattr(self, 'cache', None)
+        if cache is None or getattr(self, '_in_cached_call', False):
+            return get_cutout(self, *args, **kwargs)
+        params = _query_params(self, get_cutout, args, kwargs)
+        survey = _survey_name(self)
+        cached = cache.get_cutout(survey, self.coord, params)
+        if cached is not None:
+            state, returned = cached
+            for key, value in state.items():
+                setattr(self, key, value)
+            return returned
+        self._in_cached_call = True
+        try:
+            returned = get_cutout(self, *args, **kwargs)
+        finally:
+            self._in_cached_call = False
+        if self.cutout is not None:
+            state = dict(cutout=self.cutout, cutout_hdr=getattr(self, 'cutout_hdr', None),
+                         cutout_size=self.cutout_size)
+            cache.put_cutout(survey, self.coord, params, state, returned)
+        return returned
+    return wrapper
@@ -16,6 +16,7 @@ except ImportError:
 
 from frb.surveys import surveycoord
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 from frb.surveys import images
 
 # Define the data model for SDSS data
@@ -44,6 +45,7 @@ class SDSS_Survey(surveycoord.SurveyCoord):
         #
         self.survey = 'SDSS'
 
+    @query_cache.cached_catalog
     def get_catalog(self, photoobj_fields=None, timeout=120, print_query=False):
         """
         Query SDSS for all objects within a given
@@ -161,6 +163,7 @@ class SDSS_Survey(surveycoord.SurveyCoord):
         # Return
         return self.catalog.copy()
 
+    @query_cache.cached_cutout
     def get_cutout(self, imsize, scale=0.396127):
         """
         Grab a cutout from SDSS
@@ -1,6 +1,7 @@
 """ utils related to SurveyCoord objects"""
 
 from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from frb.surveys.sdss import SDSS_Survey
 from frb.surveys.des import DES_Survey
 from frb.surveys.wise import WISE_Survey
@@ -12,7 +13,8 @@ from frb.surveys.nsc import NSC_Survey
 from frb.surveys.delve import DELVE_Survey
 from frb.surveys.vista import VISTA_Survey
 from frb.surveys.hsc import HSC_Survey, QueryError
-from frb.surveys.catalog_utils import xmatch_and_merge_cats
+from frb.surveys.catalog_utils import xmatch_and_merge_cats, xmatch_and_merge_many
+from frb.surveys import footprints
 
 from astropy.coordinates import SkyCoord
 from astropy import units as u
@@ -21,6 +23,7 @@ from pyvo.dal import DALServiceError
 from requests import ReadTimeout
 
 import numpy as np
+import time
 import warnings
 
 optical_surveys = ['Pan-STARRS', 'WISE', 'SDSS', 'DES', 'DELVE',  'DECaL', 'VISTA', 'NSC', 'HSC']
@@ -79,9 +82,10 @@ def load_survey_by_name(name, coord, radius, **kwargs):
     # Return
     return survey
 
-def is_inside(surveyname:str, coord:SkyCoord)->bool:
+def _is_inside_cone(surveyname:str, coord:SkyCoord)->bool:
     """
-    Tests if a coordinate is within a survey footprint.
+    Tests if a coordinate is within a survey footprint
+    with a 1 arcmin cone search around it.
     Args:
         surveyname (str): Name of the survey
         coord (astropy.coordiantes.SkyCoord): Coordinate to check
@@ -123,21 +127,54 @@ def is_inside(surveyname:str, coord:SkyCoord)->bool:
                 separations = coord.separation(cat_coords)
                 if np.min(separations)>2*u.arcsec:
                     warnings.warn("Only {} objects found in {} within 1'. Check location manually.".format(len(cat), surveyname),
-                                  RuntimeWarning, stacklevel=2)
+                                  RuntimeWarning, stacklevel=3)
             return False
         else:
             return True
 
-def in_which_survey(coord:SkyCoord, optical_only:bool=True)->dict:
+def is_inside(surveyname:str, coord:SkyCoord, use_footprint:bool=True,
+              fallback:bool=True):
+    """
+    Tests if a coordinate is within a survey footprint.
+
+    The HEALPix footprint map of the survey is used if one is
+    available (see frb.surveys.footprints).  Otherwise a 1 arcmin cone
+    search is run around each coordinate and the position angles of
+    the returned sources are inspected.
+    Args:
+        surveyname (str): Name of the survey
+        coord (astropy.coordiantes.SkyCoord): Coordinate(s) to check
+        use_footprint (bool, optional): Use the footprint map, if available
+        fallback (bool, optional): Run the cone search when there is no
+            footprint map.  If False, a missing map raises an IOError.
+    Returns:
+        inside (bool or np.ndarray): True if coord is within the footprint.
+    """
+    if use_footprint and footprints.has_footprint(surveyname):
+        return footprints.in_footprint(surveyname, coord)
+    if use_footprint and not fallback:
+        raise IOError("No footprint for {:s}.  Build one with footprints.build_footprint()".format(surveyname))
+    if coord.isscalar:
+        return _is_inside_cone(surveyname, coord)
+    return np.array([_is_inside_cone(surveyname, icoord) for icoord in coord.ravel()],
+                    dtype=bool).reshape(coord.shape)
+
+def in_which_survey(coord:SkyCoord, optical_only:bool=True, use_footprints:bool=True,
+                    fallback:bool=True)->dict:
     """
     Check if a particular coord is inside any
     survey that can be currently queried from
     `frb.surveys` module.
     Args:
-        coord (astropy.coordiantes.SkyCoord): Coordinate to check
+        coord (astropy.coordiantes.SkyCoord): Coordinate(s) to check
+        optical_only (bool, optional): Only check the optical surveys
+        use_footprints (bool, optional): Use the survey footprint maps,
+            where available. See is_inside().
+        fallback (bool, optional): Run cone searches for the surveys
+            without a footprint map.  If False, these surveys are left out.
     Returns:
         inside (dict): A dict which tells which surveys the coordinate
-            is inside.
+            is inside. Values are bool arrays for an array of coordinates.
     """
     # Loop through known surveys and check them one by one.
     inside = {}
@@ -149,16 +186,48 @@ def in_which_survey(coord:SkyCoord, optical_only:bool=True)->dict:
         # Skip PSRCAT
         if surveyname == "PSRCAT":
             continue
-        inside[surveyname] = is_inside(surveyname, coord)
+        if use_footprints and not fallback and not footprints.has_footprint(surveyname):
+            continue
+        inside[surveyname] = is_inside(surveyname, coord, use_footprint=use_footprints,
+                                       fallback=fallback)
     
     return inside
 
 
+def _query_survey(surveyname:str, coord:SkyCoord, radius:u.Quantity, started:dict):
+    """
+    Run the catalog query of a single survey.
+    Used by the search_all_surveys thread pool.
+    Args:
+        surveyname (str): Name of the survey
+        coord (SkyCoord): Central coordinates of cone search.
+        radius (Quantity): Search radius in angular units.
+        started (dict): Start time of the query is recorded here
+    Returns:
+        catalog (Table or None): Catalog returned by the survey
+    """
+    started[surveyname] = time.time()
+    survey = load_survey_by_name(name=surveyname, coord=coord, radius=radius)
+    survey.get_catalog()
+    return survey.catalog
+
+
 def search_all_surveys(coord:SkyCoord, radius:u.Quantity, include_radio:bool=False,
-                       seed_cat:Table=None):
+                       seed_cat:Table=None, n_threads:int=None, timeout:float=None,
+                       budget:float=None, return_report:bool=False,
+                       nway_merge:bool=False):
     """
     A method to query all allowed surveys and combine
     the results into one table.
+
+    The queries are issued concurrently from a pool of threads.
+    A survey that has not answered `timeout` seconds after its
+    query started, or by the time the overall `budget` is spent,
+    is given up on and the search carries on with the surveys that
+    did answer. The results are merged once all queries are settled,
+    in the order of the survey list, so the output does not depend
+    on which survey answered first.
+
     Args:
         coord (SkyCoord): Central coordinates of cone search.
         radius (Quantity): Search radius in angular units.
@@ -166,9 +235,26 @@ def search_all_surveys(coord:SkyCoord, radius:u.Quantity, include_radio:bool=Fal
             Include at your own risk. Untested. Might break in unexpected ways.
         seed_cat (Table, optional): If you'd like to merge the survey results
             with another photometry table that you already have.
+        n_threads (int, optional): Number of concurrent queries.
+            Defaults to one per survey. 1 runs them one after the other.
+        timeout (float, optional): Seconds allowed to each survey query.
+            Defaults to no limit beyond that of the survey service itself.
+        budget (float, optional): Seconds allowed to the whole search.
+        return_report (bool, optional): Also return the per-survey report.
+        nway_merge (bool, optional): Merge all the catalogs at once with
+            xmatch_and_merge_many.  Columns found in several catalogs are
+            then suffixed with the survey name (e.g. z_spec_SDSS, and
+            z_spec_seed for the seed_cat) instead of _1, _2 for
+            each pairwise merge.  Off by default to keep those names.
 
     Returns:
         combined_cat (Table): Table of merged query results.
+        report (dict): Only if return_report. Keyed by survey name, with
+            the status ('ok', 'empty', 'error', 'timeout' or 'skipped'),
+            the number of objects found, the query time in seconds and
+            a message.
+            A query that timed out keeps running in the background (threads
+            cannot be interrupted) but its result is discarded.
     """
 
     # Start with the seed table
@@ -184,34 +270,97 @@ def search_all_surveys(coord:SkyCoord, radius:u.Quantity, include_radio:bool=Fal
         surveys = allowed_surveys 
     else:
         surveys = optical_surveys
-    # Loop over them
+    report = {}
     for surveyname in surveys:
+        report[surveyname] = dict(status='pending', nobj=0, time=None, message='')
         if surveyname=='Pan-STARRS':
             if radius>0.5*u.deg:
                 warnings.warn("Pan=STARRS doesn't allow cone searches wider than 0.5 deg. Skipping.", RuntimeWarning)
-                continue
-        survey = load_survey_by_name(name=surveyname, coord=coord, radius=radius)
-        try:
-            survey.get_catalog()
-        except (ConnectionError, HTTPError, QueryError):
-            warnings.warn("Couldn't connect to {:s}. Skipping this for now.".format(surveyname), RuntimeWarning)
-
-        # Did the survey return something?
-        if (survey.catalog is not None):
-            if len(survey.catalog)>0:
-                print("Found {:d} objects in {:s}".format(len(survey.catalog), surveyname))
-                if len(combined_cat)==0:
-                    # First time
-                    combined_cat = survey.catalog
+                report[surveyname].update(status='skipped', message='Cone wider than 0.5 deg')
+    queries = [surveyname for surveyname in surveys if report[surveyname]['status'] == 'pending']
+
+    # Query them all
+    t0 = time.time()
+    started = {}
+    catalogs = {}
+    pool = ThreadPoolExecutor(max_workers=max(len(queries), 1) if n_threads is None else n_threads)
+    futures = {pool.submit(_query_survey, surveyname, coord, radius, started): surveyname
+               for surveyname in queries}
+    pending = set(futures)
+    try:
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            now = time.time()
+            for future in done:
+                surveyname = futures[future]
+                report[surveyname]['time'] = now - started[surveyname]
+                # Other exceptions are bugs and propagate
+                try:
+                    catalogs[surveyname] = future.result()
+                except (ConnectionError, HTTPError, QueryError, DALServiceError) as err:
+                    warnings.warn("Couldn't connect to {:s}. Skipping this for now.".format(surveyname), RuntimeWarning)
+                    report[surveyname].update(status='error', message=repr(err))
+                except (ReadTimeout, TimeoutError) as err:
+                    warnings.warn("{:s} timed out. Skipping this for now.".format(surveyname), RuntimeWarning)
+                    report[surveyname].update(status='timeout', message=repr(err))
+            # Give up on the slow ones
+            for future in list(pending):
+                surveyname = futures[future]
+                if (budget is not None) and (now - t0 >= budget):
+                    message = 'Search budget of {:g} s spent'.format(budget)
+                elif (timeout is not None) and (surveyname in started) and (now - started[surveyname] >= timeout):
+                    message = 'No answer after {:g} s'.format(timeout)
                 else:
-                    # Combine otherwise
-                    # TODO: Need to deal with duplicate column names more elegantly.
-                    combined_cat = xmatch_and_merge_cats(combined_cat, survey.catalog,)
-            # No objects found?
-            elif len(survey.catalog)==0:
-                print("Empty table in "+surveyname)
-        
-    
-    return combined_cat
+                    continue
+                future.cancel()
+                pending.discard(future)
+                warnings.warn("{:s} timed out. Skipping this for now.".format(surveyname), RuntimeWarning)
+                report[surveyname].update(status='timeout', message=message,
+                                          time=now - started[surveyname] if surveyname in started else None)
+    finally:
+        # Do not wait for the queries given up on
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
 
-            
+    # Did the surveys return something?
+    for surveyname in queries:
+        # Failed or timed out
+        if surveyname not in catalogs:
+            continue
+        catalog = catalogs[surveyname]
+        if catalog is None:
+            print("No catalog from "+surveyname)
+            report[surveyname].update(status='empty', message='No catalog returned')
+        elif len(catalog)>0:
+            print("Found {:d} objects in {:s}".format(len(catalog), surveyname))
+            report[surveyname].update(status='ok', nobj=len(catalog))
+        # No objects found?
+        else:
+            print("Empty table in "+surveyname)
+            report[surveyname]['status'] = 'empty'
+    # Merge once at the end
+    found = [surveyname for surveyname in queries if report[surveyname]['status'] == 'ok']
+    if nway_merge:
+        tables = [catalogs[surveyname] for surveyname in found]
+        names = list(found)
+        if len(combined_cat) > 0:
+            tables.insert(0, combined_cat)
+            names.insert(0, 'seed')
+        if len(tables) == 1:
+            combined_cat = tables[0]
+        elif len(tables) > 1:
+            combined_cat = xmatch_and_merge_many(tables, table_names=names)
+    else:
+        for surveyname in found:
+            if len(combined_cat)==0:
+                # First time
+                combined_cat = catalogs[surveyname]
+            else:
+                # Combine otherwise
+                # TODO: Need to deal with duplicate column names more elegantly.
+                combined_cat = xmatch_and_merge_cats(combined_cat, catalogs[surveyname],)
+
+    if return_report:
+        return combined_cat, report
+    return combined_cat
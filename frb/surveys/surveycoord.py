@@ -5,6 +5,7 @@ import os
 
 from frb.surveys import images
 from frb.surveys import survey_io
+from frb.surveys import query_cache
 
 
 class SurveyCoord(object):
@@ -17,6 +18,11 @@ class SurveyCoord(object):
         coord (SkyCoord): Coordiante for surveying around
         radius (Angle): Search radius around the coordinate
 
+    Attributes:
+        cache (QueryCache): Local cache of the catalogs and cutouts
+            (see frb.surveys.query_cache).  None, the default unless
+            caching was enabled, always queries the archive.
+
     """
 
     __metaclass__ = ABCMeta
@@ -26,6 +32,7 @@ class SurveyCoord(object):
         self.coord = coord
         self.radius = radius
         self.verbose = verbose
+        self.cache = query_cache.default_cache()
 
         # Typically set items
         self.survey = None
@@ -5,6 +5,7 @@ from astropy import units, io, utils
 
 from frb.surveys import dlsurvey
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 from frb.galaxies.defs import VISTA_bands
 
 # Dependencies
@@ -96,6 +97,7 @@ class VISTA_Survey(dlsurvey.DL_Survey):
         # Return
         return self.query
 
+    @query_cache.cached_catalog
     def get_catalog(self, query=None, query_fields=None, print_query=False, system='AB', **kwargs):
         """
         Grab a catalog of sources around the input coordinate to the search radius
@@ -7,6 +7,7 @@ from astropy.table import Table
 
 from frb.surveys import surveycoord
 from frb.surveys import catalog_utils
+from frb.surveys import query_cache
 from frb.surveys import defs
 
 
@@ -60,6 +61,7 @@ class WISE_Survey(surveycoord.SurveyCoord):
         self.query = None
         self.database = "allwise_p3as_psd"
 
+    @query_cache.cached_catalog
     def get_catalog(self, query=None, query_fields=_DEFAULT_query_fields, 
                     print_query=False, system='AB'):
         """
@@ -108,6 +110,7 @@ class WISE_Survey(surveycoord.SurveyCoord):
         self.validate_catalog()
         return self.catalog.copy()
     
+    @query_cache.cached_cutout
     def get_cutout(self, imsize, band, timeout=120):
         """
         Download an image from IRSA
@@ -0,0 +1,70 @@
+# Module to run tests on the CIGALE batch runner
+#  pcigale itself is replaced by a stand-in here
+
+import os
+
+import numpy as np
+import pytest
+
+from astropy.table import Table
+
+from frb.galaxies import cigale
+
+
+def _photom(ngal=7, nz=3):
+    tbl = Table()
+    tbl['ID'] = ['{:05d}_{:d}'.format(ii, jj) for ii in range(ngal) for jj in range(nz)]
+    tbl['gal'] = np.repeat(np.arange(ngal), nz)
+    tbl['redshift'] = np.tile(np.linspace(0.1, 0.3, nz), ngal)
+    tbl['DES_r'] = 20. + 0.1*np.arange(len(tbl))
+    return tbl.group_by('gal')
+
+
+def test_shard_table():
+    tbl = _photom()
+    shards = cigale.shard_table(tbl, shard_size=3)
+    assert len(shards) == 3
+    assert shards[0][0] == 0 and shards[-1][1] == len(tbl)
+    # Galaxies are not split
+    for start, stop in shards:
+        assert start % 3 == 0 and stop % 3 == 0
+    assert len(cigale.shard_table(tbl[:], n_shards=50)) == len(tbl)
+
+
+def test_run_batch(tmp_path, monkeypatch):
+    tbl = _photom()
+    failing = ['00003_0']
+
+    def fake_run(photometry_table, zcol, outdir='out', **kwargs):
+        if failing[0] in photometry_table['ID']:
+            raise RuntimeError('bad photometry')
+        os.makedirs(outdir)
+        results = Table()
+        results['id'] = photometry_table['ID']
+        results['bayes.stellar.m_star'] = 10**photometry_table['DES_r']
+        results.write(os.path.join(outdir, 'results.fits'))
+
+    monkeypatch.setattr(cigale, 'run', fake_run)
+    outdir = str(tmp_path / 'batch')
+    assert cigale.run_batch(tbl, 'redshift', outdir=outdir, shard_size=2, merge=False) is None
+    manifest = cigale.loadjson(os.path.join(outdir, 'manifest.json'))
+    assert not manifest['status']['shard_0001']['done']
+    assert 'bad photometry' in manifest['status']['shard_0001']['error']
+    with pytest.raises(IOError):
+        cigale.merge_batch(outdir)
+
+    # Only the failed shard is redone
+    ran = []
+    def fix_run(photometry_table, zcol, outdir='out', **kwargs):
+        ran.append(photometry_table['ID'][0])
+        failing[0] = 'none'
+        fake_run(photometry_table, zcol, outdir=outdir, **kwargs)
+    monkeypatch.setattr(cigale, 'run', fix_run)
+    merged = cigale.run_batch(tbl, 'redshift', outdir=outdir, shard_size=2)
+    assert ran == ['00002_0']
+    assert list(merged['id'].astype(str)) == list(tbl['ID'])
+    assert os.path.isfile(os.path.join(outdir, 'results.fits'))
+
+    # A different table is refused
+    with pytest.raises(IOError):
+        cigale.run_batch(tbl[:6], 'redshift', outdir=outdir, shard_size=2)
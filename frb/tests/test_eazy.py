@@ -79,3 +79,58 @@ def test_eazy(host_obj):
 
     # Remove
     shutil.rmtree(data_path('eazy'))
+
+
+def _write_eazy_binaries(out_dir, nobj=50, nz=40, nfilt=3, ntemp=4, ntempl=20, nk=5):
+    """ Fake EAZY BINARY_OUTPUTS files with the layout EAZY writes """
+    rstate = np.random.RandomState(7)
+    root = os.path.join(out_dir, 'photz')
+    with open(root+'.tempfilt', 'wb') as f:
+        np.array([nfilt, ntemp, nz, nobj], dtype=np.int32).tofile(f)
+        rstate.rand(nz*ntemp*nfilt + nfilt).tofile(f)
+        np.linspace(0.01, 2., nz).tofile(f)
+        rstate.rand(2*nobj*nfilt).tofile(f)
+    with open(root+'.coeff', 'wb') as f:
+        np.array([nfilt, ntemp, nz, nobj], dtype=np.int32).tofile(f)
+        rstate.rand(nobj*ntemp).tofile(f)
+        rstate.randint(0, nz, nobj).astype(np.int32).tofile(f)
+        rstate.rand(ntemp).tofile(f)
+    with open(root+'.temp_sed', 'wb') as f:
+        np.array([ntemp, ntempl, nz], dtype=np.int32).tofile(f)
+        rstate.rand(ntempl + ntempl*ntemp + 2*nz).tofile(f)
+    with open(root+'.pz', 'wb') as f:
+        np.array([nz, nobj], dtype=np.int32).tofile(f)
+        zcen = rstate.uniform(0.2, 1.5, nobj)
+        (((np.linspace(0.01, 2., nz)[None, :] - zcen[:, None])/0.1)**2).tofile(f)
+        np.array([nk], dtype=np.int32).tofile(f)
+        np.arange(nk, dtype=np.double).tofile(f)
+        rstate.rand(nk*nz).tofile(f)
+        rstate.randint(0, nk+2, nobj).astype(np.int32).tofile(f)
+    return zcen
+
+
+def test_eazy_output(tmp_path):
+    zcen = _write_eazy_binaries(str(tmp_path))
+    out = frbeazy.EazyOutput.open(OUTPUT_DIRECTORY=str(tmp_path))
+    assert out is frbeazy.EazyOutput.open(OUTPUT_DIRECTORY=str(tmp_path))
+    # Matches the in-memory reader
+    tempfilt, coeffs, temp_sed, pz = frbeazy.readEazyBinary(OUTPUT_DIRECTORY=str(tmp_path))
+    assert np.array_equal(out.tempfilt['tempfilt'], tempfilt['tempfilt'])
+    assert np.array_equal(out.coeffs['izbest'], coeffs['izbest'])
+    assert np.array_equal(out.temp_sed['temp_seds'], temp_sed['temp_seds'])
+    idx = np.arange(out.NOBJ)
+    pzi = out.pz(idx, chunk_size=100)
+    for ii in [0, 17, 49]:
+        zgrid, pz1 = frbeazy.getEazyPz(ii, binaries=(tempfilt, pz))
+        assert np.allclose(pzi[ii], pz1)
+    # Draws
+    sample = out.sample_z(idx, ndraws=2000, rng=1)
+    assert sample.shape == (out.NOBJ, 2000)
+    assert np.allclose(np.median(sample, axis=1), zcen, atol=0.1)
+    # Same inverse CDF as drawing one object at a time
+    sample_u = np.random.default_rng(1).random((out.NOBJ, 2000))
+    for ii in [0, 17, 49]:
+        zgrid = np.hstack([[0], out.zgrid])
+        cdf_z = np.cumsum(np.hstack([[0], pzi[ii]]))
+        assert np.allclose(sample[ii], np.interp(sample_u[ii], cdf_z/cdf_z[-1], zgrid))
+    assert np.array_equal(sample, out.sample_z(idx, ndraws=2000, rng=1))
@@ -43,3 +43,14 @@ def test_monte_tau():
     zeval = np.array([0.5,1.,2.])
     taus = monte_tau(np.array(zeval))
     assert taus.shape[1] == len(zeval)
+
+
+def test_monte_seed():
+    zeval = np.array([0.5, 1., 2.])
+    DMs = monte_DM(zeval, nrand=200000, seed=1)
+    assert np.array_equal(DMs, monte_DM(zeval, nrand=200000, seed=1))
+    assert np.all(DMs >= 0.)
+    # Matches the average
+    assert np.isclose(np.mean(DMs[:,1]), approx_avgDM(1.).value, rtol=0.1)
+    taus = monte_tau(zeval, nrand=1000, seed=2)
+    assert np.array_equal(taus, monte_tau(zeval, nrand=1000, seed=2))
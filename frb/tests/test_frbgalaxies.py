@@ -153,6 +153,22 @@ def test_mag_dm_figure():
     os.system('rm ./temp_fig.png')
 
 
+def test_zrange_for_frbs(tmp_path, monkeypatch):
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    coords = SkyCoord(ra=[229.7063, 122.223, 122.223], dec=[12.3766, -23.2322, -23.2322], unit='deg')
+    tbl = mag_dm.zrange_for_frbs(np.array([200., 500., 800.]), coords, 23.,
+                                 EBV=np.array([0.05, 0.1, 0.1]),
+                                 DM_ISM=np.array([30., 100., 100.]))
+    assert len(tbl) == 3
+    assert np.all(tbl['z_min'] <= tbl['z_50'])
+    assert np.all(tbl['z_50'] <= tbl['z_max'])
+    assert np.all(np.diff(tbl['z_50']) > 0.)
+    assert np.all(tbl['frac_Lstar_min'] < tbl['frac_Lstar_max'])
+    # Single FRB
+    z_stats = prob_dmz.PzDMGrid('perfect').z_stats(tbl['DM_cosmic'][1])
+    assert np.isclose(z_stats['z_50'], tbl['z_50'][1])
+
+
 def test_pzdm_telescopes():
     
     telescope_dict = prob_dmz.telescope_dict
@@ -50,6 +50,86 @@ def test_halo_incidence():
     assert zeval.size == 20
     assert np.isclose(Ncumul[-1], 0.5612214870531754, rtol=1e-4)
 
+def test_halo_incidence_Mlow():
+    # Below the limit, the models wrapper warns and returns None as it always has
+    with pytest.warns(UserWarning):
+        assert halos.halo_incidence(1e10, 1.) is None
+    with pytest.raises(IOError):
+        hmf.halo_incidence(1e10, 1.)
+
+def test_hmf_table():
+    # Imported (unlikely)?
+    if not flg_aemHMF:
+        assert True
+        return
+    hmfe = hmf.init_hmf()
+    zvals = np.array([0., 0.33, 1.])
+    ns = hmf.n_in_bins(1e12, 3e12, zvals)
+    for kk, z in enumerate(zvals):
+        assert np.isclose(ns[kk], np.squeeze(hmfe.n_in_bins((1e12, 3e12), z)), rtol=1e-4)
+    # Same answer as the emulator
+    Navg = hmf.halo_incidence(1e12, 1., Mhigh=3e12, hmfe=hmfe)
+    assert np.isclose(Navg, hmf.halo_incidence(1e12, 1., Mhigh=3e12), rtol=1e-4)
+
+class _StubHMF(object):
+    """ Stand-in for the Aemulus emulator:  a Schechter-like dn/dM (h units) """
+    def dndM(self, M, z):
+        return 1e-3 * (M/1e12)**-1.9 / 1e12 * np.exp(-M/(1e14/(1+z)))
+
+
+def test_build_grid(tmp_path):
+    hmfe = _StubHMF() if not flg_aemHMF else hmf.get_hmfe()
+    kwargs = dict(z_FRB=0.2, ntrial=100, Mlow=1e11, r_max=1., verbose=False, hmfe=hmfe)
+    DM_grid, halo_tbl = hmf.build_grid(**kwargs)
+    assert DM_grid.shape == (100, 20)
+    assert np.isclose(np.sum(halo_tbl['DM']), np.sum(DM_grid))
+    # Stream to disk and resume
+    outfile = str(tmp_path / 'grid')
+    DM_grid2, _ = hmf.build_grid(outfile=outfile, **kwargs)
+    (tmp_path / 'grid_slabs' / 'slab_001.npz').unlink()
+    DM_grid3, _ = hmf.build_grid(outfile=outfile, **kwargs)
+    assert np.array_equal(DM_grid, DM_grid2)
+    assert np.array_equal(DM_grid, DM_grid3)
+    assert len(hmf.load_grid_halos(outfile)) == len(halo_tbl)
+    # Resume after a parameter change;  the old slabs are not reused
+    for change in [dict(ntrial=10), dict(seed=7), dict(Mlow=3e11)]:
+        new_kwargs = dict(kwargs, **change)
+        DM_new, tbl_new = hmf.build_grid(**new_kwargs)
+        DM_disk, _ = hmf.build_grid(outfile=outfile, **new_kwargs)
+        assert np.array_equal(DM_new, DM_disk)
+        assert len(hmf.load_grid_halos(outfile)) == len(tbl_new)
+
+def test_build_grid_slabs(tmp_path, monkeypatch):
+    """ Runs streamed to neighbouring outfiles keep their own slabs """
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(hmf, '_hmf_splines', {})
+    if not flg_aemHMF:
+        monkeypatch.setattr(hmf, '_hmfe', _StubHMF())
+    kwargs = dict(z_FRB=0.3, ntrial=10, Mlow=1e11, r_max=1., verbose=False, hmfe=None)
+    run1, run1000 = str(tmp_path / 'run1'), str(tmp_path / 'run1000')
+    _, tbl1 = hmf.build_grid(**kwargs)
+    _, tbl1000 = hmf.build_grid(**dict(kwargs, seed=7))
+    hmf.build_grid(outfile=run1, **kwargs)
+    hmf.build_grid(outfile=run1000, **dict(kwargs, seed=7))
+    assert len(hmf.load_grid_halos(run1)) == len(tbl1)
+    assert len(hmf.load_grid_halos(run1000)) == len(tbl1000)
+    # A parameter change only discards the slabs of its own run
+    slabs1 = sorted((tmp_path / 'run1_slabs').glob('slab_*.npz'))
+    hmf.build_grid(outfile=run1000, **dict(kwargs, seed=8))
+    assert sorted((tmp_path / 'run1_slabs').glob('slab_*.npz')) == slabs1
+    assert len(hmf.load_grid_halos(run1)) == len(tbl1)
+
+def test_hmf_table_low_mass(tmp_path, monkeypatch):
+    """ The default Mlow = 1e10 Msun lies within the tabulated mass function """
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(hmf, '_hmf_splines', {})
+    if not flg_aemHMF:
+        monkeypatch.setattr(hmf, '_hmfe', _StubHMF())
+    fracs = hmf.frac_in_halos(np.array([0., 0.5, 1.]), 1e10, 1e16)
+    assert np.all((fracs > 0.) & (fracs < 1.))
+    DM_grid, _ = hmf.build_grid(z_FRB=0.1, ntrial=4, Mlow=1e10, r_max=1., verbose=False)
+    assert DM_grid.shape == (4, 10)
+
 def test_YF17():
     yf17 = halos.YF17()
     ne = yf17.ne((0.,0.,20.))
@@ -87,6 +167,91 @@ def test_modified_NFW():
     ne = mNFW.ne(xyz)
     assert np.all(ne > nH)
 
+def test_Ne_Rperp_many():
+    mNFW = halos.ModifiedNFW(alpha=2, y0=2)
+    Rperp = np.array([1., 50., 150., 400.])
+    log_Mhalo = np.array([11., 12.5, 12., 12.])
+    z = np.array([0.1, 0.5, 0.2, 0.3])
+    Ne = mNFW.Ne_Rperp_many(Rperp*u.kpc, log_Mhalo, z)
+    assert Ne.unit == u.pc/u.cm**3
+    # One at a time
+    for kk in range(Rperp.size):
+        halo = halos.ModifiedNFW(log_Mhalo=log_Mhalo[kk], alpha=2, y0=2, z=z[kk])
+        Ne1 = halo.Ne_Rperp(Rperp[kk]*u.kpc, step_size=0.01*u.kpc)
+        assert np.isclose(Ne[kk].value, Ne1.value, rtol=1e-4)
+    # Beyond r200
+    assert Ne[-1].value == 0.
+    # Broadcasting
+    Ne_grid = mNFW.Ne_Rperp_many(Rperp[:,None], 12., np.array([0., 0.5]), add_units=False)
+    assert Ne_grid.shape == (4, 2)
+
+
+def test_mnfw_table(tmp_path, monkeypatch):
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(halos, '_mnfw_splines', {})
+    mNFW = halos.ModifiedNFW(alpha=2, y0=2)
+    # Matches the sum
+    for Rperp in [10., 100., 250.]*u.kpc:
+        Ne = mNFW.Ne_Rperp(Rperp, step_size=0.01*u.kpc)
+        Ne_tbl = mNFW.Ne_Rperp(Rperp, method='table')
+        assert np.isclose(Ne.value, Ne_tbl.value, rtol=1e-4)
+    RM = mNFW.RM_Rperp(100*u.kpc, 1*u.microGauss, step_size=0.01*u.kpc)
+    RM_tbl = mNFW.RM_Rperp(100*u.kpc, 1*u.microGauss, method='table')
+    assert np.isclose(RM.value, RM_tbl.value, rtol=1e-4)
+    Mr = mNFW.mass_r(100*u.kpc, step_size=0.01*u.kpc)
+    assert np.isclose(Mr.value, mNFW.mass_r(100*u.kpc, method='table').value, rtol=1e-3)
+    # Arrays and the quadrature engine
+    Rperp = np.linspace(1., 400., 50)
+    Ne_tbl = mNFW.Ne_Rperp(Rperp*u.kpc, method='table', add_units=False)
+    Ne_many = mNFW.Ne_Rperp_many(Rperp, mNFW.log_Mhalo, 0., add_units=False)
+    assert np.allclose(Ne_tbl, Ne_many, rtol=1e-5)
+    assert Ne_tbl[-1] == 0.
+    # Cached on disk
+    assert len(list(tmp_path.glob('mNFW/projected_*'))) == 1
+
+
+def test_dm_grid(tmp_path, monkeypatch):
+    from frb.halos import photoz
+    outfile = str(tmp_path / 'halo_dm.npz')
+    photoz.dm_grid(0.3, n_z=5, n_o=20, n_m=30, outfile=outfile)
+    dm = np.load(outfile)['dm']
+    assert dm.shape == (5, 20, 30)
+    assert dm.dtype == np.float32
+    # Interrupt after two redshift slices
+    orig = halos.ModifiedNFW.Ne_Rperp_many
+    ncall = []
+    def flaky(self, *args, **kwargs):
+        ncall.append(1)
+        if len(ncall) > 2:
+            raise RuntimeError('interrupted')
+        return orig(self, *args, **kwargs)
+    monkeypatch.setattr(halos.ModifiedNFW, 'Ne_Rperp_many', flaky)
+    outfile2 = str(tmp_path / 'halo_dm2.npz')
+    with pytest.raises(RuntimeError):
+        photoz.dm_grid(0.3, n_z=5, n_o=20, n_m=30, outfile=outfile2)
+    assert np.sum(np.load(str(tmp_path / 'halo_dm2_partial_done.npy'))) == 2
+    # Resume
+    monkeypatch.setattr(halos.ModifiedNFW, 'Ne_Rperp_many', orig)
+    photoz.dm_grid(0.3, n_z=5, n_o=20, n_m=30, outfile=outfile2)
+    assert np.array_equal(np.load(outfile2)['dm'], dm)
+    assert not (tmp_path / 'halo_dm2_partial.npy').exists()
+
+
+def test_halomass_realizations():
+    # Inverts the SHMR
+    log_mstar = np.array([7., 9., 10.5])
+    log_Mhalo = halos.halomass_from_stellarmass(log_mstar, z=0.3)
+    assert np.allclose(halos.stellarmass_from_halomass(log_Mhalo, z=0.3), log_mstar, atol=1e-8)
+    assert isinstance(halos.halomass_from_stellarmass(10., z=0.3), float)
+    # Realizations
+    reals = halos.halomass_realizations(log_mstar, z=0.3, n_halo=2000, seed=1)
+    assert reals.shape == (3, 2000)
+    assert np.array_equal(reals, halos.halomass_realizations(log_mstar, z=0.3, n_halo=2000, seed=1))
+    assert np.allclose(np.median(reals, axis=1), log_Mhalo, atol=0.05)
+    # Each column is one set of SHMR parameters, so masses stay ordered
+    assert np.all(np.diff(reals, axis=0) > 0)
+
+
 def test_milky_way():
     Galaxy = halos.MilkyWay()
     assert np.isclose(Galaxy.M_halo.to('M_sun').value, 1.51356125e+12)
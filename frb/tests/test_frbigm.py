@@ -10,6 +10,8 @@ from astropy import units as u
 from astropy.cosmology import Planck15, FlatLambdaCDM
 
 from frb.dm import igm
+from frb.dm import prob_dmz
+from frb import defs
 
 def test_rhoMstar():
     rho_Mstar_full = igm.avg_rhoMstar(1., remnants=True)
@@ -23,6 +25,18 @@ def test_rhoISM():
     assert rhoISM.unit == u.Msun/u.Mpc**3
     assert np.isclose(rhoISM.value, 2.19389268e+08)
 
+def test_age_splines(monkeypatch):
+    monkeypatch.setattr(igm, '_age_splines', type(igm._age_splines)())
+    z = np.linspace(0., 5., 2001)
+    np.testing.assert_allclose(igm._age_Gyr(z), defs.frb_cosmo.age(z).to('Gyr').value, rtol=1e-9)
+    # Nearby redshifts share a spline and the cache is bounded
+    for zmax in np.linspace(0.5, 19.9, 50):
+        igm._age_Gyr(np.array([zmax]))
+    assert len(igm._age_splines) == 1
+    for zmax in np.linspace(21., 500., 50):
+        igm._age_Gyr(np.array([zmax]))
+    assert len(igm._age_splines) == igm.AGE_SPLINE_CACHE_SIZE
+
 def test_igmDM():
     DM = igm.average_DM(1.)
     # Value and unit
@@ -55,3 +69,78 @@ def test_igmDM_varyH0():
 
     # Test
     assert DM2 > DM*2   # Not sure why it is so much higher
+
+
+def test_macquart_relation():
+    mrel = igm.MacquartRelation()
+    # Scalar matches the direct integration
+    DM = mrel(1.)
+    assert DM.unit == u.pc/u.cm**3
+    assert np.isclose(DM.value, igm.average_DM(1.).value, rtol=1e-3)
+    # Vectorized
+    DMs = mrel(np.array([0., 1., 4.]))
+    assert DMs.size == 3
+    assert np.isclose(DMs[0].value, 0.)
+    assert np.isclose(DMs[2].value, 3542.598, rtol=0.001)
+    # Inverse
+    assert np.isclose(mrel.z(DM), 1., rtol=1e-4)
+    # Cached table is shared
+    mrel2 = igm.MacquartRelation()
+    assert mrel2.DM_cum is mrel.DM_cum
+    # Out of range
+    with pytest.raises(ValueError):
+        mrel(6.)
+
+
+def test_grid_P_DMcosmic_z():
+    zvals = np.linspace(0., 1., 20)
+    z, DM, PDM_z = prob_dmz.grid_P_DMcosmic_z(zvals=zvals)
+    assert PDM_z.shape == (DM.size, zvals.size)
+    assert np.allclose(np.sum(PDM_z, axis=0), 1.)
+    assert PDM_z[0,0] == 1.
+    # Chunked and parallel evaluation give the same grid
+    _, _, PDM_z2 = prob_dmz.grid_P_DMcosmic_z(zvals=zvals, chunk_size=3, n_cores=2)
+    assert np.array_equal(PDM_z, PDM_z2)
+
+
+def test_cached_grid(tmp_path, monkeypatch):
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    zvals = np.linspace(0., 1., 10)
+    sdict = prob_dmz.cached_grid_P_DMcosmic_z(zvals=zvals)
+    assert isinstance(sdict['PDM_z'], np.memmap)
+    grid_path = prob_dmz.grid_cache_path(zvals=zvals)
+    assert grid_path.startswith(str(tmp_path))
+    # Re-use
+    sdict2 = prob_dmz.cached_grid_P_DMcosmic_z(zvals=zvals)
+    assert np.array_equal(sdict['PDM_z'], sdict2['PDM_z'])
+    assert len(list((tmp_path / 'PDM_z').iterdir())) == 1
+    # New parameters give a new entry
+    assert prob_dmz.grid_cache_path(zvals=zvals, F=0.2) != grid_path
+
+
+def test_pzdm_grid(tmp_path, monkeypatch):
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    pzdm_grid = prob_dmz.PzDMGrid('perfect')
+    # Compare to the full grid
+    sdict = prob_dmz.grab_repo_grid(prob_dmz.telescope_dict['perfect'])
+    PDM_z = sdict['PDM_z'].T
+    iDM = np.argmin(np.abs(sdict['DM'] - 500.))
+    PzDM = PDM_z[:,iDM] / np.sum(PDM_z[:,iDM])
+    assert np.allclose(pzdm_grid.pz_given_dm(500.), PzDM)
+    # Vectorized
+    PzDMs = pzdm_grid.pz_given_dm(np.array([100., 500.]))
+    assert PzDMs.shape == (2, sdict['z'].size)
+    # Interval
+    z_min, z_max = pzdm_grid.credible_interval(500.)
+    cum_sum = np.cumsum(PzDM)
+    assert z_min == sdict['z'][np.argmin(np.abs(cum_sum-0.025))]
+    assert z_max == sdict['z'][np.argmin(np.abs(cum_sum-0.975))]
+    assert z_min < z_max
+
+
+def test_grid_P_DMcosmic_z_beta():
+    zvals = np.linspace(0.1, 1., 5)
+    _, DM, PDM_z3 = prob_dmz.grid_P_DMcosmic_z(zvals=zvals)
+    _, _, PDM_z4 = prob_dmz.grid_P_DMcosmic_z(zvals=zvals, beta=4.)
+    assert np.allclose(np.sum(PDM_z4, axis=0), 1.)
+    assert not np.allclose(PDM_z3, PDM_z4)
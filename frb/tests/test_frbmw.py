@@ -0,0 +1,29 @@
+# Module to run tests on Galactic DM calculations
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from frb import mw
+
+
+def test_ism_map(tmp_path, monkeypatch):
+    monkeypatch.setattr(mw, '_ism_maps', {})
+    # A coarse map is quick to build
+    ism_map = mw.ism_map(nside=1, npts=100, cache_dir=str(tmp_path))
+    assert ism_map.size == 12
+    assert np.all(ism_map > 0.)
+    assert len(list(tmp_path.glob('ism_*'))) == 1
+    # Pixel centers
+    coords = SkyCoord(l=[45., 135.], b=[41.8103149, -41.8103149], unit='deg', frame='galactic')
+    DM = mw.ismDM(coords, use_map=True, nside=1, npts=100, cache_dir=str(tmp_path))
+    assert DM.unit == u.pc/u.cm**3
+    assert np.allclose(DM.value, ism_map[[0, 9]])
+    DM0 = mw.ismDM(coords[0], use_map=True, nside=1, npts=100, cache_dir=str(tmp_path))
+    assert np.isclose(DM0.value, DM[0].value)
+    # Close to the exact integral
+    assert np.isclose(DM0.value, mw.ismDM(coords[0]).value, rtol=0.02)
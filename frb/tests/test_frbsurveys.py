@@ -6,7 +6,7 @@ import astropy
 import pytest
 import os, warnings
 
-from astropy.table import Table
+from astropy.table import Table, MaskedColumn
 from astropy.coordinates import SkyCoord
 from astropy import units
 from astropy.io.fits.hdu.image import PrimaryHDU
@@ -238,4 +238,309 @@ def test_search_all():
                 'DECaL_ID', 'DECaL_brick', 'DECaL_type', 'DECaL_g', 'DECaL_r', 'DECaL_z', 'DECaL_g_err', 'DECaL_r_err', 'DECaL_z_err', 'survey', 'z_phot_l68', 'z_phot_median', 'z_phot_u68', 'z_phot_l95', 'z_phot_u95', 'z_spec_1','z_spec_2',
                 'NSC_ID', 'class_star', 'NSC_u', 'NSC_u_err', 'NSC_g', 'NSC_g_err', 'NSC_r', 'NSC_r_err', 'NSC_i', 'NSC_i_err', 'NSC_z', 'NSC_z_err', 'NSC_Y', 'NSC_Y_err', 'NSC_VR', 'NSC_VR_err']
     assert len(setdiff1d(combined_cat.colnames, colnames))==0
-    assert combined_cat['Pan-STARRS_ID'][1] == -999.
\ No newline at end of file
+    assert combined_cat['Pan-STARRS_ID'][1] == -999.
+
+def test_search_all_concurrent(monkeypatch):
+    """
+    search_all_surveys with stand-in surveys: one slow, one failing
+    """
+    import time
+    from frb.surveys.hsc import QueryError
+    coord = SkyCoord(ra=123.5, dec=32.1, unit='deg')
+
+    class FakeSurvey(object):
+        def __init__(self, name, coord, radius):
+            self.name = name
+            self.catalog = None
+        def get_catalog(self):
+            if self.name == 'HSC':
+                raise QueryError('No credentials')
+            if self.name == 'DES':
+                time.sleep(3.)
+            if self.name == 'NSC':
+                return None
+            self.catalog = Table()
+            if self.name not in ['WISE', 'VISTA']:
+                self.catalog['ra'] = [123.5, 123.51]
+                self.catalog['dec'] = [32.1, 32.1]
+                self.catalog[self.name+'_r'] = [20., 21.]
+            return self.catalog
+
+    monkeypatch.setattr(survey_utils, 'load_survey_by_name',
+                        lambda name, coord, radius, **kwargs: FakeSurvey(name, coord, radius))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        t0 = time.time()
+        combined_cat, report = survey_utils.search_all_surveys(coord, 5*units.arcsec,
+                                                               timeout=0.5, return_report=True)
+    assert time.time() - t0 < 2.
+    assert report['DES']['status'] == 'timeout'
+    assert report['HSC']['status'] == 'error'
+    assert report['WISE']['status'] == 'empty'
+    assert report['NSC']['status'] == 'empty'
+    assert all(entry['status'] in ['ok', 'empty', 'error', 'timeout', 'skipped']
+               for entry in report.values())
+    assert report['SDSS']['nobj'] == 2
+    assert len(combined_cat) == 2
+    assert 'DES_r' not in combined_cat.colnames
+    assert 'DELVE_r' in combined_cat.colnames
+    # Same merge one survey at a time
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        serial_cat = survey_utils.search_all_surveys(coord, 5*units.arcsec, n_threads=1,
+                                                     budget=60.)
+    assert 'DES_r' in serial_cat.colnames
+    assert [col for col in serial_cat.colnames if col != 'DES_r'] == combined_cat.colnames
+    # All at once, with the survey names as suffixes
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        seed_cat = Table(dict(ra=[123.5], dec=[32.1], SDSS_r=[19.]))
+        nway_cat = survey_utils.search_all_surveys(coord, 5*units.arcsec, n_threads=1, budget=60.,
+                                                   seed_cat=seed_cat, nway_merge=True)
+    assert len(nway_cat) == 2
+    assert 'SDSS_r_seed' in nway_cat.colnames
+    assert 'SDSS_r_SDSS' in nway_cat.colnames
+    assert 'DES_r' in nway_cat.colnames
+    assert nway_cat['SDSS_r_seed'][1] == -999.
+    # Bugs are not mistaken for a failed connection
+    class BrokenSurvey(FakeSurvey):
+        def get_catalog(self):
+            raise KeyError('ra')
+    monkeypatch.setattr(survey_utils, 'load_survey_by_name',
+                        lambda name, coord, radius, **kwargs: BrokenSurvey(name, coord, radius))
+    with pytest.raises(KeyError):
+        survey_utils.search_all_surveys(coord, 5*units.arcsec)
+
+
+def test_query_cache(tmp_path):
+    """
+    Survey catalogs and cutouts are served from the local cache
+    """
+    import numpy as np
+    from astropy.io import fits
+    from frb.surveys import query_cache, surveycoord
+
+    calls = []
+    class FakeSurvey(surveycoord.SurveyCoord):
+        def __init__(self, coord, radius, **kwargs):
+            surveycoord.SurveyCoord.__init__(self, coord, radius, **kwargs)
+            self.survey = 'Fake'
+        @query_cache.cached_catalog
+        def get_catalog(self, query_fields=None, print_query=False):
+            calls.append('catalog')
+            rng = np.random.default_rng(1)
+            self.catalog = Table()
+            self.catalog['ra'] = self.coord.ra.deg + rng.uniform(-0.01, 0.01, 100)
+            self.catalog['dec'] = self.coord.dec.deg + rng.uniform(-0.01, 0.01, 100)
+            self.catalog['name'] = ['obj{:d}'.format(ii) for ii in range(100)]
+            self.catalog['mag'] = np.where(np.arange(100) % 3 == 0, np.nan, 20.)
+            self.catalog['flag'] = ['' if ii % 4 == 0 else 'ok' for ii in range(100)]
+            self.catalog.meta['radius'] = self.radius
+            self.catalog.meta['survey'] = self.survey
+            return self.catalog.copy()
+        @query_cache.cached_cutout
+        def get_cutout(self, imsize, color=False):
+            calls.append('cutout')
+            self.cutout_size = imsize
+            if color:
+                self.cutout = Image.new('RGB', (8, 6), (10, 20, 30))
+                return self.cutout, None
+            self.cutout = np.arange(12.).reshape(3, 4)
+            self.cutout_hdr = fits.Header({'BAND': 'r'})
+            return self.cutout, self.cutout_hdr
+
+    cache = query_cache.QueryCache(str(tmp_path))
+    coord = SkyCoord(ra=150., dec=2., unit='deg')
+    survey = FakeSurvey(coord, 30*units.arcsec)
+    survey.cache = cache
+    cat = survey.get_catalog()
+    assert survey.get_catalog(print_query=True)['name'].tolist() == cat['name'].tolist()
+    assert calls == ['catalog']
+    # NaN and '' come back as they went in
+    hit = survey.get_catalog()
+    for key in ['mag', 'flag']:
+        assert not isinstance(hit[key], MaskedColumn)
+    assert np.array_equal(np.isnan(hit['mag']), np.isnan(cat['mag']))
+    assert hit['flag'].tolist() == cat['flag'].tolist()
+    # A smaller cone inside is cut from the cached one
+    coord2 = coord.directional_offset_by(0.*units.deg, 5*units.arcsec)
+    survey2 = FakeSurvey(coord2, 10*units.arcsec)
+    survey2.cache = cache
+    sub = survey2.get_catalog()
+    assert calls == ['catalog']
+    seps = coord2.separation(SkyCoord(ra=cat['ra'], dec=cat['dec'], unit='deg'))
+    assert sorted(sub['name']) == sorted(cat['name'][seps <= 10*units.arcsec])
+    assert sub.meta['radius'] == 10*units.arcsec
+    # Different query fields or a larger cone go to the archive
+    survey2.get_catalog(query_fields=['ra', 'dec'])
+    survey3 = FakeSurvey(coord, 1*units.arcmin)
+    survey3.cache = cache
+    survey3.get_catalog()
+    assert calls == ['catalog']*3
+
+    # Cutouts
+    img, hdr = survey.get_cutout(10*units.arcsec)
+    survey.cutout = None
+    img2, hdr2 = survey.get_cutout(10*units.arcsec)
+    assert calls.count('cutout') == 1
+    assert np.array_equal(img, img2) and hdr2['BAND'] == 'r'
+    assert survey.cutout_size == 10*units.arcsec
+    png, _ = survey.get_cutout(10*units.arcsec, color=True)
+    png2, none = survey.get_cutout(10*units.arcsec, color=True)
+    assert calls.count('cutout') == 2
+    assert none is None and png2.mode == 'RGB'
+    assert np.array_equal(np.asarray(png), np.asarray(png2))
+
+    # Expiry and size limit
+    cache.ttl = 0.
+    cache.evict()
+    survey.get_catalog()
+    assert calls.count('catalog') == 4
+    cache.ttl = query_cache.DEFAULT_TTL
+    cache.max_size = 1
+    cache.evict()
+    assert len(os.listdir(tmp_path / 'catalog')) == 0
+
+
+def test_query_cache_default(tmp_path, monkeypatch):
+    """
+    Caching is opt-in
+    """
+    from frb.surveys import query_cache, surveycoord
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    monkeypatch.delenv('FRB_SURVEY_CACHE', raising=False)
+    monkeypatch.setattr(query_cache, '_default_cache', None)
+    coord = SkyCoord(ra=150., dec=2., unit='deg')
+    assert surveycoord.SurveyCoord(coord, 10*units.arcsec).cache is None
+    monkeypatch.setenv('FRB_SURVEY_CACHE', '1')
+    cache = surveycoord.SurveyCoord(coord, 10*units.arcsec).cache
+    assert isinstance(cache, query_cache.QueryCache)
+    assert cache.ttl == query_cache.DEFAULT_TTL
+    query_cache.set_default_cache(None)
+    assert surveycoord.SurveyCoord(coord, 10*units.arcsec).cache is None
+
+
+def test_footprints(tmp_path, monkeypatch):
+    """
+    Footprint membership from HEALPix coverage maps
+    """
+    import numpy as np
+    import healpy as hp
+    from astropy.io import fits
+    from frb.surveys import footprints
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(footprints, '_footprints', {})
+
+    # MOC: base cell 4 at order 0, one order-3 cell and an order-12 cell
+    nside = 64
+    fine_pix = hp.ang2pix(4096, 20., -60., nest=True, lonlat=True)
+    uniq = np.array([4*4**0 + 4, 4*4**3 + 5, 4*4**12 + fine_pix])
+    moc_file = str(tmp_path / 'moc.fits')
+    fits.BinTableHDU.from_columns([fits.Column(name='UNIQ', format='K', array=uniq)]).writeto(moc_file)
+    footprint = footprints.build_footprint('DES', moc_file=moc_file, nside=nside)
+    assert footprint.sum() == 4**6 + 4**3 + 1
+    assert footprint[hp.ang2pix(nside, 20., -60., nest=True, lonlat=True)]
+
+    ra = np.random.default_rng(2).uniform(0., 360., 1000)
+    dec = np.random.default_rng(3).uniform(-90., 90., 1000)
+    coords = SkyCoord(ra=ra, dec=dec, unit='deg')
+    inside = survey_utils.is_inside('DES', coords)
+    pix = hp.ang2pix(nside, ra, dec, nest=True, lonlat=True)
+    assert np.array_equal(inside, footprint[pix])
+    assert np.array_equal(inside, (pix // 4**6 == 4) | (pix // 4**3 == 5) |
+                          (pix == fine_pix // 4**6))
+    # Built from source positions
+    footprints.build_footprint('SDSS', coords=coords[:10], nside=nside)
+    assert np.all(survey_utils.is_inside('SDSS', coords[:10]))
+    with pytest.raises(IOError):
+        survey_utils.is_inside('HSC', coords[0], fallback=False)
+    inside = survey_utils.in_which_survey(coords[0], fallback=False)
+    assert sorted(inside.keys()) == ['DES', 'SDSS', 'WISE']
+    assert inside['WISE'] is True and inside['DES'] == bool(footprint[pix[0]])
+
+
+def test_nedlvs_store(tmp_path, monkeypatch):
+    """
+    NED-LVS queries through the memory-mapped store
+    """
+    import numpy as np
+    from astropy.table import MaskedColumn
+    from frb.surveys import nedlvs
+    monkeypatch.setenv('FRB_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(nedlvs, '_stores', {})
+    rng = np.random.default_rng(4)
+    ngal = 20000
+    tbl = Table()
+    tbl['objname'] = ['G{:05d}'.format(ii) for ii in range(ngal)]
+    tbl['ra'] = rng.uniform(0., 360., ngal)
+    tbl['dec'] = np.degrees(np.arcsin(rng.uniform(-1., 1., ngal)))
+    tbl['DistMpc'] = rng.uniform(1., 300., ngal)
+    tbl['Mstar'] = MaskedColumn(rng.uniform(8., 11., ngal), mask=rng.uniform(size=ngal) < 0.2)
+    lvs_file = str(tmp_path / 'lvs.fits')
+    tbl.write(lvs_file)
+    monkeypatch.setenv('NEDLVS', lvs_file)
+
+    coord = SkyCoord(ra=200., dec=-10., unit='deg')
+    lvs = nedlvs.NEDLVS(coord, 1*units.deg)
+    assert nedlvs.NEDLVS(coord, 1*units.deg).store is lvs.store
+    fields = ['objname', 'Mstar', 'phys_sep']
+    close_by = lvs.get_catalog(z_lim=0.05, impact_par_lim=5*units.Mpc, query_fields=fields)
+    # Brute force
+    seps = coord.separation(SkyCoord(tbl['ra'], tbl['dec'], unit='deg'))
+    phys_sep = tbl['DistMpc']*units.Mpc*np.sin(seps.to('rad').value)
+    good = (tbl['DistMpc'] > 2) & (tbl['DistMpc'] < lvs.cosmo.luminosity_distance(0.05).to('Mpc').value) & \
+        (phys_sep < 5*units.Mpc) & (seps < 90*units.deg)
+    assert len(close_by) == good.sum() > 0
+    assert close_by['objname'].tolist() == tbl['objname'][good].tolist()
+    assert np.array_equal(close_by['Mstar'].mask, tbl['Mstar'].mask[good])
+    assert np.allclose(close_by['phys_sep'].to('Mpc').value, phys_sep[good].value)
+    # Wide cone
+    assert len(lvs.get_catalog(ang_sep_lim=120*units.deg, query_fields=['objname'])) == \
+        np.sum((tbl['DistMpc'] > 2) & (seps < 120*units.deg))
+
+
+def test_xmatch_unique():
+    """
+    One-to-one cross-matching and merging of catalogs
+    """
+    import numpy as np
+    from frb.surveys import catalog_utils
+    tab1 = Table()
+    tab1['ra'] = [10., 10., 10.01, 10.02]
+    tab1['dec'] = [-5., -5.+0.5/3600, -5., -5.]
+    tab1['A_r'] = [20., 21., 22., 23.]
+    tab1['flag'] = [1, 2, 3, 4]
+    tab2 = Table()
+    tab2['ra'] = [10.+0.1/3600, 10.03, 10.01]
+    tab2['dec'] = [-5., -5., -5.+0.2/3600]
+    tab2['B_r'] = [19., 18., 17.]
+    tab2['flag'] = [5, 6, 7]
+    # Both first entries of tab1 are near the first of tab2; only the closest matches
+    m1, m2 = catalog_utils.xmatch_catalogs(tab1, tab2, 1*units.arcsec, unique=True)
+    assert m1['A_r'].tolist() == [20., 22.] and m2['B_r'].tolist() == [19., 17.]
+    m1, m2 = catalog_utils.xmatch_catalogs(tab1, tab2, 1*units.arcsec)
+    assert len(m1) == 3
+    idx, d2d = catalog_utils.xmatch_catalogs(tab1, tab2, 1*units.arcsec, unique=True,
+                                             return_match_idx=True)
+    assert idx.tolist() == [0, -1, 2, -1] and np.isnan(d2d[1])
+    assert np.isclose(d2d[2].to('arcsec').value, 0.2)
+
+    merged = catalog_utils.xmatch_and_merge_cats(tab1, tab2)
+    assert merged.colnames == ['ra', 'dec', 'A_r', 'flag_1', 'B_r', 'flag_2']
+    assert merged['flag_1'].tolist() == [1, 3, 2, 4, -999]
+    assert merged['flag_2'].tolist() == [5, 7, -999, -999, 6]
+    assert merged['B_r'][:2].tolist() == [19., 17.]
+
+    # N-way
+    tab3 = Table()
+    tab3['ra'] = [10.03, 10.05]
+    tab3['dec'] = [-5., -5.]
+    tab3['C_r'] = [16., 15.]
+    merged = catalog_utils.xmatch_and_merge_many([tab1, tab2, tab3], table_names=('A', 'B', 'C'))
+    assert merged.colnames == ['ra', 'dec', 'A_r', 'flag_A', 'B_r', 'flag_B', 'C_r']
+    assert len(merged) == 6
+    assert merged['C_r'].tolist() == [-999.]*4 + [16., 15.]
+    assert merged['B_r'].tolist() == [19., -999., 17., -999., 18., -999.]
+    # Same sources as merging one at a time
+    twice = catalog_utils.xmatch_and_merge_cats(catalog_utils.xmatch_and_merge_cats(tab1, tab2), tab3)
+    assert sorted(twice['C_r'].tolist()) == sorted(merged['C_r'].tolist())
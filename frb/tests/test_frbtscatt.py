@@ -61,3 +61,24 @@ def test_ang_broadening():
     assert np.isclose(theta.to('arcsec').value, 9.26810535e-06)
 
 
+def test_turb_arrays():
+    lobs = (const.c/(np.array([0.4, 1., 1.4])*u.GHz)).to('cm')
+    ne = np.array([1e-3, 1e-2, 3e-2])[:,None] / u.cm**3
+    l0 = np.array([1e-3, 1., 100.])[:,None] * u.AU
+    zL = np.array([0.5, 1., 1.5])[:,None]
+    # Lenses x frequencies
+    turb = Turbulence(ne, l0, def_L0, zL, DL=def_DL, lobs=lobs)
+    tau = turb.temporal_smearing(lobs, 2.)
+    assert tau.shape == (3, 3)
+    assert set(np.unique(turb.regime)) == {1, 2}
+    for ii in range(3):
+        for jj in range(3):
+            turb1 = Turbulence(ne[ii,0], l0[ii,0], def_L0, zL[ii,0], DL=def_DL, lobs=lobs[jj])
+            assert turb1.regime == turb.regime[ii,jj]
+            assert np.isclose(turb1.temporal_smearing(lobs[jj], 2.).value, tau[ii,jj].value, rtol=1e-6)
+    # Many lenses use the tabulated distances
+    zL = np.linspace(0.1, 1.9, 20000)
+    turb = Turbulence(def_ne, def_l0, def_L0, zL, DL=def_DL, lobs=lobs[1])
+    theta = turb.angular_broadening(lobs[1], 2.)
+    turb1 = Turbulence(def_ne, def_l0, def_L0, zL[123], DL=def_DL, lobs=lobs[1])
+    assert np.isclose(turb1.angular_broadening(lobs[1], 2.).value, theta[123].value, rtol=1e-6)
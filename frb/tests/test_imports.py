@@ -0,0 +1,31 @@
+# Module to check the cost of importing the FRB repo
+from __future__ import print_function, absolute_import, division, unicode_literals
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Wall-clock budget (s) for importing any one module in a fresh interpreter
+import_budget = float(os.environ.get('FRB_IMPORT_BUDGET', 10.))
+
+top_modules = ['frb', 'frb.frb', 'frb.mw', 'frb.dm.igm', 'frb.halos.models',
+               'frb.halos.hmf']
+
+
+def _import_time(module):
+    code = ("import sys, time; t0 = time.perf_counter(); import {}; "
+            "print(time.perf_counter()-t0); print('hmf_emulator' in sys.modules)").format(module)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         check=True)
+    dt, emulator = out.stdout.split()[-2:]
+    return float(dt), emulator == 'True'
+
+
+@pytest.mark.parametrize('module', top_modules)
+def test_import_time(module):
+    dt, emulator = _import_time(module)
+    # The halo mass function emulator is only built on first use
+    assert not emulator
+    assert dt < import_budget, '{} took {:.2f}s to import'.format(module, dt)
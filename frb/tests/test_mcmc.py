@@ -53,6 +53,19 @@ def test_pdf():
     Delta = np.random.uniform(low=0.7, high=1.5, size=nFRB)
     PDF_Cosmic = mcmc.mcquinn_DM_PDF_grid(Delta, C0, sigma)
 
+def test_C0():
+    # Solution gives <Delta> = 1
+    sigmas = np.array([0.05, 0.5, 5.])
+    C0s = cosmic.solve_C0(sigmas, np.array([3., 4.]))
+    assert C0s.shape == (2, 3)
+    assert np.allclose(cosmic.avg_Delta(C0s, sigmas[None,:], np.array([3., 4.])[:,None]), 1.)
+    # Table for other beta values
+    f_C0 = cosmic.grab_C0_spline(beta=4.)
+    assert np.allclose(f_C0(sigmas), C0s[1], rtol=1e-4)
+    with pytest.raises(IOError):
+        cosmic.grab_C0_spline(beta=10.)
+
+
 def test_allprob():
     F=0.32
     # All
@@ -72,6 +85,55 @@ def test_allprob():
     assert np.isclose(like, ln_like)
 
 
+def test_likelihood():
+    F=0.32
+    like_engine = mcmc.MacquartLikelihood(mcmc.frb_DMs, mcmc.frb_zs)
+    # Compare to all_prob
+    like = mcmc.all_prob(mcmc.cosmo_Obh70, F, None, mcmc.frb_zs,
+                         mu=120., lognorm_s=0.8)
+    assert np.isclose(like_engine(mcmc.cosmo_Obh70, F, mu=120., lognorm_s=0.8), like)
+    # And one by one
+    probs = like_engine.prob(mcmc.cosmo_Obh70*1.1, F)
+    for kk, frb in enumerate(mcmc.frbs):
+        prob = mcmc.one_prob(mcmc.cosmo_Obh70*1.1, F,
+                            frb.DM.value - frb.DMISM.value, frb.z,
+                            beta=3.)
+        assert np.isclose(probs[kk], prob)
+
+
+def _gauss_log_prob(theta):
+    return -0.5 * np.sum(theta**2)
+
+
+def test_ensemble_sample(tmp_path):
+    rng = np.random.default_rng(1234)
+    p0 = rng.normal(size=(16, 2))
+    sdict = mcmc.ensemble_sample(_gauss_log_prob, p0, 500, seed=1)
+    assert sdict['chain'].shape == (500, 16, 2)
+    samples = sdict['chain'][100:].reshape(-1, 2)
+    assert np.all(np.abs(np.mean(samples, axis=0)) < 0.2)
+    assert np.all(np.abs(np.std(samples, axis=0) - 1.) < 0.2)
+    assert np.all(sdict['acceptance_fraction'] > 0.2)
+
+    # Checkpoint and resume
+    outfile = str(tmp_path / 'chain.npz')
+    mcmc.ensemble_sample(_gauss_log_prob, p0, 20, seed=1, outfile=outfile,
+                         checkpoint_every=5)
+    sdict2 = mcmc.ensemble_sample(_gauss_log_prob, p0, 40, seed=1, outfile=outfile,
+                                  resume=True)
+    sdict3 = mcmc.ensemble_sample(_gauss_log_prob, p0, 40, seed=1)
+    assert np.array_equal(sdict2['chain'], sdict3['chain'])
+    assert np.load(outfile)['chain'].shape == (40, 16, 2)
+
+
+def test_four_parameter_mcmc():
+    sdict = mcmc.run_four_parameter_mcmc(mcmc.frb_DMs, mcmc.frb_zs, 5,
+                                         nwalkers=8, seed=2)
+    assert sdict['chain'].shape == (5, 8, 4)
+    assert np.all(np.isfinite(sdict['log_prob']))
+    assert sdict['parm_names'][0] == 'Obh70'
+
+
 @pm_required
 def test_pm():
     # This takes 5min to run
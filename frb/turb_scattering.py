@@ -7,6 +7,7 @@ from __future__ import print_function, absolute_import, division, unicode_litera
 import numpy as np
 
 from scipy.special import gamma
+from scipy.interpolate import InterpolatedUnivariateSpline as IUS
 
 from astropy import constants
 from astropy import units
@@ -215,11 +216,41 @@ def ne_from_tau_kolmogorov(tau_scatt, z_FRB, zL, nu_obs, L=50*units.kpc, L0=1*un
 
     return n_e / units.cm**3
 
+def _angular_diameter_distances(zL, zsource, cosmo=defs.frb_cosmo, ngrid=10000):
+    """ Angular diameter distances to the lens, to the source and between them
+
+    For many redshifts in a flat cosmology the comoving distance
+    is interpolated from a table instead of integrated for each one.
+
+    Args:
+        zL (float or np.ndarray): Lens redshift(s)
+        zsource (float or np.ndarray): Source redshift(s);  broadcast with zL
+        cosmo (Cosmology, optional):
+        ngrid (int, optional): Size of the comoving distance table
+
+    Returns:
+        tuple: D_L, D_S, D_LS (Quantity)
+    """
+    zL, zsource = np.broadcast_arrays(np.asarray(zL, dtype=float), np.asarray(zsource, dtype=float))
+    if zL.size <= ngrid or cosmo.Ok0 != 0.:
+        return (cosmo.angular_diameter_distance(zL), cosmo.angular_diameter_distance(zsource),
+                cosmo.angular_diameter_distance_z1z2(zL, zsource))
+    # A cubic spline on this grid is accurate to ~1e-11 (relative) for z < 5
+    zgrid = np.linspace(0., max(np.max(zL), np.max(zsource), 1e-3), ngrid)
+    DM_spline = IUS(zgrid, cosmo.comoving_distance(zgrid).to('Mpc').value)
+    DM_L, DM_S = DM_spline(zL), DM_spline(zsource)
+    return (DM_L/(1+zL)*units.Mpc, DM_S/(1+zsource)*units.Mpc,
+            (DM_S-DM_L)/(1+zsource)*units.Mpc)
+
+
 class Turbulence(object):
     """ Class for turbulence calculations in a plasma
     Primarily used for scattering calculations
+
+    ne, l0, L0, zL, DL and lobs may be arrays that broadcast
+    together, e.g. for a population of lenses and frequencies
     """
-    def __init__(self, ne, l0, L0, zL, beta=11./3, SM=None, verbose=True, **kwargs):
+    def __init__(self, ne, l0, L0, zL, beta=11./3, SM=None, verbose=False, **kwargs):
         """
         Parameters
         ----------
@@ -231,10 +262,12 @@ class Turbulence(object):
           Outer scale
         SM : Quantity, optional
           Generally calculated but can be input
-        zL : float
+        zL : float or ndarray
           Redshift of scattering medium
         beta : float, optional
           Exponent of turbulence.  Default is for Kolmogorov
+        verbose : bool, optional
+          Report the scattering regime
         **kwargs :
           Passed to init methods
           e.g. sets SM if DL is provided
@@ -307,8 +340,6 @@ class Turbulence(object):
 
         """
         self.SM = (self.CN2_gal * DL).decompose()
-        if self.verbose:
-            print("Set SM={}".format(self.SM.decompose()))
 
     def set_cloudlet_rdiff(self, lobs, fa):
         """
@@ -336,6 +367,8 @@ class Turbulence(object):
         Returns
         -------
         Nothing;  sets self.rdiff and self.regime
+          regime is 1 where rdiff < l0 and 2 otherwise
+          (rdiff >> l0, or the undefined rdiff >~ l0)
         
         """
         # Check
@@ -344,27 +377,24 @@ class Turbulence(object):
         # Useful expression
         C = (np.pi*const_re**2 * lobs**2)/(1+self.zL)**2
         # Is rdiff < l0?
-        r1 = 1. / np.sqrt(C * self.SM * (self.l0**(self.beta-4.) * (self.beta/4.) *
-          gamma(-self.beta/2.)))
+        r1 = (1. / np.sqrt(C * self.SM * (self.l0**(self.beta-4.) * (self.beta/4.) *
+          gamma(-self.beta/2.)))).to('m')
         # Is rdiff >> l0?
         r2 = np.power(2**(2-self.beta) * C * self.beta * self.SM * gamma(-self.beta/2.) /
-          gamma(self.beta/2.), 1./(2-self.beta))
+          gamma(self.beta/2.), 1./(2-self.beta)).to('m')
         # Query
-        if r1 < self.l0:
-            if self.verbose:
-                print('In the regime rdiff < l_0')
-            self.rdiff = r1.to('m')
-            self.regime = 1  # rdiff < l0
-        elif r2 > 10*self.l0:
-            if self.verbose:
-                print('In the regime rdiff >> l_0')
-            self.rdiff = r2.to('m')
-            self.regime = 2  # rdiff >> l0
-        else: # Undefined
-            if self.verbose:
-                print('In the regime rdiff >~ l_0.  Be careful here!')
-            self.rdiff = r2.to('m')
-            self.regime = 2  # rdiff >> l0
+        small = r1 < self.l0
+        self.rdiff = np.where(small, r1.value, r2.value) * units.m
+        self.regime = np.where(small, 1, 2)
+        if self.regime.ndim == 0:
+            self.rdiff = self.rdiff[()]
+            self.regime = int(self.regime)
+        if self.verbose:
+            n_undefined = np.sum(~small & ~(r2 > 10*self.l0))
+            print('In the regime rdiff < l_0: {}, rdiff >> l_0: {}, rdiff >~ l_0: {}'.format(
+                np.sum(small), np.sum(~small) - n_undefined, n_undefined))
+            if n_undefined > 0:
+                print('Be careful with rdiff >~ l_0')
 
     def angular_broadening(self, lobs, zsource, cosmo=defs.frb_cosmo):
         """ Broadening of a point source due to turbulent scattering
@@ -373,7 +403,7 @@ class Turbulence(object):
         ----------
         lobs : Quantity
           Observed wavelength
-        zsource : float
+        zsource : float or ndarray
           Redshift of radio source
 
         Returns
@@ -381,19 +411,16 @@ class Turbulence(object):
         theta : Quantity
           Angular broadening.  Radius (half-width at half-max)
         """
-        if self.regime == 0:
+        if np.any(self.regime == 0):
             raise ValueError("Need to set rdiff and the regime first!")
         # f
-        if (self.regime == 1) or np.isclose(self.beta,4.):
-            f = 1.18
-        elif (self.regime == 2) and np.isclose(self.beta, 11/3.):
-            f = 1.01
+        f = np.where((self.regime == 1) | np.isclose(self.beta, 4.), 1.18,
+                     np.where(np.isclose(self.beta, 11/3.), 1.01, np.nan))
+        if np.any(np.isnan(f)):
+            raise ValueError("rdiff >> l0 is only coded for beta=11/3 or 4")
         # Distances
-        D_S = cosmo.angular_diameter_distance(zsource)
-        D_LS = cosmo.angular_diameter_distance_z1z2(self.zL, zsource)
-        if self.verbose:
-            print("D_LS={}, D_S={}".format(D_LS, D_S))
-        D_LS_D_S = D_LS/D_S
+        _, D_S, D_LS = _angular_diameter_distances(self.zL, zsource, cosmo=cosmo)
+        D_LS_D_S = (D_LS/D_S).decompose().value
 
         # Evaluate
         k = 2*np.pi / (lobs / (1+self.zL))  # Are we sure about this (1+z) factor?!
@@ -408,7 +435,7 @@ class Turbulence(object):
         ----------
         lobs : Quantity
           Observed wavelength
-        zsource : float
+        zsource : float or ndarray
         cosmo : astropy.cosmology, optional
 
         Returns
@@ -416,9 +443,7 @@ class Turbulence(object):
         tau : Quantity
           temporal broadening
         """
-        D_S = cosmo.angular_diameter_distance(zsource)
-        D_L = cosmo.angular_diameter_distance(self.zL)
-        D_LS = cosmo.angular_diameter_distance_z1z2(self.zL, zsource)
+        D_L, D_S, D_LS = _angular_diameter_distances(self.zL, zsource, cosmo=cosmo)
         # Angular
         theta = self.angular_broadening(lobs, zsource, cosmo=cosmo)
         # Calculate
@@ -431,14 +456,13 @@ class Turbulence(object):
         txt = '<{:s}'.format(self.__class__.__name__)
         #
         txt = txt + ' ne={},'.format(self.ne.to('cm**-3'))
-        txt = txt + ' l0={:.3E},'.format(self.l0.to('pc'))
+        if self.l0.isscalar:
+            txt = txt + ' l0={:.3E},'.format(self.l0.to('pc'))
+        else:
+            txt = txt + ' l0={},'.format(self.l0.to('pc'))
         txt = txt + ' L0={},'.format(self.L0.to('pc'))
         txt = txt + ' beta={},'.format(self.beta)
         txt = txt + ' zL={}'.format(self.zL)
         #txt = txt + ' SMeff={}'.format(self.SMeff)
         txt = txt + '>'
         return (txt)
-
-
-
-